@@ -4,14 +4,8 @@
 
 # app/app_streamlit.py
 import streamlit as st
-import pandas as pd
-import joblib
 import os
 import sys
-import json
-import datetime
-import hashlib
-from fpdf import FPDF
 
 # ========== PATH CONFIG ==========
 ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -20,26 +14,34 @@ if ROOT not in sys.path:
 
 try:
     import core_utils as cu
+    import inference
+    import storage
+    import reports
+    import metrics
+    import medicine_search
+    import chat_assistant
+    import export
+    from app import handlers
 except Exception:
-    st.error("⚠️ Missing 'core_utils.py' in project root. Please add it and restart.")
+    st.error("⚠️ Missing 'core_utils.py' or the model modules in project root. Please add them and restart.")
     st.stop()
 
 st.set_page_config(page_title="Health Dashboard", layout="wide", initial_sidebar_state="expanded")
 
-MODEL_DIR = os.path.join(ROOT, "models")
-RF_PATH = os.path.join(MODEL_DIR, "rf_model.joblib")
-DT_PATH = os.path.join(MODEL_DIR, "dt_model.joblib")
-FEATURES_PATH = os.path.join(MODEL_DIR, "model_features.joblib")
-USERS_FILE = os.path.join(ROOT, "users.json")
-REPORTS_DIR = os.path.join(ROOT, "reports")
+# Users, history and feedback live in SQLite (health.db); a legacy users.json
+# and feedback.txt are imported once on first start.
+storage.init_db()
+# Reports live in reports/<user>/; `python reports.py compact` moves flat
+# files from older versions there.
 
-if not os.path.exists(USERS_FILE):
-    with open(USERS_FILE, "w") as f:
-        json.dump({}, f)
+# Stage timings (see metrics.py); HEALTH_METRICS_PORT / HEALTH_METRICS_FILE
+# expose them, HEALTH_PROFILE_SLOWEST keeps cProfile dumps of slow requests.
+metrics.setup()
 
-rf_model = joblib.load(RF_PATH)
-dt_model = joblib.load(DT_PATH)
-model_features = joblib.load(FEATURES_PATH)
+# Models are loaded lazily through model_registry (via inference), which keeps
+# them cached across reruns and sessions and reloads only when an artifact changes.
+# With HEALTH_INFERENCE_URL set, predictions come from inference_service.py instead.
+INFERENCE_URL = os.environ.get("HEALTH_INFERENCE_URL")
 
 SYMPTOMS = cu.SYMPTOMS
 NUMERIC_FEATURES = cu.NUMERIC_FEATURES
@@ -47,49 +49,92 @@ CATEGORICAL_FEATURES = cu.CATEGORICAL_FEATURES
 RECOMMENDATIONS = cu.RECOMMENDATIONS
 
 # ========== UTILS ==========
-def load_users():
-    with open(USERS_FILE, "r") as f:
-        return json.load(f)
-
-def save_users(users):
-    with open(USERS_FILE, "w") as f:
-        json.dump(users, f, indent=4)
-
-def hash_password(p): 
-    return hashlib.sha256(p.encode()).hexdigest()
-
-def generate_pdf(username, prediction, vitals, symptoms, model_name, recommendations, out_path):
-    pdf = FPDF()
-    pdf.add_page()
-    pdf.set_font("Arial", "B", 16)
-    pdf.cell(0, 10, "Smart Health Diagnosis Report", ln=True, align="C")
-    pdf.set_font("Arial", size=12)
-    pdf.cell(0, 8, f"User: {username}", ln=True)
-    pdf.cell(0, 8, f"Date: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", ln=True)
-    pdf.ln(6)
-    pdf.set_font("Arial", "B", 12)
-    pdf.cell(0, 8, f"Predicted Disease: {prediction}", ln=True)
-    pdf.cell(0, 8, f"Model Used: {model_name}", ln=True)
-    pdf.ln(6)
-    pdf.set_font("Arial", "B", 12)
-    pdf.cell(0, 8, "Vitals:", ln=True)
-    pdf.set_font("Arial", size=11)
-    for k, v in vitals.items():
-        pdf.cell(0, 7, f"- {k}: {v}", ln=True)
-    pdf.ln(4)
-    pdf.set_font("Arial", "B", 12)
-    pdf.cell(0, 8, "Symptoms:", ln=True)
-    pdf.set_font("Arial", size=11)
-    pdf.multi_cell(0, 7, ", ".join(symptoms) if symptoms else "None")
-    pdf.ln(4)
-    pdf.set_font("Arial", "B", 12)
-    pdf.cell(0, 8, "Recommendations:", ln=True)
-    pdf.set_font("Arial", size=11)
-    for r in recommendations:
-        pdf.multi_cell(0, 7, f"- {r}")
-    os.makedirs(os.path.dirname(out_path), exist_ok=True)
-    pdf.output(out_path)
-    return out_path
+def predict_all(data, explain_model=None):
+    """Both models' predictions, from the inference service when configured
+    (which then also explains explain_model's prediction)."""
+    if INFERENCE_URL:
+        import inference_service
+        try:
+            return inference_service.predict_remote(INFERENCE_URL, data, explain_model)
+        except OSError:
+            st.caption("Inference service unreachable; predicting locally.")
+    return inference.predict_all(data)
+
+def load_older_history():
+    """Append the next page of older records (cursor: id of the oldest shown)."""
+    hist = st.session_state.history
+    hist += handlers.history_page(st.session_state.username, before_id=hist[-1]["id"])[0]
+
+@st.fragment(run_every=1)
+def wait_for_report(report_key):
+    """Poll while the report renders, then rerun the page once to show the button."""
+    try:
+        ready = reports.get_report(report_key) is not None
+    except Exception:
+        ready = True  # finished with an error or no longer tracked; report_download() decides
+    if ready:
+        st.rerun(scope="app")
+    st.info("📄 Preparing your diagnosis report…")
+
+def report_download(report_key):
+    """Download button for the background report; only polls while it is pending."""
+    try:
+        report = reports.get_report(report_key)
+    except KeyError:
+        return
+    except Exception:
+        st.warning("📄 The report could not be generated.")
+        return
+    if report is None:
+        wait_for_report(report_key)
+        return
+    file_name, pdf_bytes = report
+    st.download_button(
+        label="📄 Download Diagnosis Report",
+        data=pdf_bytes,
+        file_name=file_name,
+        mime="application/pdf",
+        key="download_pdf"
+    )
+
+def show_diagnosis(out):
+    """Render a handlers.diagnose() result (plus the model it was asked for)."""
+    pred, result, why = out["prediction"], out["result"], out["why"]
+    st.success(f"✅ Predicted Disease: **{pred}**")
+
+    model_cols = st.columns(len(result["models"]))
+    for col, (name, res) in zip(model_cols, result["models"].items()):
+        col.markdown(f"**{name}**")
+        for disease, p in res["top_k"]:
+            col.write(f"{disease}: {p:.0%}")
+    if result["agree"]:
+        st.caption("Both models agree.")
+    else:
+        st.warning("The models disagree; treat this prediction with extra caution.")
+    if result.get("source") == "index":
+        st.caption("Answered from the precomputed index; percentages are for the nearest vitals bucket.")
+
+    with st.expander(f"Why {pred}?"):
+        # Index answers are explained only on request (the live model is walked).
+        if why is None and st.button("Explain this prediction", key="explain_btn"):
+            why = out["why"] = handlers.explain_diagnosis(out, out["model"])
+        if why is not None:
+            if result.get("source") == "index":
+                st.caption("Computed by the live model for your exact vitals, so the total can differ "
+                           "from the bucket percentages above.")
+            st.caption(f"Starting from {why['bias']:.0%} (how common {pred} is in the training data), "
+                       f"each input moved the {out['model']} probability by:")
+            for feature, value, delta in why["features"]:
+                shown = ("yes" if value else "no") if feature in SYMPTOMS else value
+                st.write(f"- {feature.replace('_', ' ').title()} = {shown}: {delta:+.0%}")
+
+    for alert in out["alerts"]:
+        st.error(alert)
+
+    st.subheader("💡 Health Recommendations:")
+    for r in out["recommendations"]:
+        st.write(f"- {r}")
+    report_download(out["report_key"])
 
 # ========== STYLE ==========
 st.markdown("""
@@ -160,27 +205,20 @@ with st.sidebar:
             su_pwd = st.text_input("Password", type="password")
             su_pwd2 = st.text_input("Confirm Password", type="password")
             if st.button("Create Account"):
-                users = load_users()
-                if not su_user.strip() or not su_pwd:
-                    st.error("Username and password required.")
-                elif su_user in users:
-                    st.error("Username already exists.")
-                elif su_pwd != su_pwd2:
-                    st.error("Passwords do not match.")
-                else:
-                    users[su_user] = {"password": hash_password(su_pwd), "email": su_email, "history": []}
-                    save_users(users)
-                    st.success("✅ Account created! Switch to Login to continue.")
+                with metrics.request("signup"):
+                    created, message = handlers.signup(su_user, su_pwd, su_pwd2, su_email)
+                (st.success if created else st.error)(message)
         else:
             li_user = st.text_input("Username")
             li_pwd = st.text_input("Password", type="password")
             if st.button("Login"):
-                users = load_users()
-                if li_user in users and users[li_user]["password"] == hash_password(li_pwd):
+                with metrics.request("login"):
+                    ok = handlers.login(li_user, li_pwd)
+                if ok:
                     st.session_state.logged_in = True
                     st.session_state.username = li_user
                     st.session_state.page = "home"
-                    st.experimental_rerun()
+                    st.rerun()
                 else:
                     st.error("Invalid username or password.")
     else:
@@ -188,7 +226,9 @@ with st.sidebar:
         if st.button("Logout"):
             st.session_state.logged_in = False
             st.session_state.username = ""
-            st.experimental_rerun()
+            st.session_state.pop("history", None)
+            st.session_state.pop("diagnosis", None)
+            st.rerun()
 
 # ========== PUBLIC VIEW ==========
 if not st.session_state.logged_in:
@@ -228,6 +268,7 @@ for i, (icon, label, page) in enumerate(nav_items):
     with nav_cols[i]:
         if st.button(f"{icon} {label}", key=f"nav_{page}"):
             st.session_state.page = page
+            st.session_state.pop("history", None)  # History reopens at the newest page
 
 # ========== PAGE CONTENT ==========
 page = st.session_state.page
@@ -263,115 +304,118 @@ elif page == "diagnosis":
             selected.append(sym)
 
     # ---- MODEL ----
-    model_choice = st.radio("Select Model", ["Random Forest", "Decision Tree"], key="model_choice")
-    model = rf_model if model_choice == "Random Forest" else dt_model
+    model_choice = st.radio("Primary Model", ["Random Forest", "Decision Tree"], key="model_choice")
 
     # ---- PREDICT ----
+    # The last result is kept in session state, so reruns (the report
+    # becoming ready, the download button) show it again without predicting.
     if st.button("Predict", key="predict_btn"):
         try:
-            # Collect all data
-            data = {
-                "age": age,
-                "temp_c": temp_c,
-                "heart_rate": heart_rate,
-                "spo2": spo2,
-                "gender": gender
-            }
-            for s in SYMPTOMS:
-                data[s] = 1 if s in selected else 0
-
-            # Reorder columns to match model
-            df = pd.DataFrame([data])[model_features]
-            pred = model.predict(df)[0]
-
-            # ---- Show results ----
-            st.success(f"✅ Predicted Disease: **{pred}**")
-
-            recs = RECOMMENDATIONS.get(pred, ["Consult a doctor for confirmation."])
-            st.subheader("💡 Health Recommendations:")
-            for r in recs:
-                st.write(f"- {r}")
-
-            # ---- Save to user history ----
-            users = load_users()
-            user = users.get(st.session_state.username, {})
-            user.setdefault("history", []).append({
-                "timestamp": str(datetime.datetime.now()),
-                "prediction": pred,
-                "symptoms": selected,
-                "model": model_choice,
-                "vitals": data
-            })
-            users[st.session_state.username] = user
-            save_users(users)
-
-            # ---- Generate PDF ----
-            os.makedirs(REPORTS_DIR, exist_ok=True)
-            pdf_path = os.path.join(
-                REPORTS_DIR, 
-                f"{st.session_state.username}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
-            )
-
-            generate_pdf(
-                username=st.session_state.username,
-                prediction=pred,
-                vitals=data,
-                symptoms=selected,
-                model_name=model_choice,
-                recommendations=recs,
-                out_path=pdf_path
-            )
-
-            # ---- Download Button ----
-            with open(pdf_path, "rb") as pdf_file:
-                st.download_button(
-                    label="📄 Download Diagnosis Report",
-                    data=pdf_file,
-                    file_name=os.path.basename(pdf_path),
-                    mime="application/pdf",
-                    key="download_pdf"
-                )
-
+            with metrics.request("diagnosis"):
+                vitals = {"age": age, "temp_c": temp_c, "heart_rate": heart_rate, "spo2": spo2, "gender": gender}
+                # Predict, explain, save to history and queue the PDF report
+                out = handlers.diagnose(st.session_state.username, vitals, selected, model_choice,
+                                        lambda data: predict_all(data, model_choice))
+                st.session_state.diagnosis = {**out, "model": model_choice}
+                with metrics.timed("diagnosis.render"):
+                    show_diagnosis(st.session_state.diagnosis)
         except Exception as e:
+            st.session_state.pop("diagnosis", None)
             st.error(f"Prediction Error: {e}")
+    elif "diagnosis" in st.session_state:
+        show_diagnosis(st.session_state.diagnosis)
 
 
 elif page == "medicine":
     st.header("💊 Medicine Search")
-    query = st.text_input("Enter a symptom or condition:")
-    if st.button("Search"):
-        meds = {"fever": ["Paracetamol"], "cold": ["Cetirizine"], "cough": ["Dextromethorphan"]}
-        for m in meds.get(query.lower(), ["No medicine found."]):
-            st.write(f"- {m}")
+    query = st.text_input("Enter a medicine, symptom or condition:")
+    if st.button("Search") or query:
+        with metrics.request("medicine_search"):
+            results = medicine_search.search(query)
+            if not results:
+                st.write("No medicine found.")
+            for m in results:
+                rx = " · prescription only" if m["rx"] == "Rx" else ""
+                st.write(f"- **{m['name']}** ({m['generic']}){rx}: {', '.join(m['indications'])}")
+            if results:
+                st.caption("For information only; ask a pharmacist or doctor before taking any medicine.")
 
 elif page == "profile":
     st.header("👤 My Profile")
-    users = load_users()
-    u = users.get(st.session_state.username, {})
-    st.write(f"**Username:** {st.session_state.username}")
-    st.write(f"**Email:** {u.get('email', 'Not provided')}")
-    st.write(f"**Total Predictions:** {len(u.get('history', []))}")
+    with metrics.request("profile"):
+        with metrics.timed("profile.load"):
+            u = storage.get_user(st.session_state.username) or {}
+            stats = storage.get_stats(st.session_state.username)
+        st.write(f"**Username:** {st.session_state.username}")
+        st.write(f"**Email:** {u.get('email', 'Not provided')}")
+        st.write(f"**Total Predictions:** {stats['total']}")
+        if stats["total"]:
+            top = ", ".join(f"{d} ({n})" for d, n in list(stats["diseases"].items())[:3])
+            st.write(f"**Most Frequent:** {top}")
+            st.write(f"**Last Prediction:** {stats['last_prediction']} on {stats['last_timestamp']}")
+            v = stats["last_vitals"]
+            if v:
+                st.write(f"**Last Vitals:** age {v.get('age')}, {v.get('temp_c')} °C, "
+                         f"{v.get('heart_rate')} bpm, SpO₂ {v.get('spo2')}%")
+
+        # Streamed by export.py serve when HEALTH_EXPORT_URL is set; otherwise
+        # built in memory when asked for, only up to export.INLINE_MAX_BYTES.
+        user = st.session_state.username
+        label = "📦 Download all my reports and history (.zip)"
+        too_large = ("📦 Your reports are too large to download here. "
+                     "Ask the administrator to enable exports (HEALTH_EXPORT_URL).")
+        if export.EXPORT_URL:
+            st.link_button(label, export.signed_url(export.EXPORT_URL, user))
+        elif export.estimated_bytes(user) > export.INLINE_MAX_BYTES:
+            st.info(too_large)
+        elif st.button("📦 Prepare my reports and history (.zip)", key="export_prepare"):
+            try:
+                data = export.bounded_bytes(export.iter_reports_zip(user))
+            except export.TooLarge:
+                st.info(too_large)
+            else:
+                st.download_button(
+                    label=label,
+                    data=data,
+                    file_name=f"{user}_reports.zip",
+                    mime="application/zip",
+                    key="export_zip",
+                )
 
 elif page == "chat":
     st.header("🤖 AI Health Assistant")
     q = st.text_area("Ask something:")
     if st.button("Ask"):
-        if "fever" in q.lower():
-            st.write("It might be a viral fever. Drink fluids and rest.")
-        else:
-            st.write("Consult a doctor for accurate diagnosis.")
+        with metrics.request("chat"):
+            passages = chat_assistant.answer(q)
+            if not passages:
+                st.write(chat_assistant.FALLBACK)
+            for p in passages:
+                st.write(p["text"])
+                st.caption(f"{p['title']} · {p['source']}")
+            if passages:
+                st.caption("General information only; consult a doctor for an accurate diagnosis.")
 
 elif page == "history":
     st.header("📜 Prediction History")
-    users = load_users()
-    hist = users.get(st.session_state.username, {}).get("history", [])
-    if hist:
-        for rec in reversed(hist[-10:]):
-            st.write(f"🕒 {rec['timestamp']} → **{rec['prediction']}** ({rec['model']})")
-            st.write(f"Symptoms: {', '.join(rec['symptoms'])}")
-            st.markdown("---")
-    else:
-        st.info("No records yet.")
+    with metrics.request("history"):
+        if "history" not in st.session_state:
+            st.session_state.history, total = handlers.history_page(st.session_state.username)
+        else:
+            with metrics.timed("history.load"):
+                total = storage.count_history(st.session_state.username)
+        hist = st.session_state.history
+        with metrics.timed("history.render"):
+            if hist:
+                for rec in hist:
+                    st.write(f"🕒 {rec['timestamp']} → **{rec['prediction']}** ({rec['model']})")
+                    st.write(f"Symptoms: {', '.join(rec['symptoms'])}")
+                    st.markdown("---")
+                st.caption(f"Showing {len(hist)} of {total} records.")
+                if len(hist) < total:
+                    st.button("Load older", key="history_older", on_click=load_older_history)
+            else:
+                st.info("No records yet.")
 # ---------- FEEDBACK ----------
 elif page == "feedback":
     st.header("💬 Feedback")
@@ -380,31 +424,23 @@ elif page == "feedback":
     feedback_text = st.text_area("Your Feedback:", key="feedback_input", placeholder="Type your feedback here...")
     
     if st.button("Submit Feedback", key="submit_feedback"):
-        if feedback_text.strip() == "":
-            st.warning("⚠️ Please enter feedback before submitting.")
-        else:
-            feedback_entry = f"{datetime.datetime.now()} - {st.session_state.username}: {feedback_text}\n"
-            feedback_path = os.path.join(ROOT, "feedback.txt")
-            
-            with open(feedback_path, "a", encoding="utf-8") as f:
-                f.write(feedback_entry)
-            
+        with metrics.request("feedback_submit"):
+            saved = handlers.submit_feedback(st.session_state.username, feedback_text)
+        if saved:
             st.success("✅ Thank you for your valuable feedback!")
+        else:
+            st.warning("⚠️ Please enter feedback before submitting.")
 
     # Optionally show recent feedbacks for logged-in user
     st.subheader("📝 Your Recent Feedback")
-    feedback_path = os.path.join(ROOT, "feedback.txt")
-    if os.path.exists(feedback_path):
-        with open(feedback_path, "r", encoding="utf-8") as f:
-            lines = [line.strip() for line in f.readlines() if st.session_state.username in line]
-            recent = lines[-5:] if lines else []
+    with metrics.request("feedback"):
+        recent = handlers.recent_feedback(st.session_state.username)
+        with metrics.timed("feedback.render"):
             if recent:
-                for fb in reversed(recent):
-                    st.write(f"💭 {fb}")
+                for fb in recent:
+                    st.write(f"💭 {fb['timestamp']} - {st.session_state.username}: {fb['text']}")
             else:
                 st.info("No feedback submitted yet.")
-    else:
-        st.info("No feedback file found yet.")
 
 
 st.markdown("---")
@@ -0,0 +1,138 @@
+# app/handlers.py
+# Request logic of the app's pages, without any Streamlit calls.
+#
+# app_streamlit.py renders what these return; loadgen.py calls them from
+# many threads at once, the way Streamlit runs each session's script in its
+# own thread of one server process. Stages are timed with metrics.timed();
+# callers wrap each call in metrics.request().
+
+import hashlib
+
+import explain
+import inference
+import metrics
+import reports
+import storage
+from app.utils import simple_rule_flags
+from core_utils import RECOMMENDATIONS, SYMPTOMS
+
+HISTORY_PAGE = 10
+DEFAULT_RECOMMENDATION = "Consult a doctor for confirmation."
+
+
+def hash_password(p):
+    return hashlib.sha256(p.encode()).hexdigest()
+
+
+# -------------------------------
+# Accounts
+# -------------------------------
+def signup(username, password, confirm, email=""):
+    """Returns (created, message)."""
+    if not username.strip() or not password:
+        return False, "Username and password required."
+    if password != confirm:
+        return False, "Passwords do not match."
+    with metrics.timed("signup.create_user"):
+        created = storage.create_user(username, hash_password(password), email)
+    if not created:
+        return False, "Username already exists."
+    return True, "✅ Account created! Switch to Login to continue."
+
+
+def login(username, password):
+    with metrics.timed("login.get_user"):
+        user = storage.get_user(username)
+    with metrics.timed("login.verify"):
+        return user is not None and user["password"] == hash_password(password)
+
+
+# -------------------------------
+# Diagnosis
+# -------------------------------
+def collect_features(vitals, selected):
+    """Model input: the vitals dict plus a 0/1 flag per symptom."""
+    data = dict(vitals)
+    for s in SYMPTOMS:
+        data[s] = 1 if s in selected else 0
+    return data
+
+
+def diagnose(username, vitals, selected, model_choice, predict=inference.predict_all, timestamp=None):
+    """Predict, explain, save to history and queue the PDF report.
+
+    Returns {"data", "prediction", "result", "why", "recommendations",
+    "alerts", "report_key"}. "why" is None for answers from the lookup index;
+    explain_diagnosis() computes it when it is asked for.
+    """
+    with metrics.timed("diagnosis.features"):
+        data = collect_features(vitals, selected)
+    with metrics.timed("diagnosis.predict"):
+        result = predict(data)
+    pred = result["models"][model_choice]["prediction"]
+    # A remote predict (inference_service.predict_remote) brings the service's
+    # own explanation, so the models are never loaded here. An index answer
+    # is not explained up front either: that would walk the live model and
+    # undo the lookup.
+    why = result.pop("why", None)
+    if why is None and result.get("source") != "index":
+        why = explain_diagnosis({"data": data, "prediction": pred}, model_choice)
+    recs = RECOMMENDATIONS.get(pred, [DEFAULT_RECOMMENDATION])
+    alerts = simple_rule_flags(data)
+
+    with metrics.timed("diagnosis.save_history"):
+        storage.add_history(username, {
+            "timestamp": timestamp,
+            "prediction": pred,
+            "symptoms": selected,
+            "model": model_choice,
+            "vitals": data,
+        })
+    with metrics.timed("diagnosis.submit_report"):
+        report_key = reports.submit_report(
+            username=username,
+            prediction=pred,
+            vitals=data,
+            symptoms=selected,
+            model_name=model_choice,
+            recommendations=recs,
+        )
+    return {
+        "data": data,
+        "prediction": pred,
+        "result": result,
+        "why": why,
+        "recommendations": recs,
+        "alerts": alerts,
+        "report_key": report_key,
+    }
+
+
+def explain_diagnosis(out, model_choice):
+    """explain.explain() of a diagnose() result's prediction, from the live
+    model at the exact inputs."""
+    with metrics.timed("diagnosis.explain"):
+        return explain.explain(model_choice, out["data"], target=out["prediction"])[0]
+
+
+# -------------------------------
+# History and feedback
+# -------------------------------
+def history_page(username, before_id=None, limit=HISTORY_PAGE):
+    """(records, total): one page of history, newest first, and the user's total."""
+    with metrics.timed("history.load"):
+        return storage.get_history(username, limit=limit, before_id=before_id), storage.count_history(username)
+
+
+def submit_feedback(username, text):
+    """False (nothing saved) when the text is blank."""
+    if not text.strip():
+        return False
+    with metrics.timed("feedback.save"):
+        storage.add_feedback(username, text)
+    return True
+
+
+def recent_feedback(username, k=5):
+    with metrics.timed("feedback.load"):
+        return storage.recent_feedback(username, k=k)
@@ -1,31 +1,137 @@
 # app/utils.py
 
+import numpy as np
+import pandas as pd
+
 from core_utils import *
 
 # -----------------------
-# Safety Rule Function
+# Safety Rules
 # -----------------------
+# Each rule is a list of (column, op, value) clauses that must all hold.
+# Rule i sets bit i of the alert mask, so a whole population file can be
+# screened with a handful of NumPy comparisons.
+
+# Columns the rules read: (type the value is cast to, default when missing).
+RULE_COLUMNS = {
+    "spo2": (float, 98.0),
+    "temp_c": (float, 36.8),
+    "chest_pain": (int, 0),
+    "shortness_of_breath": (int, 0),
+}
+
+RULES = [
+    {
+        "name": "low_spo2",
+        "message": "⚠️ Low oxygen saturation detected (SpO₂ < 92%). Seek urgent medical attention.",
+        "when": [("spo2", "<", 92)],
+    },
+    {
+        "name": "high_fever",
+        "message": "🌡️ High fever detected (≥ 39°C). Consider medical care.",
+        "when": [("temp_c", ">=", 39)],
+    },
+    {
+        "name": "chest_pain_breath",
+        "message": "💔 Chest pain + shortness of breath may indicate a serious issue. Seek emergency care immediately.",
+        "when": [("chest_pain", "==", 1), ("shortness_of_breath", "==", 1)],
+    },
+]
+
+OPS = {
+    "<": np.less, "<=": np.less_equal, ">": np.greater,
+    ">=": np.greater_equal, "==": np.equal, "!=": np.not_equal,
+}
+MAX_RULES = 64
+
+
+def add_rule(name, message, when, columns=None):
+    """Register a rule; when is a list of (column, op, value) clauses.
+
+    columns maps any column not in RULE_COLUMNS to its (type, default).
+    Nothing is registered unless the whole rule is valid.
+    """
+    new_columns = {col: tuple(td) for col, td in (columns or {}).items() if col not in RULE_COLUMNS}
+    for col, (typ, _) in new_columns.items():
+        if typ not in (int, float):
+            raise ValueError(f"column {col!r}: type must be int or float")
+    for col, op, _ in when:
+        if col not in RULE_COLUMNS and col not in new_columns:
+            raise ValueError(f"unknown column {col!r}; pass its (type, default) in columns")
+        if op not in OPS:
+            raise ValueError(f"unknown operator {op!r}")
+    if any(r["name"] == name for r in RULES):
+        raise ValueError(f"rule {name!r} already exists")
+    if len(RULES) >= MAX_RULES:
+        raise ValueError(f"at most {MAX_RULES} rules")
+    RULE_COLUMNS.update(new_columns)
+    RULES.append({"name": name, "message": message, "when": list(when)})
+
+
+def mask_dtype(n_rules=None):
+    """Smallest unsigned integer type with a bit per rule."""
+    n = len(RULES) if n_rules is None else n_rules
+    return next(t for t in (np.uint8, np.uint16, np.uint32, np.uint64) if n <= np.iinfo(t).bits)
+
+
+def _column(data, col, n):
+    """Column cast like the rule type, plus a mask of values the cast would
+    reject (non-numeric, or NaN in an int column)."""
+    typ, default = RULE_COLUMNS[col]
+    if col not in data:
+        return np.full(n, default), np.zeros(n, dtype=bool)
+    values = np.asarray(data[col])
+    invalid = np.zeros(len(values), dtype=bool)
+    if values.dtype.kind not in "biuf":
+        raw = pd.Series(values, dtype=object)
+        values = pd.to_numeric(raw, errors="coerce").to_numpy(dtype=np.float64)
+        # float() accepts NaN itself; anything else that became NaN was rejected.
+        was_nan = raw.map(lambda v: isinstance(v, float) and v != v).to_numpy(dtype=bool)
+        invalid = np.isnan(values) & ~was_nan
+    if typ is int and values.dtype.kind == "f":
+        invalid |= ~np.isfinite(values)
+        values = np.trunc(values)
+    return values, invalid
+
+
+def evaluate_rules(data):
+    """Bitmask of triggered rules per row of a DataFrame or dict of arrays.
+
+    A value that cannot be cast (blank, None, text, NaN in an int column)
+    takes its column's default, as do missing columns; the row's other
+    values are still checked.
+    """
+    n = len(data) if hasattr(data, "columns") else len(next(iter(data.values())))
+    used = list(dict.fromkeys(col for rule in RULES for col, _, _ in rule["when"]))
+    columns = {}
+    for col in used:
+        values, invalid = _column(data, col, n)
+        columns[col] = np.where(invalid, RULE_COLUMNS[col][1], values) if invalid.any() else values
+
+    dtype = mask_dtype()
+    mask = np.zeros(n, dtype=dtype)
+    for bit, rule in enumerate(RULES):
+        hit = np.ones(n, dtype=bool)
+        for col, op, value in rule["when"]:
+            hit &= OPS[op](columns[col], value)
+        mask |= hit.astype(dtype) << dtype(bit)
+    return mask
+
+
+def alert_messages(mask):
+    """Messages of the rules set in one mask value."""
+    mask = int(mask)
+    return [rule["message"] for bit, rule in enumerate(RULES) if mask >> bit & 1]
+
+
+def alert_text(masks, sep=" | "):
+    """Joined messages per row, formatting each distinct mask only once."""
+    unique, inverse = np.unique(masks, return_inverse=True)
+    texts = np.array([sep.join(alert_messages(m)) for m in unique], dtype=object)
+    return texts[inverse]
+
 
 def simple_rule_flags(x):
     """Check vitals for warning signs and return alerts."""
-    alerts = []
-
-    try:
-        spo2 = float(x.get("spo2", 98))
-        temp = float(x.get("temp_c", 36.8))
-        chest_pain = int(x.get("chest_pain", 0))
-        short_breath = int(x.get("shortness_of_breath", 0))
-    except (ValueError, TypeError):
-        spo2, temp, chest_pain, short_breath = 98, 36.8, 0, 0
-
-    # Low oxygen
-    if spo2 < 92:
-        alerts.append("⚠️ Low oxygen saturation detected (SpO₂ < 92%). Seek urgent medical attention.")
-    # High fever
-    if temp >= 39:
-        alerts.append("🌡️ High fever detected (≥ 39°C). Consider medical care.")
-    # Chest pain + breath shortness
-    if chest_pain == 1 and short_breath == 1:
-        alerts.append("💔 Chest pain + shortness of breath may indicate a serious issue. Seek emergency care immediately.")
-    
-    return alerts
+    row = {col: [x.get(col, default)] for col, (_, default) in RULE_COLUMNS.items()}
+    return alert_messages(evaluate_rules(row)[0])
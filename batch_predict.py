@@ -0,0 +1,165 @@
+# batch_predict.py
+# Score a CSV of patient records with the trained models.
+#
+#   python batch_predict.py intake.csv predictions.csv --model rf --top-k 3
+#
+# The input is streamed in chunks and scored across a process pool; at most
+# (workers * 2) chunks are in flight, so memory stays bounded whatever the
+# size of the file.
+
+import argparse
+import collections
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from core_utils import ALL_FEATURES, CATEGORICAL_FEATURES, NUMERIC_FEATURES, SYMPTOMS
+import inference
+from app.utils import alert_text, evaluate_rules
+
+MODEL_NAMES = {"rf": "Random Forest", "dt": "Decision Tree"}
+
+
+# -------------------------------
+# Validation
+# -------------------------------
+def check_columns(path):
+    """Raise ValueError if the CSV header lacks any of ALL_FEATURES."""
+    columns = pd.read_csv(path, nrows=0).columns
+    missing = [c for c in ALL_FEATURES if c not in columns]
+    if missing:
+        raise ValueError(f"{path} is missing required columns: {', '.join(missing)}")
+    return list(columns)
+
+
+def check_values(path, chunksize):
+    """Raise ValueError naming the first row (1-based, after the header)
+    with a value the models cannot score: a vital that is blank or not a
+    finite number, a blank gender, or a symptom flag that is not 0, 1 or
+    blank. Runs before any output is written, so a bad file never leaves
+    partial results behind."""
+    rules = [
+        (NUMERIC_FEATURES, "must be a number"),
+        (CATEGORICAL_FEATURES, "is blank"),
+        (SYMPTOMS, "must be 0, 1 or blank"),
+    ]
+    for chunk in pd.read_csv(path, usecols=ALL_FEATURES, dtype=str, chunksize=chunksize):
+        numbers = chunk[NUMERIC_FEATURES + SYMPTOMS].apply(pd.to_numeric, errors="coerce")
+        bad = pd.concat([
+            ~np.isfinite(numbers[NUMERIC_FEATURES].astype(float)),
+            chunk[CATEGORICAL_FEATURES].isna(),
+            chunk[SYMPTOMS].notna() & ~numbers[SYMPTOMS].isin([0, 1]),
+        ], axis=1)
+        if bad.to_numpy().any():
+            row = bad.any(axis=1).idxmax()
+            col = bad.columns[bad.loc[row].to_numpy().argmax()]
+            problem = next(msg for cols, msg in rules if col in cols)
+            if col not in CATEGORICAL_FEATURES:
+                value = chunk.at[row, col]
+                problem += ", got " + ("blank" if pd.isna(value) else repr(value))
+            raise ValueError(f"{path} row {row + 1}: {col} {problem}")
+
+
+def read_chunks(path, chunksize, keep_columns=()):
+    """Chunks of the CSV with blank symptom flags read as 0."""
+    dtypes = {s: np.float32 for s in SYMPTOMS}
+    dtypes.update({c: str for c in CATEGORICAL_FEATURES})
+    for chunk in pd.read_csv(
+        path,
+        usecols=list(dict.fromkeys(list(keep_columns) + ALL_FEATURES)),
+        dtype=dtypes,
+        chunksize=chunksize,
+    ):
+        chunk[SYMPTOMS] = chunk[SYMPTOMS].fillna(0).astype(np.uint8)
+        yield chunk
+
+
+# -------------------------------
+# Scoring
+# -------------------------------
+def score_chunk(chunk, model_name, top_k=3, keep_columns=()):
+    """Return predictions, top-k probabilities and alerts for one chunk
+    (top_k is capped at the number of classes)."""
+    engine = inference.get_engine(model_name)
+    proba = inference.predict_proba(model_name, chunk[ALL_FEATURES])
+    classes = engine["classes"]
+    top_k = min(top_k, len(classes))
+    top = np.argsort(-proba, axis=1, kind="stable")[:, :top_k]
+
+    out = pd.DataFrame({c: chunk[c].to_numpy() for c in keep_columns}, index=chunk.index)
+    out["prediction"] = classes[np.argmax(proba, axis=1)]
+    rows = np.arange(len(chunk))
+    for k in range(top_k):
+        out[f"top{k + 1}"] = classes[top[:, k]]
+        out[f"top{k + 1}_proba"] = proba[rows, top[:, k]].round(4)
+    mask = evaluate_rules(chunk)
+    out["alert_mask"] = mask
+    out["alerts"] = alert_text(mask)
+    return out
+
+
+def run(input_path, output_path, model="rf", chunksize=50000, workers=None, top_k=3, keep_columns=()):
+    """Score input_path into output_path; returns (rows, seconds)."""
+    check_columns(input_path)
+    check_values(input_path, chunksize)
+    model_name = MODEL_NAMES[model]
+    workers = workers or os.cpu_count() or 1
+    t0 = time.perf_counter()
+    n_rows = 0
+    header = True
+
+    def write(result):
+        nonlocal n_rows, header
+        result.to_csv(output_path, mode="w" if header else "a", header=header, index=False)
+        header = False
+        n_rows += len(result)
+
+    chunks = read_chunks(input_path, chunksize, keep_columns)
+    if workers == 1:
+        for chunk in chunks:
+            write(score_chunk(chunk, model_name, top_k, keep_columns))
+    else:
+        pending = collections.deque()
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for chunk in chunks:
+                pending.append(pool.submit(score_chunk, chunk, model_name, top_k, keep_columns))
+                # Write in input order and keep at most 2 chunks per worker queued.
+                while len(pending) >= 2 * workers:
+                    write(pending.popleft().result())
+            while pending:
+                write(pending.popleft().result())
+
+    if header:
+        # Empty input: still produce a file with the output header.
+        write(score_chunk(pd.DataFrame(columns=ALL_FEATURES + list(keep_columns)), model_name, top_k, keep_columns))
+    return n_rows, time.perf_counter() - t0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch-score a CSV of patient records.")
+    parser.add_argument("input", help="CSV with the columns in core_utils.ALL_FEATURES")
+    parser.add_argument("output", help="CSV to write predictions to")
+    parser.add_argument("--model", choices=sorted(MODEL_NAMES), default="rf")
+    parser.add_argument("--chunksize", type=int, default=50000)
+    parser.add_argument("--workers", type=int, default=None, help="processes (default: all cores)")
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--keep", nargs="*", default=[], help="input columns copied to the output, e.g. an id")
+    args = parser.parse_args(argv)
+    if args.top_k < 1:
+        parser.error("--top-k must be at least 1")
+
+    try:
+        rows, seconds = run(args.input, args.output, args.model, args.chunksize, args.workers, args.top_k, args.keep)
+    except ValueError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+    print(f"✅ Scored {rows} rows in {seconds:.2f}s ({rows / max(seconds, 1e-9):,.0f} rows/sec) → {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,270 @@
+# bench_models.py
+# Latency and resource benchmark for the models in models/.
+#
+#   python bench_models.py --out bench_results.json
+#   python bench_models.py --out new.json --compare bench_results.json
+#
+# Reports per artifact: cold load time (fresh process), on-disk size and the
+# memory the loaded object holds; per prediction path: p50/p95/p99 single-row
+# latency and batch throughput. Results are JSON so runs from different
+# retrains can be diffed.
+
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+import sklearn
+
+import inference
+import model_registry as registry
+import prediction_cache
+import reports
+import storage
+import tree_engine
+from app import handlers
+from app.utils import alert_text, evaluate_rules, simple_rule_flags
+from core_utils import SYMPTOMS
+from sample_inputs import random_rows
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+BATCH_SIZES = [1, 10, 100, 1000, 10000]
+RULE_ROWS = 2_000_000
+SINGLE_ROW_CALLS = 500
+
+# Run in a fresh process: argv is the artifact and the repo root. rss_bytes is
+# the growth of current RSS while the loaded object is held, or None without
+# /proc (macOS, Windows). tracemalloc would miss the trees, which sklearn
+# allocates in C.
+_LOAD_SNIPPET = """
+import json, os, sys, time
+sys.path.insert(0, sys.argv[2])
+import joblib, sklearn.ensemble, sklearn.pipeline
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+before = rss_bytes()
+t0 = time.perf_counter()
+obj = joblib.load(sys.argv[1])
+load_s = time.perf_counter() - t0
+after = rss_bytes()
+print(json.dumps({"load_s": load_s, "rss_bytes": None if before is None else after - before}))
+"""
+
+
+# -------------------------------
+# Timing
+# -------------------------------
+def percentiles(samples_s):
+    ms = 1e3 * np.asarray(samples_s)
+    return {
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "mean_ms": float(ms.mean()),
+    }
+
+
+def time_calls(fn, args_list):
+    times = []
+    for args in args_list:
+        t0 = time.perf_counter()
+        fn(*args)
+        times.append(time.perf_counter() - t0)
+    return times
+
+
+# -------------------------------
+# Artifacts
+# -------------------------------
+def bench_artifacts(names=None):
+    names = names or sorted(f for f in os.listdir(registry.MODEL_DIR) if f.endswith(".joblib"))
+    out = {}
+    for name in names:
+        path = os.path.join(registry.MODEL_DIR, name)
+        proc = subprocess.run([sys.executable, "-W", "ignore", "-c", _LOAD_SNIPPET, path, ROOT],
+                              capture_output=True, text=True, check=True)
+        out[name] = {
+            "disk_bytes": os.path.getsize(path),
+            "sha256": registry.file_hash(path),
+            **json.loads(proc.stdout.strip().splitlines()[-1]),
+        }
+    return out
+
+
+# -------------------------------
+# Prediction paths
+# -------------------------------
+def _diagnosis_page(model_name):
+    """handlers.diagnose() as the Diagnosis page calls it (predict, explain,
+    safety rules). Run it under _no_side_effects()."""
+    def run(row):
+        vitals = {k: v for k, v in row.items() if k not in SYMPTOMS}
+        selected = [s for s in SYMPTOMS if row[s]]
+        return handlers.diagnose("bench", vitals, selected, model_name)
+    return run
+
+
+@contextlib.contextmanager
+def _no_side_effects():
+    """Stub out the history write and the PDF report job."""
+    with mock.patch.object(storage, "add_history"), \
+            mock.patch.object(reports, "submit_report", return_value=None):
+        yield
+
+
+def _sklearn_single(model_name):
+    model = registry.get_model(model_name)
+    features = registry.get_features()
+    return lambda row: model.predict(pd.DataFrame([row])[features])[0]
+
+
+def single_row_paths(model_name):
+    """Single-row callables, keyed by path name. Add future fast paths here."""
+    engine = inference.get_engine(model_name)
+    return {
+        "sklearn_pipeline": _sklearn_single(model_name),
+        "tree_engine": lambda row: tree_engine.predict(engine, row)[0],
+        # Everything handlers.diagnose() computes per submission. Fresh
+        # inputs, so these are prediction cache misses.
+        "diagnosis_page": _diagnosis_page(model_name),
+    }
+
+
+def batch_paths(model_name):
+    model = registry.get_model(model_name)
+    engine = inference.get_engine(model_name)
+    return {
+        "sklearn_pipeline": lambda df: model.predict_proba(df),
+        "tree_engine": lambda df: tree_engine.predict_proba(engine, tree_engine.encode(engine, df)),
+    }
+
+
+def bench_model(model_name, n_calls=SINGLE_ROW_CALLS, batch_sizes=BATCH_SIZES):
+    rows = random_rows(n_calls, seed=1).to_dict("records")
+    out = {"single_row": {}, "batch": {}}
+    with _no_side_effects():
+        for path, fn in single_row_paths(model_name).items():
+            fn(rows[0])  # warm up (model load, engine export)
+            prediction_cache.clear()
+            out["single_row"][path] = percentiles(time_calls(fn, [(r,) for r in rows]))
+
+        # A repeated input is served from the prediction cache.
+        hit, page = rows[0], _diagnosis_page(model_name)
+        page(hit)
+        out["single_row"]["diagnosis_page_cache_hit"] = percentiles(time_calls(page, [(hit,)] * n_calls))
+
+    for path, fn in batch_paths(model_name).items():
+        out["batch"][path] = {}
+        for size in batch_sizes:
+            df = random_rows(size, seed=size)
+            repeat = max(3, min(50, 20000 // size))
+            seconds = np.median(time_calls(fn, [(df,)] * repeat))
+            out["batch"][path][str(size)] = {"seconds": float(seconds), "rows_per_sec": size / seconds}
+    return out
+
+
+def bench_all_models(models=("Random Forest", "Decision Tree"), n_calls=SINGLE_ROW_CALLS):
+    """Both models on one input: two predict_one() calls vs one predict_all()."""
+    rows = [(r,) for r in random_rows(n_calls, seed=2).to_dict("records")]
+    paths = {
+        "separate_predict_one": lambda row: [inference.predict_one(m, row) for m in models],
+        "predict_all": lambda row: inference.predict_all(row, model_names=models),
+    }
+    out = {}
+    for path, fn in paths.items():
+        fn(rows[0][0])
+        prediction_cache.clear()
+        out[path] = percentiles(time_calls(fn, rows))
+    return out
+
+
+def bench_rules(n_rows=RULE_ROWS, per_row=20000):
+    """Safety rule screening throughput: bitmask, bitmask + text, per-row dicts."""
+    df = random_rows(n_rows, seed=5)
+    out = {}
+    for path, fn in [("bitmask", evaluate_rules), ("bitmask_and_text", lambda d: alert_text(evaluate_rules(d)))]:
+        seconds = np.median(time_calls(fn, [(df,)] * 3))
+        out[path] = {"rows": n_rows, "seconds": float(seconds), "rows_per_sec": float(n_rows / seconds)}
+    records = df.head(per_row).to_dict("records")
+    seconds = time_calls(lambda rs: [simple_rule_flags(r) for r in rs], [(records,)])[0]
+    out["simple_rule_flags_per_row"] = {"rows": per_row, "seconds": seconds, "rows_per_sec": per_row / seconds}
+    return out
+
+
+def run(models=("Random Forest", "Decision Tree")):
+    return {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "sklearn": sklearn.__version__,
+            "cpus": os.cpu_count(),
+            "machine": platform.machine(),
+        },
+        "artifacts": bench_artifacts(),
+        "models": {name: bench_model(name) for name in models},
+        "all_models": bench_all_models(models),
+        "rules": bench_rules(),
+    }
+
+
+# -------------------------------
+# Comparison
+# -------------------------------
+def compare(new, old):
+    """Print new/old ratios for every single-row p50 and batch throughput."""
+    print(f"{'metric':<70}{'old':>12}{'new':>12}{'ratio':>8}")
+    for model, res in new["models"].items():
+        prev = old.get("models", {}).get(model)
+        if prev is None:
+            continue
+        for path, stats in res["single_row"].items():
+            if path in prev["single_row"]:
+                o, n = prev["single_row"][path]["p50_ms"], stats["p50_ms"]
+                print(f"{model + ' single ' + path + ' p50 ms':<70}{o:>12.3f}{n:>12.3f}{n / o:>8.2f}")
+        for path, sizes in res["batch"].items():
+            for size, stats in sizes.items():
+                if size in prev["batch"].get(path, {}):
+                    o, n = prev["batch"][path][size]["rows_per_sec"], stats["rows_per_sec"]
+                    print(f"{model + ' batch ' + path + ' x' + size + ' rows/s':<70}{o:>12.0f}{n:>12.0f}{n / o:>8.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark model load time, latency and throughput.")
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--compare", help="previous results JSON to compare against")
+    args = parser.parse_args(argv)
+
+    results = run()
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    for model, res in results["models"].items():
+        for path, stats in res["single_row"].items():
+            print(f"{model:<14} {path:<26} p50 {stats['p50_ms']:.3f} ms  p99 {stats['p99_ms']:.3f} ms")
+    for path, stats in results["all_models"].items():
+        print(f"{'both models':<14} {path:<26} p50 {stats['p50_ms']:.3f} ms  p99 {stats['p99_ms']:.3f} ms")
+    for path, stats in results["rules"].items():
+        print(f"{'safety rules':<14} {path:<26} {stats['rows_per_sec']:,.0f} rows/s ({stats['rows']:,} rows)")
+    print(f"✅ Results written to {args.out}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
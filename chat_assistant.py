@@ -0,0 +1,326 @@
+# chat_assistant.py
+# Offline question answering for the Chat page: retrieve the passages of a
+# local health knowledge base that best match a question.
+#
+#   python chat_assistant.py build                  # index core_utils.RECOMMENDATIONS + data/knowledge/
+#   python chat_assistant.py update                 # re-index only added, changed or removed documents
+#   python chat_assistant.py ask "what to do for a fever"
+#   python chat_assistant.py bench --passages 20000
+#
+# Passages (paragraphs of data/knowledge/*.md|*.txt and one per disease in
+# RECOMMENDATIONS) are hashed into a fixed-width sparse term-count matrix
+# (words and word pairs, English stop words removed). Document frequencies
+# are kept next to it, so adding or replacing a document only hashes that
+# document. TF-IDF weights are derived from the counts; an update weighs
+# only the new passages until the passage count drifts by REWEIGH_DRIFT,
+# then every passage is re-weighed with fresh IDF. A question is
+# answered by one sparse vector-matrix product over the rows of its words
+# (cosine similarity).
+#
+# Files (models/): chat_index.npz (counts + document frequencies) and
+# chat_index.json (passages and the content hash of every source).
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import HashingVectorizer
+
+from core_utils import RECOMMENDATIONS
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+KNOWLEDGE_DIR = os.path.join(ROOT, "data", "knowledge")
+INDEX_FILE = os.path.join(ROOT, "models", "chat_index.npz")
+META_FILE = os.path.join(ROOT, "models", "chat_index.json")
+RECOMMENDATIONS_SOURCE = "core_utils.RECOMMENDATIONS"
+
+N_FEATURES = 2 ** 18
+# Incremental updates weigh only new passages with the current IDF; every
+# passage is re-weighed once the count drifts this far from the last time.
+REWEIGH_DRIFT = 0.1
+TOP_K = 3
+MIN_SCORE = 0.1
+FALLBACK = "I couldn't find that in the health notes. Consult a doctor for accurate diagnosis."
+
+_vectorizer = HashingVectorizer(
+    n_features=N_FEATURES, ngram_range=(1, 2), stop_words="english",
+    alternate_sign=False, norm=None, dtype=np.float32,
+)
+_lock = threading.Lock()
+_cache = {}
+
+
+# -------------------------------
+# Sources
+# -------------------------------
+def split_passages(text):
+    """(title, paragraph) pairs; '#' lines set the title of what follows."""
+    title, out = "", []
+    for block in text.split("\n\n"):
+        lines = []
+        for line in block.strip().splitlines():
+            if line.startswith("#"):
+                title = line.lstrip("#").strip()
+            else:
+                lines.append(line.strip())
+        if lines:
+            out.append((title, " ".join(lines)))
+    return out
+
+
+def read_sources(knowledge_dir=KNOWLEDGE_DIR):
+    """{source: text} for RECOMMENDATIONS and every document on disk."""
+    sources = {
+        RECOMMENDATIONS_SOURCE: "\n\n".join(
+            f"# {disease}\n{' '.join(advice)}" for disease, advice in RECOMMENDATIONS.items()
+        )
+    }
+    for path in sorted(glob.glob(os.path.join(knowledge_dir, "*.md")) + glob.glob(os.path.join(knowledge_dir, "*.txt"))):
+        with open(path, encoding="utf-8") as f:
+            sources[os.path.relpath(path, ROOT)] = f.read()
+    return sources
+
+
+def _digest(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+# -------------------------------
+# Index
+# -------------------------------
+def _counts(texts):
+    """Sublinear term counts (1 + log tf) of texts, one row each."""
+    X = _vectorizer.transform(texts).tocsr()
+    np.log(X.data, out=X.data)
+    X.data += 1
+    return X
+
+
+def _row_weights(counts, idf):
+    """Row-normalized TF-IDF weights of count rows (passages x features)."""
+    X = counts @ sp.diags(idf)
+    norms = np.sqrt(np.asarray(X.multiply(X).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sp.csr_matrix(sp.diags(1 / norms) @ X, dtype=np.float32)
+
+
+def _weigh(index):
+    """Re-derive the IDF from the stored counts and weigh every passage. The
+    weights are also kept feature-major (features x passages), so a question
+    only touches the rows of its own words."""
+    n = len(index["passages"])
+    index["idf"] = (np.log((1 + n) / (1 + index["df"])) + 1).astype(np.float32)
+    index["weighed_n"] = n
+    index["weights"] = _row_weights(index["counts"], index["idf"])
+    index["matrix"] = index["weights"].T.tocsr()
+    return index
+
+
+def empty_index():
+    return {
+        "passages": [],
+        "sources": {},
+        "counts": sp.csr_matrix((0, N_FEATURES), dtype=np.float32),
+        "df": np.zeros(N_FEATURES, dtype=np.int32),
+    }
+
+
+def update_index(index, sources):
+    """Bring index up to date with {source: text}; only added, changed or
+    removed sources are (re)hashed. Returns (index, added, removed passages)."""
+    changed = {s for s, text in sources.items() if index["sources"].get(s) != _digest(text)}
+    stale = changed | (set(index["sources"]) - set(sources))
+    if not stale:
+        return index, 0, 0
+
+    # Work on a copy: readers may still be using the current index.
+    index = dict(index, df=index["df"].copy(), sources=dict(index["sources"]))
+    keep = np.array([p["source"] not in stale for p in index["passages"]], dtype=bool)
+    removed = int((~keep).sum())
+    counts, weights = index["counts"], index.get("weights")
+    if removed:
+        dropped = counts[~keep]
+        index["df"] -= np.bincount(dropped.indices, minlength=N_FEATURES).astype(np.int32)
+        counts = counts[keep]
+        weights = None if weights is None else weights[keep]
+    passages = [p for p, k in zip(index["passages"], keep) if k]
+
+    new = [
+        {"source": s, "title": title, "text": text}
+        for s in sorted(changed) for title, text in split_passages(sources[s])
+    ]
+    added = sp.csr_matrix((0, N_FEATURES), dtype=np.float32)
+    if new:
+        added = _counts([f"{p['title']} {p['text']}" for p in new])
+        index["df"] += np.bincount(added.indices, minlength=N_FEATURES).astype(np.int32)
+        counts = sp.vstack([counts, added], format="csr")
+    index.update(passages=passages + new, counts=counts)
+    index["sources"] = {s: d for s, d in index["sources"].items() if s not in stale}
+    index["sources"].update({s: _digest(sources[s]) for s in changed})
+
+    last = index.get("weighed_n", 0)
+    if weights is None or abs(len(index["passages"]) - last) > REWEIGH_DRIFT * last:
+        return _weigh(index), len(new), removed
+    index["weights"] = sp.vstack([weights, _row_weights(added, index["idf"])], format="csr")
+    index["matrix"] = index["weights"].T.tocsr()
+    return index, len(new), removed
+
+
+def build_index(sources):
+    return update_index(empty_index(), sources)[0]
+
+
+def _replace(path, write):
+    """Write a file through a private temp file next to it, then rename it
+    into place, so concurrent writers never share or expose a partial file."""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def save_index(index, index_file=INDEX_FILE, meta_file=META_FILE):
+    counts = index["counts"]
+    _replace(index_file, lambda f: np.savez(
+        f, data=counts.data, indices=counts.indices, indptr=counts.indptr, df=index["df"]))
+    meta = {"n_features": N_FEATURES, "sources": index["sources"], "passages": index["passages"]}
+    _replace(meta_file, lambda f: f.write(json.dumps(meta).encode("utf-8")))
+
+
+def load_index(index_file=INDEX_FILE, meta_file=META_FILE):
+    """The saved index, or None if missing or built with another layout."""
+    try:
+        with open(meta_file, encoding="utf-8") as f:
+            meta = json.load(f)
+        arrays = np.load(index_file)
+    except (OSError, ValueError):
+        return None
+    if meta.get("n_features") != N_FEATURES:
+        return None
+    counts = sp.csr_matrix(
+        (arrays["data"], arrays["indices"], arrays["indptr"]), shape=(len(meta["passages"]), N_FEATURES)
+    )
+    index = {"passages": meta["passages"], "sources": meta["sources"], "counts": counts, "df": arrays["df"]}
+    return _weigh(index)
+
+
+def _fingerprint(knowledge_dir):
+    files = glob.glob(os.path.join(knowledge_dir, "*.md")) + glob.glob(os.path.join(knowledge_dir, "*.txt"))
+    return tuple(sorted((p, os.path.getmtime(p)) for p in files))
+
+
+def get_index(knowledge_dir=KNOWLEDGE_DIR):
+    """Process-wide index: loaded from models/ once, then updated in memory
+    when a document is added, edited or deleted. Only `build` and `update`
+    write models/, never a request."""
+    key = _fingerprint(knowledge_dir)
+    index = _cache.get(key)
+    if index is None:
+        with _lock:
+            index = _cache.get(key)
+            if index is None:
+                index = next(iter(_cache.values()), None) or load_index() or empty_index()
+                index = update_index(index, read_sources(knowledge_dir))[0]
+                _cache.clear()
+                _cache[key] = index
+    return index
+
+
+# -------------------------------
+# Query
+# -------------------------------
+def ask(question, k=TOP_K, index=None):
+    """Top-k passages for a question: [{"text", "title", "source", "score"}]."""
+    index = index or get_index()
+    if not index["passages"] or not question.strip():
+        return []
+    q = _counts([question])
+    weights = q.data * index["idf"][q.indices]
+    norm = np.linalg.norm(weights)
+    if not norm:
+        return []
+    scores = (weights / norm) @ index["matrix"][q.indices]
+    top = np.argpartition(-scores, min(k, len(scores)) - 1)[:k]
+    top = top[np.argsort(-scores[top], kind="stable")]
+    return [dict(index["passages"][i], score=float(scores[i])) for i in top.tolist() if scores[i] > 0]
+
+
+def answer(question, k=TOP_K, min_score=MIN_SCORE):
+    """Passages worth showing, or [] when nothing matches well enough."""
+    return [p for p in ask(question, k) if p["score"] >= min_score]
+
+
+# -------------------------------
+# Benchmark
+# -------------------------------
+def bench(n_passages=20_000, n_queries=500, n_added=100, seed=0):
+    """Full build, incremental add and query latency on a synthetic knowledge
+    base made by shuffling words of the real passages."""
+    from bench_models import percentiles, time_calls
+
+    rng = np.random.default_rng(seed)
+    words = " ".join(p for _, text in read_sources().items() for _, p in split_passages(text)).split()
+
+    def fake(n, start):
+        return {f"synthetic/{start + i}.md": " ".join(rng.choice(words, 60)) for i in range(n)}
+
+    sources = fake(n_passages, 0)
+    t0 = time.perf_counter()
+    index = build_index(sources)
+    build_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    index, added, _ = update_index(index, {**sources, **fake(n_added, n_passages)})
+    add_s = time.perf_counter() - t0
+
+    questions = [" ".join(rng.choice(words, 6)) for _ in range(n_queries)]
+    ask(questions[0], index=index)
+    return {
+        "passages": len(index["passages"]),
+        "build_s": build_s,
+        "added": added,
+        "add_s": add_s,
+        **percentiles(time_calls(lambda q: ask(q, index=index), [(q,) for q in questions])),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline health knowledge base for the Chat page.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("build", help="rebuild the index from scratch")
+    sub.add_parser("update", help="re-index added, changed or removed documents")
+    a = sub.add_parser("ask")
+    a.add_argument("question")
+    a.add_argument("-k", type=int, default=TOP_K)
+    b = sub.add_parser("bench")
+    b.add_argument("--passages", type=int, default=20_000)
+    args = parser.parse_args(argv)
+
+    if args.command in ("build", "update"):
+        t0 = time.perf_counter()
+        index = empty_index() if args.command == "build" else (load_index() or empty_index())
+        index, added, removed = update_index(index, read_sources())
+        save_index(index)
+        print(f"✅ {len(index['passages'])} passages from {len(index['sources'])} sources "
+              f"(+{added} / -{removed}) in {time.perf_counter() - t0:.2f}s → {INDEX_FILE}")
+    elif args.command == "ask":
+        for p in ask(args.question, args.k):
+            print(f"{p['score']:.3f}  [{p['source']} · {p['title']}] {p['text']}")
+    else:
+        r = bench(args.passages)
+        print(f"{r['passages']:,} passages: build {r['build_s']:.2f}s, +{r['added']} passages in {r['add_s']:.3f}s, "
+              f"query p50 {r['p50_ms']:.2f} ms, p95 {r['p95_ms']:.2f} ms, p99 {r['p99_ms']:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
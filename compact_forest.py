@@ -0,0 +1,234 @@
+# compact_forest.py
+# Shrink the Random Forest to fit a size or latency budget.
+#
+#   python compact_forest.py --max-bytes 100000
+#   python compact_forest.py --max-latency-ms 0.05 --install
+#
+# Works on the flat tree engine (see tree_engine.py): keeps the first N trees,
+# turns every node at the depth cap into a leaf with that node's class
+# distribution, collapses splits whose two sides end in the same leaf value,
+# stores leaf values once in a shared table, and quantizes thresholds to
+# float16 and probabilities to uint8. Every candidate is scored on the
+# held-out split of train_model.py and the most accurate one inside the budget
+# is written next to the pipeline.
+
+import argparse
+import hashlib
+import io
+import json
+import os
+
+import joblib
+import numpy as np
+
+import inference
+import lookup_index
+import model_registry as registry
+import tree_engine
+from bench_models import percentiles, time_calls
+from sample_inputs import random_rows
+from train_model import load_dataset, split_dataset
+
+MODEL_NAMES = {"rf": "Random Forest", "dt": "Decision Tree"}
+TREE_COUNTS = [200, 100, 50, 25, 10, 5]
+DEPTH_CAPS = [None, 12, 10, 8, 6, 4]
+VALUE_LEVELS = 255
+LATENCY_CALLS = 300
+
+
+# -------------------------------
+# Compaction
+# -------------------------------
+def _value_table(engine, quantize):
+    """Deduplicated value rows and the row id of every node."""
+    value = engine["value"]
+    if quantize:
+        value = np.rint(value * VALUE_LEVELS).astype(np.uint8)
+    return np.unique(value, axis=0, return_inverse=True)
+
+
+def _collapse(children, value_id, root, max_depth):
+    """Return {node: value id} for every node that becomes a leaf and the
+    set of nodes that remain internal, walking the tree from root."""
+    leaf_value, internal = {}, set()
+
+    def visit(node, depth):
+        left, right = children[2 * node], children[2 * node + 1]
+        if left == node or (max_depth is not None and depth >= max_depth):
+            leaf_value[node] = value_id[node]
+            return value_id[node]
+        lv, rv = visit(left, depth + 1), visit(right, depth + 1)
+        if lv is not None and lv == rv:
+            # Both sides predict the same thing: the split is dead weight.
+            del leaf_value[left], leaf_value[right]
+            leaf_value[node] = lv
+            return lv
+        internal.add(node)
+        return None
+
+    visit(root, 0)
+    return leaf_value, internal
+
+
+def compact(engine, n_trees=None, max_depth=None, quantize=True):
+    """Return a compacted copy of a tree engine.
+
+    The result predicts with tree_engine like any other engine; it is no
+    longer bit-identical to the source pipeline.
+    """
+    n_trees = min(n_trees or engine["n_trees"], engine["n_trees"])
+    table, value_id = _value_table(engine, quantize)
+    children = engine["children"]
+
+    feature, lower, upper, kids, index, roots, depths = [], [], [], [], [], [], []
+    for root in engine["roots"][:n_trees]:
+        leaf_value, internal = _collapse(children, value_id, int(root), max_depth)
+        # Breadth-first renumbering keeps each tree contiguous.
+        order, new_id, depth_of = [int(root)], {int(root): len(feature)}, {int(root): 0}
+        i = 0
+        while i < len(order):
+            node = order[i]
+            i += 1
+            if node in internal:
+                for child in (children[2 * node], children[2 * node + 1]):
+                    new_id[int(child)] = len(feature) + len(order)
+                    depth_of[int(child)] = depth_of[node] + 1
+                    order.append(int(child))
+        for node in order:
+            me = new_id[node]
+            if node in internal:
+                feature.append(engine["feature"][node])
+                lower.append(engine["lower"][node])
+                upper.append(engine["upper"][node])
+                kids += [new_id[int(children[2 * node])], new_id[int(children[2 * node + 1])]]
+                index.append(0)
+            else:
+                feature.append(0)
+                lower.append(np.inf)
+                upper.append(np.inf)
+                kids += [me, me]
+                index.append(leaf_value[node])
+        roots.append(new_id[int(root)])
+        depths.append(max(depth_of.values()))
+
+    # Only value rows that are still referenced by a leaf are kept.
+    used, index = np.unique(np.asarray(index), return_inverse=True)
+    n_nodes = len(feature)
+    out = {
+        "features": engine["features"],
+        "categories": engine["categories"],
+        "classes": engine["classes"],
+        "n_trees": n_trees,
+        "max_depth": int(max(depths)),
+        "feature": np.asarray(feature, dtype=np.uint8 if len(engine["features"]) < 256 else np.int32),
+        "lower": np.asarray(lower, dtype=np.float16 if quantize else np.float64),
+        "upper": np.asarray(upper, dtype=np.float16 if quantize else np.float64),
+        "children": np.asarray(kids, dtype=np.int32),
+        "value": table[used],
+        "value_index": index.astype(np.uint16 if len(used) < 2 ** 16 else np.int32),
+        "roots": np.asarray(roots, dtype=np.int32),
+        "depths": np.asarray(depths, dtype=np.int32),
+        "compaction": {"n_trees": n_trees, "max_depth": max_depth, "quantize": quantize, "nodes": n_nodes},
+    }
+    if quantize:
+        out["value_scale"] = 1.0 / VALUE_LEVELS
+    if "source_hash" in engine:
+        # Same pipeline, different predictions: caches key on engine_hash
+        # (inference.engine_hash), so they never mix the two.
+        out["source_hash"] = engine["source_hash"]
+        out["engine_hash"] = hashlib.sha256(
+            json.dumps([engine["source_hash"], out["compaction"]], sort_keys=True).encode()
+        ).hexdigest()
+    return out
+
+
+# -------------------------------
+# Evaluation
+# -------------------------------
+def artifact_bytes(engine):
+    """Size of the engine as joblib writes it."""
+    buf = io.BytesIO()
+    joblib.dump(engine, buf)
+    return buf.tell()
+
+
+def single_row_p50_ms(engine, rows):
+    tree_engine.predict(engine, rows[0])
+    return percentiles(time_calls(lambda r: tree_engine.predict(engine, r), [(r,) for r in rows]))["p50_ms"]
+
+
+def evaluate(engine, X_test, y_test, rows):
+    X = tree_engine.encode(engine, X_test)
+    return {
+        "accuracy": float(np.mean(tree_engine.predict(engine, X) == np.asarray(y_test))),
+        "bytes": artifact_bytes(engine),
+        "p50_ms": single_row_p50_ms(engine, rows),
+        "nodes": int(len(engine["feature"])),
+    }
+
+
+def search(engine, X_test, y_test, max_bytes=None, max_latency_ms=None,
+           tree_counts=TREE_COUNTS, depth_caps=DEPTH_CAPS):
+    """Score every candidate; return (best candidate within budget, all results)."""
+    rows = random_rows(LATENCY_CALLS, seed=3).to_dict("records")
+    results = []
+    for n_trees in sorted({min(n, engine["n_trees"]) for n in tree_counts}, reverse=True):
+        for max_depth in depth_caps:
+            candidate = compact(engine, n_trees, max_depth)
+            results.append((candidate, evaluate(candidate, X_test, y_test, rows)))
+
+    fits = [
+        (c, r) for c, r in results
+        if (max_bytes is None or r["bytes"] <= max_bytes)
+        and (max_latency_ms is None or r["p50_ms"] <= max_latency_ms)
+    ]
+    best = max(fits, key=lambda cr: (cr[1]["accuracy"], -cr[1]["bytes"]), default=None)
+    return best, results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compact a tree model to fit a size or latency budget.")
+    parser.add_argument("--model", choices=sorted(MODEL_NAMES), default="rf")
+    parser.add_argument("--max-bytes", type=int, help="largest allowed artifact size")
+    parser.add_argument("--max-latency-ms", type=float, help="largest allowed single-row p50")
+    parser.add_argument("--data", default="data/symptoms_disease.csv", help="dataset for the held-out split")
+    parser.add_argument("--out", help="output file (default models/<model>_compact.joblib)")
+    parser.add_argument("--install", action="store_true",
+                        help="also write it as the engine the app serves (models/<model>_engine.joblib)")
+    args = parser.parse_args(argv)
+
+    model_name = MODEL_NAMES[args.model]
+    engine = inference.get_engine(model_name)
+    _, X_test, _, y_test = split_dataset(load_dataset(args.data))
+    rows = random_rows(LATENCY_CALLS, seed=3).to_dict("records")
+    base = evaluate(engine, X_test, y_test, rows)
+    best, results = search(engine, X_test, y_test, args.max_bytes, args.max_latency_ms)
+
+    print(f"{'trees':>6}{'depth':>7}{'nodes':>8}{'bytes':>10}{'p50 ms':>9}{'accuracy':>10}{'Δ acc':>8}")
+    print(f"{'orig':>6}{'-':>7}{base['nodes']:>8}{base['bytes']:>10}{base['p50_ms']:>9.3f}{base['accuracy']:>10.4f}{0:>8.4f}")
+    for candidate, r in results:
+        c = candidate["compaction"]
+        print(f"{c['n_trees']:>6}{str(c['max_depth'] or '-'):>7}{r['nodes']:>8}{r['bytes']:>10}"
+              f"{r['p50_ms']:>9.3f}{r['accuracy']:>10.4f}{r['accuracy'] - base['accuracy']:>+8.4f}")
+
+    if best is None:
+        raise SystemExit("❌ No candidate fits the budget.")
+    candidate, r = best
+    out = args.out or os.path.join(registry.MODEL_DIR, f"{args.model}_compact.joblib")
+    joblib.dump(candidate, out)
+    print(f"✅ {candidate['compaction']} → {out}: {r['bytes']:,} bytes ({r['bytes'] / base['bytes']:.1%}), "
+          f"p50 {r['p50_ms']:.3f} ms, accuracy {r['accuracy']:.4f} ({r['accuracy'] - base['accuracy']:+.4f})")
+    if args.install:
+        path = os.path.join(registry.MODEL_DIR, inference.ENGINE_FILES[model_name])
+        joblib.dump(candidate, path)
+        # The precomputed index records engine hashes, so one built for the
+        # full forest stops answering from here on (here and in running apps).
+        lookup_index.clear()
+        print(f"✅ Installed as {path}")
+        if os.path.exists(os.path.join(registry.MODEL_DIR, lookup_index.META_FILE)):
+            print("⚠️ The precomputed index was built for the full forest and is no longer used; "
+                  "`python lookup_index.py build` rebuilds it for the compacted engine.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,28 @@
 # generate_dataset.py
-import pandas as pd
+# Vectorized, seeded synthetic dataset generator.
+#
+#   python data/generate_dataset.py                                  # 800 rows → data/symptoms_disease.csv
+#   python data/generate_dataset.py --rows 50000000 --out big.parquet --seed 7
+#
+# Parquet output needs pyarrow, which is optional (pip install pyarrow).
+# Rows are produced in chunks and appended to the output, so datasets larger
+# than RAM can be generated. The same --seed and --chunk-size always give the
+# same file.
+import argparse
+import os
+import time
+
 import numpy as np
-import random
+import pandas as pd
 
 # ------------------------
 # Configuration
 # ------------------------
-NUM_ROWS = 800  # You can change between 500-1000
+NUM_ROWS = 800
+SEED = 42
+CHUNK_SIZE = 1_000_000
+OUT_PATH = "data/symptoms_disease.csv"
+
 DISEASES = [
     "Common Cold","Flu","Migraine","Gastroenteritis","COVID-19",
     "Allergy","Diabetes (possible)","Hypertension (possible)",
@@ -24,57 +40,156 @@ SYMPTOMS = [
 
 NUMERIC_FEATURES = ["age","temp_c","heart_rate","spo2"]
 
+DISEASE_SYMPTOMS = {
+    "Common Cold": ["cough", "runny_nose", "sore_throat"],
+    "Flu": ["fever", "cough", "fatigue", "body_ache"],
+    "Migraine": ["headache", "nausea", "vision_blur"],
+    "Gastroenteritis": ["diarrhea", "vomiting", "nausea"],
+    "COVID-19": ["fever", "cough", "shortness_of_breath", "loss_of_smell"],
+    "Allergy": ["runny_nose", "rash", "cough"],
+    "Diabetes (possible)": ["frequent_urination", "increased_thirst"],
+    "Hypertension (possible)": ["headache", "chest_pain"],
+    "Heart Attack Risk": ["chest_pain", "shortness_of_breath"],
+    "Dermatitis": ["rash"],
+}
+
+# Disease × symptom 0/1 matrix: row i is the symptom vector of DISEASES[i].
+SYMPTOM_MASK = np.array(
+    [[int(s in DISEASE_SYMPTOMS[d]) for s in SYMPTOMS] for d in DISEASES], dtype=np.uint8
+)
+
+COLUMNS = ["age", "gender", "temp_c", "heart_rate", "spo2", "disease"] + SYMPTOMS
+
+# Value ranges (inclusive). Temperatures are drawn in tenths of a degree,
+# which is the same as round(uniform(36.0, 40.0), 1).
+AGE = (5, 80)
+TEMP_TENTHS = (360, 400)
+HEART_RATE = (60, 110)
+SPO2 = (90, 100)
+
+
 # ------------------------
-# Function to generate row
+# Generation
 # ------------------------
-def generate_row():
-    disease = random.choice(DISEASES)
-    gender = random.choice(GENDERS)
-    age = random.randint(5, 80)
-    temp_c = round(random.uniform(36.0, 40.0),1)
-    heart_rate = random.randint(60, 110)
-    spo2 = random.randint(90, 100)
-
-    # Randomly assign symptoms based on disease
-    symptom_row = {sym:0 for sym in SYMPTOMS}
-    
-    if disease == "Common Cold":
-        symptom_row.update({ "cough":1, "runny_nose":1, "sore_throat":1 })
-    elif disease == "Flu":
-        symptom_row.update({ "fever":1, "cough":1, "fatigue":1, "body_ache":1 })
-    elif disease == "Migraine":
-        symptom_row.update({ "headache":1, "nausea":1, "vision_blur":1 })
-    elif disease == "Gastroenteritis":
-        symptom_row.update({ "diarrhea":1, "vomiting":1, "nausea":1 })
-    elif disease == "COVID-19":
-        symptom_row.update({ "fever":1, "cough":1, "shortness_of_breath":1, "loss_of_smell":1 })
-    elif disease == "Allergy":
-        symptom_row.update({ "runny_nose":1, "rash":1, "cough":1 })
-    elif disease == "Diabetes (possible)":
-        symptom_row.update({ "frequent_urination":1, "increased_thirst":1 })
-    elif disease == "Hypertension (possible)":
-        symptom_row.update({ "headache":1, "chest_pain":1 })
-    elif disease == "Heart Attack Risk":
-        symptom_row.update({ "chest_pain":1, "shortness_of_breath":1 })
-    elif disease == "Dermatitis":
-        symptom_row.update({ "rash":1 })
-
+def generate_codes(n, rng):
+    """Draw n rows as small integer arrays (category codes, raw values)."""
     return {
-        "age": age,
-        "gender": gender,
-        "temp_c": temp_c,
-        "heart_rate": heart_rate,
-        "spo2": spo2,
-        "disease": disease,
-        **symptom_row
+        "age": rng.integers(AGE[0], AGE[1] + 1, n, dtype=np.int16),
+        "gender": rng.integers(0, len(GENDERS), n, dtype=np.int8),
+        "temp_tenths": np.rint(rng.uniform(TEMP_TENTHS[0], TEMP_TENTHS[1], n)).astype(np.int16),
+        "heart_rate": rng.integers(HEART_RATE[0], HEART_RATE[1] + 1, n, dtype=np.int16),
+        "spo2": rng.integers(SPO2[0], SPO2[1] + 1, n, dtype=np.int16),
+        "disease": rng.integers(0, len(DISEASES), n, dtype=np.int8),
     }
 
+
+def to_frame(codes):
+    """DataFrame with the dataset's columns; symptoms come from SYMPTOM_MASK."""
+    data = {
+        "age": codes["age"],
+        "gender": pd.Categorical.from_codes(codes["gender"], GENDERS),
+        "temp_c": codes["temp_tenths"] / 10.0,
+        "heart_rate": codes["heart_rate"],
+        "spo2": codes["spo2"],
+        "disease": pd.Categorical.from_codes(codes["disease"], DISEASES),
+    }
+    symptoms = SYMPTOM_MASK[codes["disease"]]
+    for j, s in enumerate(SYMPTOMS):
+        data[s] = symptoms[:, j]
+    return pd.DataFrame(data, columns=COLUMNS)
+
+
+def generate_chunk(n, rng):
+    """Return n rows as a DataFrame (same columns and ranges as before)."""
+    return to_frame(generate_codes(n, rng))
+
+
+def _token_table(strings):
+    """Fixed-width uint8 table of strings, NUL-padded on the right."""
+    encoded = [t.encode() for t in strings]
+    width = max(len(t) for t in encoded)
+    return np.array(encoded, dtype=f"S{width}").view(np.uint8).reshape(len(encoded), width)
+
+
+# Every possible "age,gender,temp_c," prefix and "heart_rate,spo2,disease,symptoms\n"
+# suffix of a CSV line (the disease fixes every symptom).
+_CSV_PREFIX = _token_table([
+    f"{a},{g},{t / 10:.1f},"
+    for a in range(AGE[0], AGE[1] + 1)
+    for g in GENDERS
+    for t in range(TEMP_TENTHS[0], TEMP_TENTHS[1] + 1)
+])
+_CSV_SUFFIX = _token_table([
+    f"{h},{o}," + d + "," + ",".join(map(str, SYMPTOM_MASK[i])) + "\n"
+    for h in range(HEART_RATE[0], HEART_RATE[1] + 1)
+    for o in range(SPO2[0], SPO2[1] + 1)
+    for i, d in enumerate(DISEASES)
+])
+
+
+def to_csv_bytes(codes):
+    """Format rows as CSV lines by gathering precomputed byte tokens and
+    dropping their padding."""
+    n_gender, n_temp = len(GENDERS), TEMP_TENTHS[1] - TEMP_TENTHS[0] + 1
+    n_spo2, n_disease = SPO2[1] - SPO2[0] + 1, len(DISEASES)
+    prefix = ((codes["age"].astype(np.int32) - AGE[0]) * n_gender + codes["gender"]) * n_temp \
+        + (codes["temp_tenths"] - TEMP_TENTHS[0])
+    suffix = ((codes["heart_rate"].astype(np.int32) - HEART_RATE[0]) * n_spo2 + (codes["spo2"] - SPO2[0])) * n_disease \
+        + codes["disease"]
+    rows = np.concatenate([_CSV_PREFIX[prefix], _CSV_SUFFIX[suffix]], axis=1)
+    return rows[rows != 0].tobytes()
+
+
+def iter_chunks(num_rows, seed=SEED, chunk_size=CHUNK_SIZE):
+    """Yield code dicts totalling num_rows, each from its own seeded stream."""
+    streams = np.random.SeedSequence(seed).spawn((num_rows + chunk_size - 1) // chunk_size)
+    for i, stream in enumerate(streams):
+        yield generate_codes(min(chunk_size, num_rows - i * chunk_size), np.random.default_rng(stream))
+
+
 # ------------------------
-# Generate dataset
+# Output
 # ------------------------
-data = [generate_row() for _ in range(NUM_ROWS)]
-df = pd.DataFrame(data)
+def write_dataset(path, num_rows, seed=SEED, chunk_size=CHUNK_SIZE, fmt=None):
+    """Write num_rows rows to path as CSV or Parquet; returns seconds taken."""
+    fmt = fmt or ("parquet" if path.endswith(".parquet") else "csv")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    t0 = time.perf_counter()
+    if fmt == "parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        writer = None
+        try:
+            for codes in iter_chunks(num_rows, seed, chunk_size):
+                table = pa.Table.from_pandas(to_frame(codes), preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(path, table.schema)
+                writer.write_table(table)
+        finally:
+            if writer is not None:
+                writer.close()
+    else:
+        with open(path, "wb") as f:
+            f.write((",".join(COLUMNS) + "\n").encode())
+            for codes in iter_chunks(num_rows, seed, chunk_size):
+                f.write(to_csv_bytes(codes))
+    return time.perf_counter() - t0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate the synthetic symptoms/disease dataset.")
+    parser.add_argument("--rows", type=int, default=NUM_ROWS)
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--out", default=OUT_PATH, help=".csv or .parquet")
+    parser.add_argument("--format", choices=["csv", "parquet"], default=None)
+    args = parser.parse_args(argv)
+
+    seconds = write_dataset(args.out, args.rows, args.seed, args.chunk_size, args.format)
+    print(f"✅ Dataset saved as '{args.out}' ({args.rows:,} rows in {seconds:.2f}s, "
+          f"{args.rows / max(seconds, 1e-9):,.0f} rows/sec)")
+
 
-# Save CSV
-df.to_csv("data/symptoms_disease.csv", index=False)
-print("✅ Dataset saved as 'data/symptoms_disease.csv'")
+if __name__ == "__main__":
+    main()
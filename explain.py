@@ -0,0 +1,203 @@
+# explain.py
+# Per-prediction feature contributions for the tree models in models/.
+#
+#   python explain.py check --rows 2000     # contributions add up to predict_proba
+#   python explain.py bench                 # single-row and batch latency
+#
+# Decision-path attribution (Saabas): walking a row down a tree, every split
+# moves the class distribution from the node's value to the child's value,
+# and that change is credited to the split's feature. Summed over the path,
+# and averaged over the trees of a forest,
+#
+#   predict_proba(row) == bias + contributions(row).sum(features)
+#
+# where bias is the class distribution at the roots (the training prior).
+# The walk runs on the flat tree engine, whose splits are already folded back
+# to the raw inputs of the ColumnTransformer, so scaled vitals and one-hot
+# gender columns are credited to core_utils.ALL_FEATURES names. All trees and
+# rows advance together, one depth level per numpy step.
+
+import argparse
+import threading
+import time
+
+import numpy as np
+
+import inference
+import model_registry as registry
+import tree_engine
+
+TOP_FEATURES = 5
+CHUNK_ROWS = 512
+
+_lock = threading.Lock()
+_exact = {}
+
+
+def get_engine(model_name):
+    """The serving engine, or a fresh export when it was compacted
+    (compact_forest.py drops the class values of internal nodes)."""
+    engine = inference.get_engine(model_name)
+    if "value_index" not in engine:
+        return engine
+    key = (model_name, engine.get("source_hash"))
+    exact = _exact.get(key)
+    if exact is None:
+        with _lock:
+            exact = _exact.get(key)
+            if exact is None:
+                exact = tree_engine.export_pipeline(registry.get_model(model_name), registry.get_features())
+                _exact.clear()
+                _exact[key] = exact
+    return exact
+
+
+# -------------------------------
+# Attribution
+# -------------------------------
+def _contributions(engine, X, out):
+    """Accumulate contributions of the rows of X into out (rows, features, classes)."""
+    n_rows, n_features = X.shape
+    flat = X.ravel()
+    feature, lower, upper = engine["feature"], engine["lower"], engine["upper"]
+    children, value = engine["children"], engine["value"]
+    cell = np.tile(np.arange(n_rows, dtype=np.int64) * n_features, engine["n_trees"])
+    node = np.repeat(np.asarray(engine["roots"]), n_rows)
+    cells, parents, kids = [], [], []
+    for _ in range(engine["max_depth"]):
+        f = feature[node]
+        x = flat[f + cell]
+        child = children[2 * node + ((x > lower[node]) & (x <= upper[node]))]
+        # Leaves point to themselves; only rows still moving contribute.
+        moved = np.flatnonzero(child != node)
+        if not len(moved):
+            break
+        node, child, cell = node[moved], child[moved], cell[moved]
+        cells.append(cell + f[moved])
+        parents.append(node)
+        kids.append(child)
+        node = child
+    if not cells:
+        return
+    cells = np.concatenate(cells)
+    delta = value[np.concatenate(kids)] - value[np.concatenate(parents)]
+    acc = out.reshape(n_rows * n_features, -1)
+    for c in range(acc.shape[1]):
+        acc[:, c] += np.bincount(cells, delta[:, c], minlength=len(acc))
+
+
+def contributions(engine, rows):
+    """(bias, contributions) for a dict, list of dicts, DataFrame or array.
+
+    bias has shape (classes,); contributions (rows, features, classes), with
+    features in engine["features"] order and classes in engine["classes"].
+    """
+    if "value_index" in engine:
+        raise ValueError("compacted engines have no internal node values; export the pipeline instead")
+    X = np.ascontiguousarray(tree_engine.encode(engine, rows))
+    out = np.zeros((X.shape[0], X.shape[1], len(engine["classes"])))
+    for start in range(0, X.shape[0], CHUNK_ROWS):
+        _contributions(engine, X[start:start + CHUNK_ROWS], out[start:start + CHUNK_ROWS])
+    out /= engine["n_trees"]
+    bias = engine["value"][np.asarray(engine["roots"])].mean(axis=0)
+    return bias, out
+
+
+def explain(model_name, rows, k=TOP_FEATURES, target=None):
+    """Top-k contributions to each row's predicted class (or to the class
+    `target` when given):
+    [{"prediction", "probability", "bias", "features": [(feature, value, contribution)]}]."""
+    engine = get_engine(model_name)
+    if isinstance(rows, dict):
+        rows = [rows]
+    bias, contrib = contributions(engine, rows)
+    proba = bias + contrib.sum(axis=1)
+    if target is None:
+        best = np.argmax(proba, axis=1)
+    else:
+        best = np.full(len(proba), list(engine["classes"]).index(target))
+    X = rows.to_dict("records") if hasattr(rows, "columns") else rows
+    out = []
+    for i, c in enumerate(best.tolist()):
+        per_feature = contrib[i, :, c]
+        top = np.argsort(-np.abs(per_feature), kind="stable")[:k]
+        out.append({
+            "prediction": engine["classes"][c],
+            "probability": float(proba[i, c]),
+            "bias": float(bias[c]),
+            "features": [
+                (engine["features"][j], X[i][engine["features"][j]], float(per_feature[j]))
+                for j in top.tolist() if per_feature[j] != 0
+            ],
+        })
+    return out
+
+
+# -------------------------------
+# Self-check and benchmark
+# -------------------------------
+def check(n_rows=2000, seed=0):
+    """Max |bias + sum(contributions) - predict_proba| per model, against the
+    engine and against the sklearn pipeline."""
+    from sample_inputs import random_rows
+
+    df = random_rows(n_rows, seed)
+    out = {}
+    for model_name in inference.ENGINE_FILES:
+        engine = get_engine(model_name)
+        bias, contrib = contributions(engine, df)
+        total = bias + contrib.sum(axis=1)
+        pipeline = registry.get_model(model_name).predict_proba(df)
+        out[model_name] = {
+            "engine": float(np.abs(total - tree_engine.predict_proba(engine, df)).max()),
+            "pipeline": float(np.abs(total - pipeline).max()),
+        }
+    return out
+
+
+def bench(n_calls=300, batch=1000, seed=3):
+    from bench_models import percentiles, time_calls
+    from sample_inputs import random_rows
+
+    rows = random_rows(n_calls, seed).to_dict("records")
+    df = random_rows(batch, seed + 1)
+    out = {}
+    for model_name in inference.ENGINE_FILES:
+        explain(model_name, rows[0])
+        t0 = time.perf_counter()
+        explain(model_name, df)
+        out[model_name] = {
+            **percentiles(time_calls(lambda r: explain(model_name, r), [(r,) for r in rows])),
+            "batch_rows": batch,
+            "batch_s": time.perf_counter() - t0,
+        }
+    return out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Feature contributions of the tree models.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    c = sub.add_parser("check", help="verify that contributions add up to the predicted probabilities")
+    c.add_argument("--rows", type=int, default=2000)
+    sub.add_parser("bench", help="single-row and batch explanation latency")
+    args = parser.parse_args(argv)
+
+    if args.command == "check":
+        failed = False
+        for model_name, err in check(args.rows).items():
+            # Only the engine must match exactly: sklearn's float32 thresholds
+            # can send a value sitting on a threshold the other way.
+            ok = err["engine"] < 1e-9
+            failed |= not ok
+            print(f"{'✅' if ok else '❌'} {model_name}: max error vs engine {err['engine']:.2e}, "
+                  f"vs sklearn pipeline {err['pipeline']:.2e}")
+        if failed:
+            raise SystemExit(1)
+    else:
+        for model_name, r in bench().items():
+            print(f"{model_name}: single row p50 {r['p50_ms']:.2f} ms, p99 {r['p99_ms']:.2f} ms; "
+                  f"{r['batch_rows']:,} rows in {r['batch_s'] * 1e3:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+# export.py
+# Bulk export of Diagnosis reports and prediction history, streamed.
+#
+#   python export.py reports --user Karthik --out karthik.zip   # one user's PDFs + history.parquet
+#   python export.py reports --out - > all_reports.zip          # every user
+#   python export.py history --out history.parquet [--user NAME]
+#   python export.py serve --port 8700                          # GET /reports.zip, GET /history.parquet
+#   python export.py serve --signed-only --host 0.0.0.0         # only links signed by the app
+#
+# Both exports are generators of byte chunks. The zip is written front to
+# back with data descriptors (no seeking), PDFs are copied CHUNK_BYTES at a
+# time, and the history is encoded as Parquet row groups of HISTORY_BATCH
+# records read from a cursor over the history table (as CSV inside the zip
+# when the optional pyarrow is not installed). Memory stays at about
+# one chunk plus one row group whatever the size of the export, and nothing
+# is staged on disk. Reports are found through the index in storage.py, so
+# the reports/ folder is never listed.
+#
+# The app's Profile page links to the server (HEALTH_EXPORT_URL) with a URL
+# signed for the signed-in user that expires after LINK_TTL_S; the key is
+# kept in the meta table of health.db, which the app and the server share.
+# Without HEALTH_EXPORT_URL the page offers the zip itself, up to
+# INLINE_MAX_BYTES (a download button needs the whole file in memory).
+
+import argparse
+import csv
+import datetime
+import hashlib
+import hmac
+import importlib.util
+import io
+import os
+import secrets
+import sys
+import time
+import urllib.parse
+import zipfile
+
+import reports
+import storage
+from core_utils import CATEGORICAL_FEATURES, NUMERIC_FEATURES
+
+CHUNK_BYTES = 1 << 16
+HISTORY_BATCH = 10_000
+DEFAULT_PORT = 8700
+EXPORT_URL = os.environ.get("HEALTH_EXPORT_URL")
+LINK_TTL_S = 600
+INLINE_MAX_BYTES = 20 << 20
+# Rough compressed size of one history row in history.parquet.
+HISTORY_ROW_BYTES = 64
+
+
+class _Pipe(io.RawIOBase):
+    """Write-only buffer that the generators drain after every write."""
+
+    def __init__(self):
+        super().__init__()
+        self._parts = []
+        self._pos = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._parts.append(bytes(b))
+        self._pos += len(b)
+        return len(b)
+
+    def tell(self):
+        return self._pos
+
+    def take(self):
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+# -------------------------------
+# History
+# -------------------------------
+def _history_schema():
+    import pyarrow as pa
+
+    return pa.schema(
+        [("id", pa.int64()), ("username", pa.string()), ("timestamp", pa.string()),
+         ("prediction", pa.string()), ("model", pa.string())]
+        + [(f, pa.float64()) for f in NUMERIC_FEATURES]
+        + [(f, pa.string()) for f in CATEGORICAL_FEATURES]
+        + [("symptoms", pa.list_(pa.string()))]
+    )
+
+
+def _number(v):
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return None
+
+
+def _history_table(records, schema):
+    import pyarrow as pa
+
+    # Older records may hold vitals of any JSON type; coerce to the schema.
+    columns = {name: [r[name] for r in records] for name in ("id", "username", "timestamp", "prediction", "model")}
+    for f in NUMERIC_FEATURES:
+        columns[f] = [_number(r["vitals"].get(f)) for r in records]
+    for f in CATEGORICAL_FEATURES:
+        columns[f] = [None if r["vitals"].get(f) is None else str(r["vitals"].get(f)) for r in records]
+    columns["symptoms"] = [r["symptoms"] for r in records]
+    return pa.Table.from_pydict(columns, schema=schema)
+
+
+def iter_history_parquet(username=None, db_path=None, batch_rows=HISTORY_BATCH):
+    """Yield a Parquet file of one user's (or every user's) history, one row
+    group of batch_rows records at a time (vitals as columns)."""
+    import pyarrow.parquet as pq
+
+    schema = _history_schema()
+    sink = _Pipe()
+    writer = pq.ParquetWriter(sink, schema)
+    batch = []
+    for rec in storage.iter_history(db_path, username=username):
+        batch.append(rec)
+        if len(batch) == batch_rows:
+            writer.write_table(_history_table(batch, schema))
+            batch.clear()
+            yield sink.take()
+    if batch:
+        writer.write_table(_history_table(batch, schema))
+    writer.close()
+    yield sink.take()
+
+
+def iter_history_csv(username=None, db_path=None, batch_rows=HISTORY_BATCH):
+    """Like iter_history_parquet(), as UTF-8 CSV (symptoms joined by ";");
+    for installs without pyarrow."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(["id", "username", "timestamp", "prediction", "model"]
+                    + NUMERIC_FEATURES + CATEGORICAL_FEATURES + ["symptoms"])
+    for i, r in enumerate(storage.iter_history(db_path, username=username), 1):
+        writer.writerow([r["id"], r["username"], r["timestamp"], r["prediction"], r["model"]]
+                        + [_number(r["vitals"].get(f)) for f in NUMERIC_FEATURES]
+                        + [r["vitals"].get(f) for f in CATEGORICAL_FEATURES]
+                        + [";".join(r["symptoms"])])
+        if i % batch_rows == 0:
+            yield buf.getvalue().encode()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue().encode()
+
+
+def has_parquet():
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+# -------------------------------
+# Reports
+# -------------------------------
+def _zip_info(entry, folder):
+    created = datetime.datetime.fromisoformat(entry["created"])
+    info = zipfile.ZipInfo(f"{folder}/{entry['name']}", date_time=created.timetuple()[:6])
+    info.compress_type = zipfile.ZIP_DEFLATED
+    return info
+
+
+def iter_reports_zip(username=None, include_history=True, db_path=None, reports_dir=None):
+    """Yield a zip of one user's (or every user's) reports as <user>/<name>.pdf,
+    plus history.parquet (history.csv without pyarrow) when include_history is set."""
+    sink = _Pipe()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for entry in storage.list_reports(username, db_path):
+            folder = reports.user_dir(entry["username"], reports_dir)
+            try:
+                f = open(os.path.join(folder, entry["name"]), "rb")
+            except FileNotFoundError:
+                continue  # deleted outside reports.py; `reports.py compact` drops it from the index
+            with f, zf.open(_zip_info(entry, os.path.basename(folder)), "w") as out:
+                while chunk := f.read(CHUNK_BYTES):
+                    out.write(chunk)
+                    yield sink.take()
+            yield sink.take()
+        if include_history:
+            name, history = (("history.parquet", iter_history_parquet) if has_parquet()
+                             else ("history.csv", iter_history_csv))
+            with zf.open(name, "w", force_zip64=True) as out:
+                for chunk in history(username, db_path):
+                    out.write(chunk)
+                    yield sink.take()
+    yield sink.take()
+
+
+def estimated_bytes(username, db_path=None):
+    """Upper estimate of a user's zip: their PDFs plus the history rows."""
+    reports_bytes = sum(r["bytes"] for r in storage.list_reports(username, db_path))
+    return reports_bytes + storage.count_history(username, db_path) * HISTORY_ROW_BYTES
+
+
+class TooLarge(ValueError):
+    pass
+
+
+def bounded_bytes(chunks, max_bytes=INLINE_MAX_BYTES):
+    """The chunks as one bytes object; raises TooLarge past max_bytes, so a
+    wrong estimate never holds more than max_bytes."""
+    buf = io.BytesIO()
+    for chunk in chunks:
+        if buf.tell() + len(chunk) > max_bytes:
+            raise TooLarge(f"export is larger than {max_bytes:,} bytes")
+        buf.write(chunk)
+    return buf.getvalue()
+
+
+def write(chunks, out):
+    """Write chunks to a path ("-" for stdout); returns the byte count."""
+    n = 0
+    f = sys.stdout.buffer if out == "-" else open(out, "wb")
+    try:
+        for chunk in chunks:
+            f.write(chunk)
+            n += len(chunk)
+    finally:
+        if f is not sys.stdout.buffer:
+            f.close()
+    return n
+
+
+# -------------------------------
+# Signed links
+# -------------------------------
+_keys = {}
+
+
+def _key(db_path=None):
+    """Signing key, created once per database and shared by app and server."""
+    path = db_path or storage.DB_PATH
+    key = _keys.get(path)
+    if key is None:
+        key = _keys[path] = storage.setdefault_meta("export_link_key", secrets.token_hex(32), db_path).encode()
+    return key
+
+
+def _signature(username, expires, db_path=None):
+    return hmac.new(_key(db_path), f"{username}\n{expires}".encode(), hashlib.sha256).hexdigest()
+
+
+def signed_url(base_url, username, ttl_s=LINK_TTL_S, db_path=None):
+    """/reports.zip link for one user, valid for ttl_s seconds."""
+    expires = int(time.time()) + ttl_s
+    query = urllib.parse.urlencode({"user": username, "expires": expires,
+                                    "sig": _signature(username, expires, db_path)})
+    return f"{base_url.rstrip('/')}/reports.zip?{query}"
+
+
+def check_signature(username, expires, sig, db_path=None):
+    try:
+        expires = int(expires)
+    except (TypeError, ValueError):
+        return False
+    return (username is not None and expires >= time.time()
+            and hmac.compare_digest(_signature(username, expires, db_path), sig or ""))
+
+
+# -------------------------------
+# HTTP
+# -------------------------------
+def create_app(db_path=None, signed_only=False):
+    """Starlette app: GET /reports.zip[?user=&history=0], GET /history.parquet[?user=].
+
+    A request carrying sig= must match signed_url(); with signed_only,
+    /reports.zip requires it and /history.parquet is not served.
+    """
+    from starlette.applications import Starlette
+    from starlette.responses import PlainTextResponse, StreamingResponse
+    from starlette.routing import Route
+
+    def attachment(name):
+        return {"Content-Disposition": f'attachment; filename="{name}"'}
+
+    def forbidden():
+        return PlainTextResponse("invalid or expired link", status_code=403)
+
+    async def reports_zip(request):
+        user = request.query_params.get("user")
+        if signed_only or "sig" in request.query_params:
+            q = request.query_params
+            if not check_signature(user, q.get("expires"), q.get("sig"), db_path):
+                return forbidden()
+        chunks = iter_reports_zip(user, request.query_params.get("history", "1") != "0", db_path)
+        return StreamingResponse(chunks, media_type="application/zip", headers=attachment("reports.zip"))
+
+    async def history_parquet(request):
+        if signed_only:
+            return forbidden()
+        chunks = iter_history_parquet(request.query_params.get("user"), db_path)
+        return StreamingResponse(chunks, media_type="application/vnd.apache.parquet",
+                                 headers=attachment("history.parquet"))
+
+    return Starlette(routes=[
+        Route("/reports.zip", reports_zip),
+        Route("/history.parquet", history_parquet),
+    ])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export Diagnosis reports and history.")
+    parser.add_argument("--db", default=storage.DB_PATH)
+    sub = parser.add_subparsers(dest="command", required=True)
+    r = sub.add_parser("reports", help="zip of report PDFs (and history.parquet)")
+    r.add_argument("--user", help="only this user (default everyone)")
+    r.add_argument("--no-history", action="store_true")
+    r.add_argument("--out", required=True, help="zip file, or - for stdout")
+    h = sub.add_parser("history", help="history as Parquet")
+    h.add_argument("--user")
+    h.add_argument("--out", required=True, help="parquet file, or - for stdout")
+    s = sub.add_parser("serve", help="stream exports over HTTP (without --signed-only: no authentication, keep it local)")
+    s.add_argument("--host", default="127.0.0.1")
+    s.add_argument("--port", type=int, default=DEFAULT_PORT)
+    s.add_argument("--signed-only", action="store_true", help="serve only links signed by the app")
+    args = parser.parse_args(argv)
+
+    storage.init_db(args.db)
+    if args.command == "serve":
+        import uvicorn
+
+        uvicorn.run(create_app(args.db, args.signed_only), host=args.host, port=args.port)
+        return
+    if args.command == "reports":
+        n = write(iter_reports_zip(args.user, not args.no_history, args.db), args.out)
+    else:
+        n = write(iter_history_parquet(args.user, args.db), args.out)
+    if args.out != "-":
+        print(f"✅ {n / 1e6:.1f} MB → {args.out}")
+
+
+if __name__ == "__main__":
+    main()
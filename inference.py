@@ -0,0 +1,138 @@
+# inference.py
+# Single entry point for disease prediction, shared by the app and tools.
+#
+# Uses the flat tree engine exported next to each pipeline (see tree_engine.py)
+# and falls back to exporting it on the fly from the loaded pipeline when the
+# engine file is missing or was exported from a different pipeline file.
+
+import threading
+
+import numpy as np
+
+import lookup_index
+import model_registry as registry
+import prediction_cache
+import tree_engine
+
+ENGINE_FILES = {
+    "Random Forest": "rf_engine.joblib",
+    "Decision Tree": "dt_engine.joblib",
+}
+
+TOP_K = 3
+
+_lock = threading.Lock()
+_exported = {}
+_stacked = {}
+
+
+def get_engine(model_name):
+    """Return the tree engine matching the current pipeline artifact."""
+    source_hash = registry.artifact_hash(registry.MODEL_FILES[model_name])
+    engine_file = ENGINE_FILES[model_name]
+    if registry.exists(engine_file):
+        engine = registry.load(engine_file)
+        if engine.get("source_hash") == source_hash:
+            return engine
+
+    key = (model_name, source_hash)
+    engine = _exported.get(key)
+    if engine is None:
+        with _lock:
+            engine = _exported.get(key)
+            if engine is None:
+                engine = tree_engine.export_pipeline(
+                    registry.get_model(model_name), registry.get_features()
+                )
+                engine["source_hash"] = source_hash
+                # Only the engine of the current artifact is worth keeping.
+                for old in [k for k in _exported if k[0] == model_name]:
+                    del _exported[old]
+                _exported[key] = engine
+    return engine
+
+
+def engine_hash(engine):
+    """Identity of an engine for caches: the pipeline artifact hash, or the
+    engine's own hash when it was changed after export (compact_forest.py)."""
+    return engine.get("engine_hash") or engine["source_hash"]
+
+
+def predict_proba(model_name, rows):
+    """Class probabilities for a dict, list of dicts, DataFrame or 2-D array."""
+    return tree_engine.predict_proba(get_engine(model_name), rows)
+
+
+def predict(model_name, rows):
+    """Predicted labels for a dict, list of dicts, DataFrame or 2-D array."""
+    return tree_engine.predict(get_engine(model_name), rows)
+
+
+def predict_one(model_name, data):
+    """Predicted disease (str) for one feature dict as built by the app.
+
+    Memoized in prediction_cache on the canonical feature tuple, the model
+    name and engine_hash() of the engine.
+    """
+    engine = get_engine(model_name)
+    key = prediction_cache.make_key(model_name, engine_hash(engine), data, engine["features"])
+    return prediction_cache.cached(key, lambda: str(tree_engine.predict(engine, data)[0]))
+
+
+def get_stacked(model_names):
+    """One stacked engine over several models (see tree_engine.stack)."""
+    engines = [get_engine(name) for name in model_names]
+    key = (tuple(model_names), tuple(engine_hash(e) for e in engines))
+    stacked = _stacked.get(key)
+    if stacked is None:
+        stacked = tree_engine.stack(engines)
+        with _lock:
+            _stacked.clear()
+            _stacked[key] = stacked
+    return stacked
+
+
+def _summarize(model_names, stacked, probas, k):
+    """Per-row {"models": {...}, "agree": bool} dicts from stacked probabilities."""
+    results = []
+    for row in range(len(probas[0])):
+        out = {}
+        for name, m, proba in zip(model_names, stacked["members"], probas):
+            p = proba[row]
+            order = np.argsort(-p, kind="stable")[:k]
+            classes = m["engine"]["classes"]
+            out[name] = {
+                "prediction": str(classes[order[0]]),
+                "top_k": [(str(classes[i]), float(p[i])) for i in order if p[i] > 0 or i == order[0]],
+            }
+        results.append({"models": out, "agree": len({r["prediction"] for r in out.values()}) == 1})
+    return results
+
+
+def predict_all_batch(rows, k=TOP_K, model_names=None):
+    """predict_all() for a list of dicts, a DataFrame or an encoded array
+    (not memoized); one result dict per row."""
+    model_names = list(model_names or registry.MODEL_FILES)
+    stacked = get_stacked(model_names)
+    return _summarize(model_names, stacked, tree_engine.predict_proba_stacked(stacked, rows), k)
+
+
+def predict_all(data, k=TOP_K, model_names=None):
+    """Every model's top-k diseases for one feature dict, in a single pass.
+
+    Returns {"models": {name: {"prediction": str, "top_k": [(disease, p), ...]}},
+    "agree": bool}. Inputs covered by the precomputed index (lookup_index.py)
+    are answered from it, with "source": "index" added. Otherwise the
+    features are encoded once and all trees of all models are walked
+    together; memoized like predict_one().
+    """
+    model_names = list(model_names or registry.MODEL_FILES)
+    result = lookup_index.lookup(data, model_names, k)
+    if result is not None:
+        return result
+    stacked = get_stacked(model_names)
+    hashes = "+".join(engine_hash(m["engine"]) for m in stacked["members"])
+    key = prediction_cache.make_key(("all", tuple(model_names), k), hashes, data, stacked["features"])
+    return prediction_cache.cached(
+        key, lambda: _summarize(model_names, stacked, tree_engine.predict_proba_stacked(stacked, data), k)[0]
+    )
@@ -0,0 +1,398 @@
+# inference_service.py
+# HTTP inference service with request micro-batching.
+#
+#   python inference_service.py serve --port 8600                  # batching on
+#   python inference_service.py serve --port 8600 --no-batching
+#   python inference_service.py loadgen --concurrency 64 --requests 5000
+#
+# POST /predict        one feature dict (core_utils.ALL_FEATURES) → inference.predict_all() result;
+#                      ?explain=<model> adds explain.explain() of that model's prediction as "why"
+# POST /predict_batch  {"rows": [feature dict, ...]} → {"results": [...]}
+# GET  /health         model hashes and batching counters
+# GET  /metrics        Prometheus text (see metrics.py)
+#
+# Concurrent /predict requests are queued and flushed as one vectorized
+# prediction when max_batch rows are waiting or max_wait_ms after the first
+# one arrived. Rows are validated before they are queued (422 on bad input),
+# and a batch that still fails is retried row by row, so one bad row only
+# fails its own request. Prediction runs in a worker thread, off the event
+# loop. The Streamlit app uses the service instead of in-process
+# prediction when HEALTH_INFERENCE_URL is set (see predict_remote()).
+
+import argparse
+import asyncio
+import contextlib
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.parse
+import urllib.request
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route
+
+import explain
+import inference
+import metrics
+import model_registry as registry
+from core_utils import ALL_FEATURES, CATEGORICAL_FEATURES
+
+MAX_BATCH = int(os.environ.get("HEALTH_MAX_BATCH", 64))
+MAX_WAIT_MS = float(os.environ.get("HEALTH_MAX_WAIT_MS", 2.0))
+MAX_BATCH_ROWS = 10000
+DEFAULT_PORT = 8600
+
+
+# -------------------------------
+# Micro-batching
+# -------------------------------
+class MicroBatcher:
+    """Collect single rows from concurrent requests into one predict call."""
+
+    def __init__(self, predict_rows, max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS):
+        self.predict_rows = predict_rows
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms / 1000.0
+        self.batches = 0
+        self.rows = 0
+        self._queue = None
+        self._task = None
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    async def submit(self, row):
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((row, future))
+        return await future
+
+    async def _collect(self):
+        items = [await self._queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.max_wait
+        while len(items) < self.max_batch:
+            try:
+                items.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                items.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return items
+
+    def _predict(self, rows):
+        """[(result, exception)] per row; a failed batch is retried row by row."""
+        try:
+            with metrics.timed("service.batch_predict"):
+                return [(r, None) for r in self.predict_rows(rows)]
+        except Exception as e:
+            if len(rows) == 1:
+                return [(None, e)]
+        out = []
+        for row in rows:
+            try:
+                with metrics.timed("service.row_retry"):
+                    out.append((self.predict_rows([row])[0], None))
+            except Exception as e:
+                out.append((None, e))
+        return out
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            items = await self._collect()
+            self.batches += 1
+            self.rows += len(items)
+            outcomes = await loop.run_in_executor(None, self._predict, [row for row, _ in items])
+            for (_, future), (result, error) in zip(items, outcomes):
+                if future.done():
+                    continue
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(error)
+
+
+# -------------------------------
+# HTTP app
+# -------------------------------
+def _check(row):
+    """(clean row, problems): features coerced to what the models expect
+    (numbers as finite floats, categories as strings), and
+    {"missing": [...], "invalid": [...]} when something is wrong."""
+    if not isinstance(row, dict):
+        return None, {"missing": list(ALL_FEATURES)}
+    clean, missing, invalid = {}, [], []
+    for f in ALL_FEATURES:
+        if f not in row or row[f] is None:
+            missing.append(f)
+        elif f in CATEGORICAL_FEATURES:
+            clean[f] = str(row[f])
+        else:
+            try:
+                clean[f] = float(row[f])
+            except (TypeError, ValueError):
+                invalid.append(f)
+                continue
+            if not math.isfinite(clean[f]):
+                invalid.append(f)
+    problems = {k: v for k, v in (("missing", missing), ("invalid", invalid)) if v}
+    return clean, problems
+
+
+async def _json(request):
+    """Parsed request body, or None when it is not valid JSON."""
+    try:
+        return await request.json()
+    except ValueError:  # JSONDecodeError and UnicodeDecodeError
+        return None
+
+
+def _bad_json():
+    return JSONResponse({"error": "request body is not valid JSON"}, status_code=400)
+
+
+def create_app(max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS, k=inference.TOP_K):
+    """Starlette app; max_batch=1 turns micro-batching off."""
+    batcher = MicroBatcher(lambda rows: inference.predict_all_batch(rows, k), max_batch, max_wait_ms)
+
+    async def predict(request):
+        t0 = time.perf_counter()
+        body = await _json(request)
+        if body is None:
+            return _bad_json()
+        row, problems = _check(body)
+        if problems:
+            return JSONResponse({"error": "invalid features", **problems}, status_code=422)
+        explain_model = request.query_params.get("explain")
+        if explain_model is not None and explain_model not in registry.MODEL_FILES:
+            return JSONResponse({"error": f"unknown model {explain_model!r}"}, status_code=422)
+        if batcher.max_batch == 1:
+            batcher.batches += 1
+            batcher.rows += 1
+            result, error = (await asyncio.get_running_loop().run_in_executor(None, batcher._predict, [row]))[0]
+            if error is not None:
+                raise error
+        else:
+            result = await batcher.submit(row)
+        if explain_model is not None:
+            target = result["models"][explain_model]["prediction"]
+            why = await asyncio.get_running_loop().run_in_executor(
+                None, lambda: explain.explain(explain_model, row, target=target)[0])
+            result = {**result, "why": why}
+        metrics.observe("request", "service.predict", time.perf_counter() - t0)
+        return JSONResponse(result)
+
+    async def predict_batch(request):
+        body = await _json(request)
+        if body is None:
+            return _bad_json()
+        rows = body.get("rows", []) if isinstance(body, dict) else None
+        if not isinstance(rows, list):
+            return JSONResponse({"error": 'expected {"rows": [feature dict, ...]}'}, status_code=422)
+        if len(rows) > MAX_BATCH_ROWS:
+            return JSONResponse({"error": f"at most {MAX_BATCH_ROWS} rows per request"}, status_code=413)
+        checked = [_check(r) for r in rows]
+        bad = {i: problems for i, (_, problems) in enumerate(checked) if problems}
+        if bad:
+            return JSONResponse({"error": "invalid features", "rows": bad}, status_code=422)
+        clean = [row for row, _ in checked]
+        results = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: inference.predict_all_batch(clean, k) if clean else [])
+        return JSONResponse({"results": results})
+
+    async def health(request):
+        return JSONResponse({
+            "models": {name: registry.artifact_hash(f) for name, f in registry.MODEL_FILES.items()},
+            "max_batch": batcher.max_batch,
+            "max_wait_ms": batcher.max_wait * 1000.0,
+            "batches": batcher.batches,
+            "batched_rows": batcher.rows,
+        })
+
+    async def metrics_text(request):
+        return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        inference.get_stacked(list(registry.MODEL_FILES))  # warm up before the first request
+        batcher.start()
+        yield
+        await batcher.stop()
+
+    return Starlette(routes=[
+        Route("/predict", predict, methods=["POST"]),
+        Route("/predict_batch", predict_batch, methods=["POST"]),
+        Route("/health", health),
+        Route("/metrics", metrics_text),
+    ], lifespan=lifespan)
+
+
+# -------------------------------
+# Client
+# -------------------------------
+def predict_remote(url, data, explain_model=None, timeout=5.0):
+    """Call /predict on a running service; same result as inference.predict_all(),
+    plus the service's explanation of explain_model's prediction as "why"."""
+    body = json.dumps({f: data[f] for f in ALL_FEATURES}).encode()
+    query = "" if explain_model is None else "?" + urllib.parse.urlencode({"explain": explain_model})
+    req = urllib.request.Request(url.rstrip("/") + "/predict" + query, data=body,
+                                 headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        result = json.load(resp)
+    for res in result["models"].values():
+        res["top_k"] = [tuple(t) for t in res["top_k"]]
+    if "why" in result:
+        result["why"]["features"] = [tuple(t) for t in result["why"]["features"]]
+    return result
+
+
+# -------------------------------
+# Load generator
+# -------------------------------
+async def _post(reader, writer, host, path, body):
+    writer.write(
+        f"POST {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+    )
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode().partition(":")
+        if name.lower() == "content-length":
+            length = int(value)
+    await reader.readexactly(length)
+    return status
+
+
+async def _drive(host, port, bodies, concurrency):
+    """Send bodies to /predict over `concurrency` keep-alive connections."""
+    latencies, errors = [], 0
+    it = iter(bodies)
+
+    async def client():
+        nonlocal errors
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            for body in it:
+                t0 = time.perf_counter()
+                if await _post(reader, writer, host, "/predict", body) != 200:
+                    errors += 1
+                latencies.append(time.perf_counter() - t0)
+        finally:
+            writer.close()
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return time.perf_counter() - t0, latencies, errors
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_ready(url, proc, timeout=60.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("service exited during startup")
+        try:
+            with urllib.request.urlopen(url + "/health", timeout=1) as resp:
+                return json.load(resp)
+        except OSError:
+            time.sleep(0.2)
+    raise TimeoutError(f"{url} did not become ready")
+
+
+def loadgen(n_requests=5000, concurrency=64, max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS):
+    """Start the service with batching on and off and drive it with the same load."""
+    from bench_models import percentiles
+    from sample_inputs import random_rows
+
+    rows = random_rows(n_requests, seed=4).to_dict("records")
+    bodies = [json.dumps({k: (v.item() if hasattr(v, "item") else v) for k, v in r.items()}).encode()
+              for r in rows]
+    results = {}
+    for mode, batch in [("batching_on", max_batch), ("batching_off", 1)]:
+        port = _free_port()
+        proc = subprocess.Popen(
+            [sys.executable, "-W", "ignore", os.path.abspath(__file__), "serve", "--port", str(port),
+             "--max-batch", str(batch), "--max-wait-ms", str(max_wait_ms), "--log-level", "warning"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+        try:
+            url = f"http://127.0.0.1:{port}"
+            _wait_ready(url, proc)
+            asyncio.run(_drive("127.0.0.1", port, bodies[:200], min(concurrency, 8)))  # warm up
+            seconds, latencies, errors = asyncio.run(_drive("127.0.0.1", port, bodies, concurrency))
+            with urllib.request.urlopen(url + "/health") as resp:
+                health = json.load(resp)
+        finally:
+            proc.terminate()
+            proc.wait()
+        results[mode] = {
+            "requests": len(latencies),
+            "errors": errors,
+            "requests_per_sec": len(latencies) / seconds,
+            "mean_batch": health["batched_rows"] / max(health["batches"], 1),
+            **percentiles(latencies),
+        }
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Disease prediction HTTP service.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve = sub.add_parser("serve")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=DEFAULT_PORT)
+    serve.add_argument("--max-batch", type=int, default=MAX_BATCH)
+    serve.add_argument("--max-wait-ms", type=float, default=MAX_WAIT_MS)
+    serve.add_argument("--no-batching", action="store_true")
+    serve.add_argument("--log-level", default="info")
+    load = sub.add_parser("loadgen")
+    load.add_argument("--requests", type=int, default=5000)
+    load.add_argument("--concurrency", type=int, default=64)
+    load.add_argument("--max-batch", type=int, default=MAX_BATCH)
+    load.add_argument("--max-wait-ms", type=float, default=MAX_WAIT_MS)
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        import uvicorn
+
+        app = create_app(1 if args.no_batching else args.max_batch, args.max_wait_ms)
+        uvicorn.run(app, host=args.host, port=args.port, log_level=args.log_level)
+        return
+
+    results = loadgen(args.requests, args.concurrency, args.max_batch, args.max_wait_ms)
+    print(f"{'mode':<14}{'req/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'batch':>7}{'errors':>8}")
+    for mode, r in results.items():
+        print(f"{mode:<14}{r['requests_per_sec']:>10.0f}{r['p50_ms']:>9.2f}{r['p95_ms']:>9.2f}"
+              f"{r['p99_ms']:>9.2f}{r['mean_batch']:>7.1f}{r['errors']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+# loadgen.py
+# Headless load test of the app's flows with many concurrent sessions.
+#
+#   python loadgen.py --sessions 16 --iterations 20 --out load_results.json
+#   python loadgen.py --sessions 32 --reload-every 2
+#   python loadgen.py --sessions 16 --out new.json --compare load_results.json
+#
+# Every session is a thread, as in one Streamlit server process. It signs up
+# and logs in, then repeats: diagnosis (predict, explain, save to history,
+# queue the PDF), a history page, a feedback submit and the feedback list.
+# All calls go through app/handlers.py, the code the pages run. Everything is
+# written to a fresh temporary directory (database, reports/ and a copy of
+# models/), so real data is never touched. --reload-every S rewrites the RF
+# artifact every S seconds with the same model in different bytes, which
+# forces the reload and engine re-export a retrain would cause.
+#
+# Reported: throughput, p50/p95/p99 per flow, errors, lost writes (rows and
+# report files that calls reported as saved but that are missing
+# afterwards), and the per-stage time breakdown recorded by metrics.py.
+
+import argparse
+import collections
+import contextlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import joblib
+import numpy as np
+
+import metrics
+import model_registry as registry
+import reports
+import storage
+from app import handlers
+from bench_models import percentiles
+from sample_inputs import random_rows
+from core_utils import CATEGORICAL_FEATURES, NUMERIC_FEATURES, SYMPTOMS
+
+MODEL_CHOICES = ["Random Forest", "Decision Tree"]
+FLOWS = ["signup", "login", "diagnosis", "history", "feedback_submit", "feedback"]
+# Stages recorded inside a request; others (report.*) run on background workers.
+REQUEST_STAGES = ("signup.", "login.", "diagnosis.", "history.", "feedback.")
+REPORT_TIMEOUT_S = 120
+
+
+# -------------------------------
+# Sandbox
+# -------------------------------
+@contextlib.contextmanager
+def sandbox(models_dir=None):
+    """Point storage, reports and the model registry at a temp directory."""
+    saved = (storage.DB_PATH, reports.REPORTS_DIR, registry.MODEL_DIR)
+    tmp = tempfile.mkdtemp(prefix="health_load_")
+    try:
+        storage.DB_PATH = os.path.join(tmp, "health.db")
+        reports.REPORTS_DIR = os.path.join(tmp, "reports")
+        registry.MODEL_DIR = os.path.join(tmp, "models")
+        shutil.copytree(models_dir or saved[2], registry.MODEL_DIR)
+        registry.clear()
+        metrics.reset()
+        missing = os.path.join(tmp, "missing")
+        storage.init_db(users_json=missing, feedback_txt=missing)
+        yield tmp
+    finally:
+        storage.DB_PATH, reports.REPORTS_DIR, registry.MODEL_DIR = saved
+        registry.clear()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+class Reloader(threading.Thread):
+    """Swap rf_model.joblib between two encodings of the same forest."""
+
+    def __init__(self, every_s):
+        super().__init__(daemon=True)
+        self.every_s = every_s
+        self.reloads = 0
+        self._done = threading.Event()
+        path = os.path.join(registry.MODEL_DIR, registry.MODEL_FILES["Random Forest"])
+        model = joblib.load(path)
+        self.variants = []
+        for compress in (0, 3):
+            variant = f"{path}.z{compress}"
+            joblib.dump(model, variant, compress=compress)
+            self.variants.append(variant)
+        self.path = path
+
+    def run(self):
+        while not self._done.wait(self.every_s):
+            tmp = f"{self.path}.tmp"
+            shutil.copyfile(self.variants[self.reloads % 2], tmp)
+            os.replace(tmp, self.path)
+            self.reloads += 1
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+# -------------------------------
+# Sessions
+# -------------------------------
+def _inputs(n, seed):
+    """[(vitals, selected symptoms)] shaped like Diagnosis page input."""
+    out = []
+    for row in random_rows(n, seed).to_dict("records"):
+        vitals = {f: row[f] for f in NUMERIC_FEATURES + CATEGORICAL_FEATURES}
+        out.append((vitals, [s for s in SYMPTOMS if row[s]]))
+    return out
+
+
+def run_session(i, iterations, start, log):
+    """One simulated user. Appends (flow, seconds, error) to log and returns
+    what should have been written: {"user", "diagnoses", "feedback", "reports"}."""
+    user, password = f"load_{i}", f"pw{i}"
+    written = {"user": None, "diagnoses": 0, "feedback": 0, "reports": set()}
+    rng = np.random.default_rng(i)
+    inputs = _inputs(iterations, seed=1000 + i)
+
+    def call(flow, fn, *args):
+        t0 = time.perf_counter()
+        error = None
+        try:
+            with metrics.request(flow):
+                return fn(*args)
+        except Exception as e:  # a failed call is counted, the session goes on
+            error = f"{type(e).__name__}: {e}"
+        finally:
+            log.append((flow, time.perf_counter() - t0, error))
+
+    start.wait()
+    created = call("signup", handlers.signup, user, password, password, "")
+    if created and created[0]:
+        written["user"] = user
+    if not call("login", handlers.login, user, password):
+        log.append(("login", 0.0, "login rejected"))
+        return written
+    for it, (vitals, selected) in enumerate(inputs):
+        model = MODEL_CHOICES[int(rng.integers(len(MODEL_CHOICES)))]
+        out = call("diagnosis", handlers.diagnose, user, vitals, selected, model)
+        if out:
+            written["diagnoses"] += 1
+            written["reports"].add(out["report_key"])
+        call("history", handlers.history_page, user)
+        if call("feedback_submit", handlers.submit_feedback, user, f"load test feedback {it}"):
+            written["feedback"] += 1
+        call("feedback", handlers.recent_feedback, user)
+    return written
+
+
+def _wait_reports(jobs, timeout_s=REPORT_TIMEOUT_S):
+    """Wait for queued PDFs, given as (user, key); returns the number that
+    failed or timed out."""
+    deadline = time.time() + timeout_s
+    failed = 0
+    for user, key in jobs:
+        while True:
+            try:
+                if reports.get_report(key) is not None:
+                    break
+            except KeyError:
+                # No longer tracked (reports.MAX_TRACKED): wait for the index
+                # row, the job's last write, so nothing outlives the sandbox.
+                name = os.path.basename(reports.report_path(user, key))
+                if any(r["name"] == name for r in storage.list_reports(user)):
+                    break
+            except Exception:
+                failed += 1
+                break
+            if time.time() > deadline:
+                failed += 1
+                break
+            time.sleep(0.01)
+    return failed
+
+
+def count_lost(sessions):
+    """Compare what the sessions wrote with what is in the database and on disk."""
+    conn = storage.connect()
+    lost = collections.Counter()
+    users = {u for (u,) in conn.execute("SELECT username FROM users")}
+    for w in sessions:
+        user = w["user"]
+        if user is None:
+            continue
+        lost["users"] += user not in users
+        history = conn.execute("SELECT COUNT(*) FROM history WHERE username = ?", (user,)).fetchone()[0]
+        lost["history"] += max(0, w["diagnoses"] - history)
+        lost["stats"] += abs(storage.count_history(user) - history)
+        feedback = conn.execute("SELECT COUNT(*) FROM feedback WHERE username = ?", (user,)).fetchone()[0]
+        lost["feedback"] += max(0, w["feedback"] - feedback)
+        indexed = {r["name"] for r in storage.list_reports(user)}
+        for key in w["reports"]:
+            path = reports.report_path(user, key)
+            lost["reports"] += not os.path.exists(path) or os.path.basename(path) not in indexed
+    return {k: lost[k] for k in ("users", "history", "stats", "feedback", "reports")}
+
+
+def run(n_sessions=16, iterations=20, reload_every=None, models_dir=None):
+    with sandbox(models_dir):
+        # Warm the models once so the first sessions do not all pay the load.
+        handlers.inference.predict_all(_inputs(1, 0)[0][0] | {s: 0 for s in SYMPTOMS})
+        metrics.reset()
+
+        reloader = Reloader(reload_every) if reload_every else None
+        start = threading.Barrier(n_sessions + 1)
+        log = []
+        written = [None] * n_sessions
+
+        def session(i):
+            written[i] = run_session(i, iterations, start, log)
+
+        threads = [threading.Thread(target=session, args=(i,)) for i in range(n_sessions)]
+        for t in threads:
+            t.start()
+        if reloader:
+            reloader.start()
+        start.wait()
+        t0 = time.perf_counter()
+        for t in threads:
+            t.join()
+        wall_s = time.perf_counter() - t0
+        if reloader:
+            reloader.stop()
+        failed_reports = _wait_reports({(w["user"], key) for w in written for key in w["reports"]})
+        report_s = time.perf_counter() - t0 - wall_s
+
+        flows = {}
+        for flow in FLOWS:
+            samples = [s for f, s, e in log if f == flow and e is None]
+            errors = [e for f, _, e in log if f == flow and e is not None]
+            flows[flow] = {"calls": len(samples) + len(errors), "errors": len(errors),
+                           "first_error": errors[0] if errors else None}
+            if samples:
+                flows[flow].update(percentiles(samples))
+
+        snap = metrics.snapshot()
+        request_s = sum(v["sum"] for v in snap.get("request", {}).values())
+        stages = {
+            label: {"count": v["count"], "total_s": v["sum"], "mean_ms": 1e3 * v["sum"] / v["count"],
+                    "share": v["sum"] / request_s if request_s and label.startswith(REQUEST_STAGES) else None}
+            for label, v in sorted(snap.get("stage", {}).items(), key=lambda kv: -kv[1]["sum"])
+        }
+        return {
+            "sessions": n_sessions,
+            "iterations": iterations,
+            "reload_every_s": reload_every,
+            "reloads": reloader.reloads if reloader else 0,
+            "wall_s": wall_s,
+            "requests": len(log),
+            "requests_per_sec": len(log) / wall_s,
+            "report_drain_s": report_s,
+            "failed_reports": failed_reports,
+            "flows": flows,
+            "stages": stages,
+            "lost_writes": count_lost(written),
+        }
+
+
+# -------------------------------
+# Output
+# -------------------------------
+def print_results(r):
+    print(f"{r['sessions']} sessions x {r['iterations']} iterations: {r['requests']:,} requests in "
+          f"{r['wall_s']:.2f}s = {r['requests_per_sec']:.0f} req/s"
+          + (f", {r['reloads']} model reloads" if r["reloads"] else ""))
+    print(f"{'flow':<16}{'calls':>7}{'errors':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for flow, f in r["flows"].items():
+        if f["calls"]:
+            print(f"{flow:<16}{f['calls']:>7}{f['errors']:>8}{f.get('p50_ms', 0):>9.2f}"
+                  f"{f.get('p95_ms', 0):>9.2f}{f.get('p99_ms', 0):>9.2f}")
+    # share: of all request time; bg: background worker, not part of a request
+    print(f"{'stage':<28}{'count':>7}{'mean ms':>9}{'total s':>9}{'share':>8}")
+    for label, s in r["stages"].items():
+        share = "bg" if s["share"] is None else f"{s['share']:.1%}"
+        print(f"{label:<28}{s['count']:>7}{s['mean_ms']:>9.2f}{s['total_s']:>9.2f}{share:>8}")
+    print(f"PDFs drained {r['report_drain_s']:.2f}s after the last request ({r['failed_reports']} failed)")
+    lost = r["lost_writes"]
+    print(("✅ No lost writes" if not any(lost.values()) else "❌ Lost writes: ")
+          + ", ".join(f"{k} {v}" for k, v in lost.items() if v))
+    for flow, f in r["flows"].items():
+        if f["first_error"]:
+            print(f"❌ {flow}: {f['errors']} errors, first: {f['first_error']}")
+
+
+def compare(new, old):
+    """Print old/new per-flow latency and overall throughput."""
+    print(f"{'metric':<34}{'old':>10}{'new':>10}{'ratio':>8}")
+    o, n = old["requests_per_sec"], new["requests_per_sec"]
+    print(f"{'requests/s':<34}{o:>10.0f}{n:>10.0f}{n / o:>8.2f}")
+    for flow, f in new["flows"].items():
+        prev = old["flows"].get(flow, {})
+        for q in ("p50_ms", "p99_ms"):
+            if q in f and prev.get(q):
+                print(f"{flow + ' ' + q:<34}{prev[q]:>10.2f}{f[q]:>10.2f}{f[q] / prev[q]:>8.2f}")
+    for k, v in new["lost_writes"].items():
+        print(f"{'lost ' + k:<34}{old['lost_writes'].get(k, 0):>10}{v:>10}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent-session load test of the app flows.")
+    parser.add_argument("--sessions", type=int, default=16)
+    parser.add_argument("--iterations", type=int, default=20, help="diagnosis/history/feedback rounds per session")
+    parser.add_argument("--reload-every", type=float, help="rewrite the RF artifact every S seconds")
+    parser.add_argument("--models", help="models directory to copy (default models/)")
+    parser.add_argument("--out", help="write results as JSON")
+    parser.add_argument("--compare", help="previous results JSON to compare against")
+    args = parser.parse_args(argv)
+
+    results = run(args.sessions, args.iterations, args.reload_every, args.models)
+    print_results(results)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Results written to {args.out}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,484 @@
+# lookup_index.py
+# Precomputed predictions over the symptom lattice and bucketed vitals.
+#
+#   python lookup_index.py build            # after train_model.py
+#   python lookup_index.py report           # share of history served from the index
+#
+# The index holds every model's top-k answer for each combination of up to
+# MAX_SYMPTOMS symptoms × gender × a few equal-width buckets per vital,
+# evaluated at the middle of the bucket. A cell is only served when the
+# build proves (certain_cells) that every model's top-1 disease is the same
+# for all vitals in the bucket, so served predictions always match the live
+# models; the probabilities shown are the bucket midpoint's. Everything else
+# (undecided cells, more symptoms, vitals outside the training ranges,
+# unknown gender, an index built for other model files) goes to the live
+# model.
+#
+# Files (models/): lookup_index.npy (memory-mapped uint8 table),
+# lookup_combos.npy (symptom bitmask -> row) and lookup_index.json (layout).
+
+import argparse
+import itertools
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+import model_registry as registry
+import tree_engine
+from core_utils import ALL_FEATURES, NUMERIC_FEATURES, SYMPTOMS
+
+TABLE_FILE = "lookup_index.npy"
+COMBOS_FILE = "lookup_combos.npy"
+META_FILE = "lookup_index.json"
+
+MAX_SYMPTOMS = 4
+TOP_K = 3
+BUCKETS = {"age": 6, "temp_c": 5, "heart_rate": 4, "spo2": 3}
+# Resolution of the values the Diagnosis page collects.
+STEPS = {"age": 1.0, "temp_c": 0.1, "heart_rate": 1.0, "spo2": 1.0}
+PROBA_SCALE = 255
+UNDECIDED = 255  # top-1 class id of a cell whose answer depends on the exact vitals
+BUILD_ROWS = 200_000
+
+_lock = threading.Lock()
+_loaded = {}
+
+
+# -------------------------------
+# Layout
+# -------------------------------
+def symptom_combos(max_symptoms=MAX_SYMPTOMS):
+    """Bitmasks of every symptom set with at most max_symptoms symptoms."""
+    masks = [
+        sum(1 << i for i in combo)
+        for r in range(max_symptoms + 1)
+        for combo in itertools.combinations(range(len(SYMPTOMS)), r)
+    ]
+    return np.asarray(masks, dtype=np.int64)
+
+
+def bucket_edges(lo, hi, n_buckets, step):
+    """Inner edges splitting [lo, hi] into n_buckets equal parts, on half steps
+    so no UI value sits on an edge."""
+    inner = lo + (hi - lo) * np.arange(1, n_buckets) / n_buckets
+    return sorted({float(np.floor(e / step) * step + step / 2) for e in inner if lo < e < hi})
+
+
+def representatives(edges, lo, hi, step):
+    """The UI value in the middle of each bucket (a, b] of [lo, hi]."""
+    grid = np.round(np.arange(lo, hi + step / 2, step), 6)
+    bucket = np.searchsorted(edges, grid, side="left")
+    return [float(grid[bucket == i][len(grid[bucket == i]) // 2]) for i in range(len(edges) + 1)]
+
+
+def _boxes(edges, ranges):
+    """Lower/upper corners of every vitals cell, in table order; a cell
+    holds lo < x <= hi in each vital."""
+    bounds = []
+    for f in NUMERIC_FEATURES:
+        lo, hi = ranges[f]
+        b = [lo - STEPS[f] / 2] + list(edges[f]) + [hi]
+        bounds.append(list(zip(b[:-1], b[1:])))
+    cells = list(itertools.product(*bounds))
+    return np.array([[c[j][0] for j in range(4)] for c in cells]), np.array([[c[j][1] for j in range(4)] for c in cells])
+
+
+# -------------------------------
+# Exactness check
+# -------------------------------
+def _reachable_leaves(stacked, fixed, box_lo, box_hi):
+    """Walk every tree for each row of fixed (symptoms and gender set, vitals
+    free inside the box) and return the leaves that can be reached as
+    (row, tree, node, leaf box lo, leaf box hi)."""
+    vitals = np.array([ALL_FEATURES.index(f) for f in NUMERIC_FEATURES])
+    vital_pos = np.full(len(ALL_FEATURES), -1)
+    vital_pos[vitals] = np.arange(len(vitals))
+    feature, lower, upper, children = stacked["feature"], stacked["lower"], stacked["upper"], stacked["children"]
+    n_rows, n_trees = len(fixed), len(stacked["roots"])
+
+    node = np.repeat(stacked["roots"], n_rows)
+    row = np.tile(np.arange(n_rows), n_trees)
+    tree = np.repeat(np.arange(n_trees), n_rows)
+    lo = np.tile(box_lo, (len(node), 1))
+    hi = np.tile(box_hi, (len(node), 1))
+    out = []
+    while len(node):
+        leaf = children[2 * node] == node
+        out.append((row[leaf], tree[leaf], node[leaf], lo[leaf], hi[leaf]))
+        node, row, tree, lo, hi = node[~leaf], row[~leaf], tree[~leaf], lo[~leaf], hi[~leaf]
+
+        j = vital_pos[feature[node]]
+        t = lower[node]
+        free = j >= 0
+        at = np.arange(len(node))
+        # Fixed features follow the engine's test; vitals go wherever the box allows.
+        x = fixed[row, feature[node]]
+        fixed_next = children[2 * node + ((x > t) & (x <= upper[node]))]
+        left = np.flatnonzero(free & (lo[at, j] < t))
+        right = np.flatnonzero(free & (hi[at, j] > t))
+        same = np.flatnonzero(~free)
+        lo_l, hi_l = lo[left], hi[left].copy()
+        hi_l[np.arange(len(left)), j[left]] = t[left]
+        lo_r, hi_r = lo[right].copy(), hi[right]
+        lo_r[np.arange(len(right)), j[right]] = t[right]
+
+        node = np.concatenate([fixed_next[same], children[2 * node[left]], children[2 * node[right] + 1]])
+        row = np.concatenate([row[same], row[left], row[right]])
+        tree = np.concatenate([tree[same], tree[left], tree[right]])
+        lo = np.concatenate([lo[same], lo_l, lo_r])
+        hi = np.concatenate([hi[same], hi_l, hi_r])
+    return [np.concatenate(parts) for parts in zip(*out)]
+
+
+def _decided(lo, hi):
+    """True where the class with the largest lower bound beats every other
+    class's upper bound, so the top-1 cannot change inside the box."""
+    winner = lo.argmax(axis=-1)
+    best = np.take_along_axis(lo, winner[..., None], axis=-1)[..., 0]
+    others = hi.copy()
+    np.put_along_axis(others, winner[..., None], -np.inf, axis=-1)
+    runner_up = others.max(axis=-1)
+    return np.isfinite(best) & np.isfinite(runner_up) & (best > runner_up + 1e-9)
+
+
+def _bounds(base, owner, starts, values):
+    """base plus, per row, the sum over trees of each tree's min / max."""
+    lo, hi = base.copy(), base.copy()
+    if len(starts):
+        np.add.at(lo, owner, np.minimum.reduceat(values, starts))
+        np.add.at(hi, owner, np.maximum.reduceat(values, starts))
+    return lo, hi
+
+
+def _runs(keys):
+    """Start offsets of the runs of equal values in a sorted array."""
+    return np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else np.zeros(0, dtype=np.int64)
+
+
+def certain_cells(stacked, fixed, cell_lo, cell_hi, winners):
+    """(rows, cells) bool: every model's top-1 is provably winners[m][row, cell]
+    for all vitals in the cell.
+
+    Summing each tree's smallest and largest class probability over its
+    reachable leaves bounds the forest's probabilities inside a box. Trees
+    with a single reachable leaf add a constant. A row the whole vitals box
+    does not settle is re-checked per cell, bounding the winner from below
+    and the best other class from above.
+    """
+    n_rows, n_cells, n_trees = len(fixed), len(cell_lo), len(stacked["roots"])
+    row, tree, node, lo, hi = _reachable_leaves(stacked, fixed, cell_lo.min(axis=0), cell_hi.max(axis=0))
+    certain = np.ones((n_rows, n_cells), dtype=bool)
+    for m, member in enumerate(stacked["members"]):
+        start, stop = member["trees"]
+        sel = np.flatnonzero((tree >= start) & (tree < stop))
+        group = row[sel] * n_trees + tree[sel]
+        order = np.argsort(group, kind="stable")
+        sel, group = sel[order], group[order]
+        values = tree_engine.node_values(member["engine"], node[sel] - member["node_offset"])
+        starts = _runs(group)
+        sizes = np.diff(np.r_[starts, len(group)])
+        single = sizes == 1
+
+        const = np.zeros((n_rows, values.shape[1]))
+        np.add.at(const, group[starts[single]] // n_trees, values[starts[single]])
+        multi = np.repeat(~single, sizes)
+        m_starts = _runs(group[multi])
+        whole_lo, whole_hi = _bounds(const, group[multi][m_starts] // n_trees, m_starts, values[multi])
+        open_rows = ~(_decided(whole_lo, whole_hi) & (whole_lo.argmax(axis=1)[:, None] == winners[m]).all(axis=1))
+        if not open_rows.any():
+            continue
+
+        keep = multi & open_rows[group // n_trees]
+        k_group, k_values, k_lo, k_hi = group[keep], values[keep], lo[sel][keep], hi[sel][keep]
+        k_row = k_group // n_trees
+        k_starts = _runs(k_group)
+        k_owner = k_row[k_starts]
+        ranked = np.argsort(-k_values, axis=1, kind="stable")[:, :2]
+        best_class = ranked[:, 0]
+        best, second = np.take_along_axis(k_values, ranked, axis=1).T
+        rows_open = np.flatnonzero(open_rows)
+        at = np.arange(len(k_values))
+        for c in range(n_cells):
+            w = winners[m][:, c]
+            wl = w[k_row]
+            inside = np.all((k_lo < cell_hi[c]) & (cell_lo[c] < k_hi), axis=1)
+            win_lo = const[np.arange(n_rows), w].copy()
+            others = const.copy()
+            others[np.arange(n_rows), w] = -np.inf
+            rest_hi = others.max(axis=1)
+            if len(k_starts):
+                pw = np.where(inside, k_values[at, wl], np.inf)
+                po = np.where(inside, np.where(best_class == wl, second, best), -np.inf)
+                np.add.at(win_lo, k_owner, np.minimum.reduceat(pw, k_starts))
+                np.add.at(rest_hi, k_owner, np.maximum.reduceat(po, k_starts))
+            ok = np.isfinite(win_lo) & np.isfinite(rest_hi) & (win_lo > rest_hi + 1e-9)
+            pending = open_rows & ~ok
+            if pending.any():
+                # Tighter, per-class bounds for the rows the cheap bound missed.
+                sub = np.flatnonzero(pending[k_row] & inside)
+                sub_starts = _runs(k_group[sub])
+                owner = k_row[sub][sub_starts]
+                p_lo, p_hi = _bounds(const, owner, sub_starts, k_values[sub])
+                ok[pending] = (_decided(p_lo, p_hi) & (p_lo.argmax(axis=1) == w))[pending]
+            certain[rows_open, c] &= ok[rows_open]
+    return certain
+
+
+# -------------------------------
+# Build
+# -------------------------------
+def _fixed_rows(combos, genders):
+    """Encoded rows with symptoms and gender set (vitals left at 0)."""
+    n = len(combos) * len(genders)
+    X = np.zeros((n, len(ALL_FEATURES)))
+    X[:, ALL_FEATURES.index("gender")] = np.tile(np.arange(len(genders)), len(combos))
+    masks = np.repeat(combos, len(genders))
+    for i, s in enumerate(SYMPTOMS):
+        X[:, ALL_FEATURES.index(s)] = (masks >> i) & 1
+    return X
+
+
+def _cells(combos, genders, reps):
+    """Feature rows for a block of symptom combos, in table order."""
+    vitals = np.asarray(list(itertools.product(*(reps[f] for f in NUMERIC_FEATURES))))
+    fixed = _fixed_rows(combos, genders)
+    X = np.repeat(fixed, len(vitals), axis=0)
+    for j, f in enumerate(NUMERIC_FEATURES):
+        X[:, ALL_FEATURES.index(f)] = np.tile(vitals[:, j], len(fixed))
+    return X
+
+
+def build(model_dir=None, data_path="data/symptoms_disease.csv", max_symptoms=MAX_SYMPTOMS,
+          buckets=None, k=TOP_K):
+    """Write the index files; returns the layout dict (with build stats)."""
+    import inference
+    from train_model import load_dataset
+
+    t0 = time.perf_counter()
+    model_dir = model_dir or registry.MODEL_DIR
+    buckets = dict(BUCKETS, **(buckets or {}))
+    model_names = list(registry.MODEL_FILES)
+    stacked = inference.get_stacked(model_names)
+    engines = [m["engine"] for m in stacked["members"]]
+
+    df = load_dataset(data_path)
+    ranges = {f: (float(df[f].min()), float(df[f].max())) for f in NUMERIC_FEATURES}
+    edges = {f: bucket_edges(*ranges[f], buckets[f], STEPS[f]) for f in NUMERIC_FEATURES}
+    reps = {f: representatives(edges[f], *ranges[f], STEPS[f]) for f in NUMERIC_FEATURES}
+    cell_lo, cell_hi = _boxes(edges, ranges)
+    genders = list(stacked["categories"]["gender"])
+
+    combos = symptom_combos(max_symptoms)
+    rank = np.full(1 << len(SYMPTOMS), -1, dtype=np.int32)
+    rank[combos] = np.arange(len(combos), dtype=np.int32)
+
+    shape = (len(combos), len(genders)) + tuple(len(reps[f]) for f in NUMERIC_FEATURES) + (len(model_names), k, 2)
+    tmp = os.path.join(model_dir, TABLE_FILE + ".tmp")
+    table = np.lib.format.open_memmap(tmp, mode="w+", dtype=np.uint8, shape=shape)
+    per_combo = int(np.prod(shape[1:6]))
+    block = max(1, BUILD_ROWS // per_combo)
+    n_certain = 0
+    for start in range(0, len(combos), block):
+        chunk = combos[start:start + block]
+        X = _cells(chunk, genders, reps)
+        out = np.empty((len(X), len(model_names), k, 2), dtype=np.uint8)
+        for m, proba in enumerate(tree_engine.predict_proba_stacked(stacked, X)):
+            top = np.argsort(-proba, axis=1, kind="stable")[:, :k]
+            out[:, m, :, 0] = top
+            out[:, m, :, 1] = np.rint(np.take_along_axis(proba, top, axis=1) * PROBA_SCALE)
+        winners = out[:, :, 0, 0].reshape(-1, len(cell_lo), len(model_names)).transpose(2, 0, 1).astype(np.int64)
+        certain = certain_cells(stacked, _fixed_rows(chunk, genders), cell_lo, cell_hi, winners).ravel()
+        out[~certain, 0, 0, 0] = UNDECIDED
+        n_certain += int(certain.sum())
+        table[start:start + block] = out.reshape((-1,) + shape[1:])
+    table.flush()
+    del table
+    os.replace(tmp, os.path.join(model_dir, TABLE_FILE))
+    np.save(os.path.join(model_dir, COMBOS_FILE), rank)
+
+    n_cells = int(np.prod(shape[:6]))
+    meta = {
+        "models": model_names,
+        "model_hashes": [inference.engine_hash(e) for e in engines],
+        "classes": [[str(c) for c in e["classes"]] for e in engines],
+        "genders": genders,
+        "max_symptoms": max_symptoms,
+        "k": k,
+        "ranges": ranges,
+        "edges": edges,
+        "representatives": reps,
+        "shape": list(shape),
+        "cells": n_cells,
+        "decided_cells": n_certain,
+        "build_seconds": time.perf_counter() - t0,
+        "bytes": os.path.getsize(os.path.join(model_dir, TABLE_FILE))
+        + os.path.getsize(os.path.join(model_dir, COMBOS_FILE)),
+    }
+    with open(os.path.join(model_dir, META_FILE), "w") as f:
+        json.dump(meta, f, indent=2)
+    clear()
+    return meta
+
+
+# -------------------------------
+# Lookup
+# -------------------------------
+def _load():
+    """The index for the current model artifacts, or None."""
+    path = os.path.join(registry.MODEL_DIR, META_FILE)
+    try:
+        stamp = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    import inference
+
+    # Engine hashes, not artifact hashes: a compacted engine answers
+    # differently from the pipeline it came from.
+    hashes = [inference.engine_hash(inference.get_engine(n)) for n in registry.MODEL_FILES]
+    key = (stamp, tuple(hashes))
+    index = _loaded.get(key)
+    if index is None:
+        with _lock:
+            with open(path) as f:
+                meta = json.load(f)
+            if meta["model_hashes"] != hashes:
+                index = False  # built for other models
+            else:
+                index = dict(meta)
+                index["table"] = np.load(os.path.join(registry.MODEL_DIR, TABLE_FILE), mmap_mode="r")
+                index["combos"] = np.load(os.path.join(registry.MODEL_DIR, COMBOS_FILE), mmap_mode="r")
+                index["gender_codes"] = {g: i for i, g in enumerate(meta["genders"])}
+            _loaded.clear()
+            _loaded[key] = index
+    return index or None
+
+
+def _bucket(edges, x):
+    # A value goes to bucket i when edges[i - 1] < x <= edges[i].
+    i = 0
+    while i < len(edges) and x > edges[i]:
+        i += 1
+    return i
+
+
+def lookup(data, model_names=None, k=TOP_K):
+    """predict_all()-shaped result from the index, or None to use the live model."""
+    if os.environ.get("HEALTH_LOOKUP_INDEX", "1") == "0":
+        return None
+    index = _load()
+    if index is None or k > index["k"] or list(model_names or registry.MODEL_FILES) != index["models"]:
+        return None
+    try:
+        mask = 0
+        for i, s in enumerate(SYMPTOMS):
+            v = data[s]
+            if v not in (0, 1):
+                return None
+            mask |= int(v) << i
+        cell = [index["combos"][mask], index["gender_codes"][str(data["gender"])]]
+        for f in NUMERIC_FEATURES:
+            x = float(data[f])
+            lo, hi = index["ranges"][f]
+            if not lo <= x <= hi:
+                return None
+            cell.append(_bucket(index["edges"][f], x))
+    except (KeyError, TypeError, ValueError):
+        return None
+    if cell[0] < 0:
+        return None
+
+    answers = index["table"][tuple(cell)]
+    if answers[0, 0, 0] == UNDECIDED:
+        return None
+    out = {}
+    for m, name in enumerate(index["models"]):
+        classes = index["classes"][m]
+        top = [(classes[c], p / PROBA_SCALE) for c, p in answers[m, :k].tolist()]
+        out[name] = {"prediction": top[0][0], "top_k": [top[0]] + [t for t in top[1:] if t[1] > 0]}
+    return {"models": out, "agree": len({r["prediction"] for r in out.values()}) == 1, "source": "index"}
+
+
+def clear():
+    with _lock:
+        _loaded.clear()
+
+
+# -------------------------------
+# Reports
+# -------------------------------
+def agreement(rows, k=TOP_K):
+    """For rows (feature dicts): share served by the index and, of those, the
+    share whose top-1 per model matches the live model."""
+    import inference
+
+    served = matched = 0
+    model_names = list(registry.MODEL_FILES)
+    live = inference.predict_all_batch(rows, k, model_names) if rows else []
+    for row, want in zip(rows, live):
+        got = lookup(row, model_names, k)
+        if got is None:
+            continue
+        served += 1
+        matched += all(got["models"][n]["prediction"] == want["models"][n]["prediction"] for n in model_names)
+    return {
+        "rows": len(rows),
+        "served": served / len(rows) if rows else 0.0,
+        "top1_agreement": matched / served if served else 0.0,
+    }
+
+
+def history_rows(db_path=None):
+    """Feature dicts of all stored Diagnosis requests."""
+    import storage
+
+    rows = []
+    for rec in storage.iter_history(db_path):
+        vitals = rec.get("vitals") or {}
+        if all(f in vitals for f in ALL_FEATURES):
+            rows.append({f: vitals[f] for f in ALL_FEATURES})
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or inspect the precomputed prediction index.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    b = sub.add_parser("build")
+    b.add_argument("--data", default="data/symptoms_disease.csv", help="training data (sets the vitals ranges)")
+    b.add_argument("--max-symptoms", type=int, default=MAX_SYMPTOMS)
+    for f, n in BUCKETS.items():
+        b.add_argument(f"--{f.replace('_', '-')}-buckets", type=int, default=n)
+    r = sub.add_parser("report")
+    r.add_argument("--db", default=None, help="SQLite database with the history")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        buckets = {f: getattr(args, f"{f}_buckets") for f in BUCKETS}
+        meta = build(data_path=args.data, max_symptoms=args.max_symptoms, buckets=buckets)
+        print(f"✅ Index built in {meta['build_seconds']:.1f}s: {int(np.prod(meta['shape'][:6])):,} cells, "
+              f"{meta['bytes'] / 1e6:.1f} MB")
+        for f in NUMERIC_FEATURES:
+            print(f"   {f:<11} edges {meta['edges'][f]}  values {meta['representatives'][f]}")
+        from sample_inputs import random_rows
+
+        in_range = random_rows(20000, seed=6)
+        for f, (lo, hi) in meta["ranges"].items():
+            in_range = in_range[(in_range[f] >= lo) & (in_range[f] <= hi)]
+        stats = agreement(in_range.to_dict("records"))
+        print(f"   random in-range inputs: {stats['served']:.1%} served, "
+              f"top-1 agreement with the live models {stats['top1_agreement']:.1%}")
+        return
+
+    rows = history_rows(args.db)
+    if not rows:
+        print("No stored Diagnosis requests with complete vitals.")
+        return
+    stats = agreement(rows)
+    print(f"History requests: {stats['rows']}, served from the index: {stats['served']:.1%}, "
+          f"top-1 agreement: {stats['top1_agreement']:.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,519 @@
+# medicine_search.py
+# Indexed medicine search for the Medicines page.
+#
+#   python medicine_search.py "paracetmol"        # query the catalog
+#   python medicine_search.py --bench --entries 50000
+#
+# The catalog (data/medicines.csv or a JSON list with the same fields) is
+# loaded once into an inverted index: token -> (entry ids, field weight).
+# Each query word is matched
+#   - exactly,
+#   - through data/symptom_synonyms.csv ("loose motions" -> diarrhea),
+#   - as a prefix (sorted vocabulary + bisect; the shortest completions of
+#     common prefixes are precomputed) when it is the word being typed or
+#     has no exact match,
+#   - with up to max_edits() typos (trigram candidates of a similar length,
+#     then a banded edit distance; the closest corrections win) when nothing
+#     else matched.
+# Entries matching every word rank first, by summed field weight. Scores are
+# combined over the matched posting lists only, never the whole catalog.
+
+import argparse
+import bisect
+import csv
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+import numpy as np
+
+from core_utils import SYMPTOMS
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+CATALOG_FILE = os.path.join(ROOT, "data", "medicines.csv")
+SYNONYMS_FILE = os.path.join(ROOT, "data", "symptom_synonyms.csv")
+LIST_FIELDS = ("category", "indications", "symptoms")
+# Weight of a word by the field it was found in.
+FIELDS = {"name": 4.0, "generic": 3.0, "indications": 2.0, "symptoms": 2.0, "category": 1.0}
+# Discount by how the query word was matched.
+SYNONYM = 0.9
+PREFIX = 0.8
+TYPO = 0.6
+MAX_EXPANSIONS = 64
+MAX_TYPO_CANDIDATES = 16
+LIMIT = 10
+TARGET_MS = 1.0  # --bench fails when any query kind is slower at p95 or p99
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+_lock = threading.Lock()
+_indexes = {}
+
+
+def tokenize(text):
+    return _TOKEN.findall(str(text).lower().replace("_", " "))
+
+
+def max_edits(word):
+    return 0 if len(word) < 4 else 1 if len(word) < 8 else 2
+
+
+def edit_distance(a, b, limit):
+    """Optimal string alignment distance, or limit + 1 once it is exceeded.
+
+    A shared prefix and suffix are skipped, only the band of cells within
+    limit of the diagonal is computed, and the walk stops at the first row
+    whose band is all above limit.
+    """
+    n, m = len(a), len(b)
+    if abs(n - m) > limit:
+        return limit + 1
+    if a == b:
+        return 0
+    start = 0
+    while start < n and start < m and a[start] == b[start]:
+        start += 1
+    while n > start and m > start and a[n - 1] == b[m - 1]:
+        n, m = n - 1, m - 1
+    a, b = a[start:n], b[start:m]
+    n, m = n - start, m - start
+    big = limit + 1
+    prev2, prev = None, [j if j <= limit else big for j in range(m + 1)]
+    for i in range(1, n + 1):
+        ca = a[i - 1]
+        cur = [big] * (m + 1)
+        if i <= limit:
+            cur[0] = i
+        best = cur[0]
+        for j in range(max(1, i - limit), min(m, i + limit) + 1):
+            cb = b[j - 1]
+            d = prev[j - 1] + (ca != cb)
+            if prev[j] + 1 < d:
+                d = prev[j] + 1
+            if cur[j - 1] + 1 < d:
+                d = cur[j - 1] + 1
+            if i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == cb and prev2[j - 2] + 1 < d:
+                d = prev2[j - 2] + 1
+            cur[j] = d
+            if d < best:
+                best = d
+        if best > limit:
+            return big
+        prev2, prev = prev, cur
+    return min(prev[m], big)
+
+
+def _trigrams(word):
+    padded = f"${word}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+# -------------------------------
+# Catalog
+# -------------------------------
+def load_catalog(path=CATALOG_FILE):
+    """List of entries {name, generic, category, rx, indications, symptoms};
+    list fields are ';'-separated in CSV."""
+    if path.endswith(".json"):
+        with open(path, encoding="utf-8") as f:
+            rows = json.load(f)
+    else:
+        with open(path, newline="", encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+    catalog = []
+    for row in rows:
+        entry = {"name": row["name"], "generic": row.get("generic", ""), "rx": row.get("rx", "")}
+        for field in LIST_FIELDS:
+            value = row.get(field) or []
+            entry[field] = [v.strip() for v in value.split(";") if v.strip()] if isinstance(value, str) else list(value)
+        catalog.append(entry)
+    return catalog
+
+
+def load_synonyms(path=SYNONYMS_FILE):
+    """{term: symptom}; the symptom keys themselves are terms too."""
+    synonyms = {s.replace("_", " "): s for s in SYMPTOMS}
+    if os.path.exists(path):
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                synonyms[" ".join(tokenize(row["term"]))] = row["symptom"]
+    return synonyms
+
+
+# -------------------------------
+# Index
+# -------------------------------
+def build_index(catalog, synonyms=None):
+    postings = {}  # token -> {entry id: weight}
+    by_symptom = {}
+    for i, entry in enumerate(catalog):
+        for field, weight in FIELDS.items():
+            value = entry.get(field, "")
+            for token in tokenize(" ".join(value) if isinstance(value, list) else value):
+                ids = postings.setdefault(token, {})
+                ids[i] = max(ids.get(i, 0.0), weight)
+        for s in entry.get("symptoms", []):
+            by_symptom.setdefault(s, []).append(i)
+
+    vocab = sorted(postings)
+    grams = {}  # (trigram, token length) -> token ids
+    for t, token in enumerate(vocab):
+        for g in _trigrams(token):
+            grams.setdefault((g, len(token)), []).append(t)
+    phrases = {}  # first word -> [(words, symptom)], longest first
+    for term, symptom in (synonyms or {}).items():
+        words = tuple(term.split())
+        if words:
+            phrases.setdefault(words[0], []).append((words, symptom))
+    for options in phrases.values():
+        options.sort(key=lambda o: -len(o[0]))
+
+    index = {
+        "catalog": catalog,
+        "vocab": vocab,
+        "postings": {
+            token: (np.fromiter(ids, dtype=np.int32, count=len(ids)),
+                    np.fromiter(ids.values(), dtype=np.float32, count=len(ids)))
+            for token, ids in postings.items()
+        },
+        "symptoms": {s: np.asarray(ids, dtype=np.int32) for s, ids in by_symptom.items()},
+        "grams": {g: np.asarray(ids, dtype=np.int32) for g, ids in grams.items()},
+        "phrases": phrases,
+    }
+    index["synonyms"] = {term: _matches(index, term, symptom) for term, symptom in (synonyms or {}).items()}
+    index["completions"] = {
+        prefix: _completed(index, [t for t in shortest if t != prefix][:MAX_EXPANSIONS])
+        for prefix, shortest in _completions(vocab).items()
+    }
+    return index
+
+
+def _completions(vocab):
+    """{prefix: its MAX_EXPANSIONS + 1 shortest completions} for every prefix
+    with more than MAX_EXPANSIONS of them, so a short prefix is never sorted
+    or merged at query time."""
+    out = {}
+    k, groups = 1, [vocab]
+    while groups:
+        longer = []
+        for group in groups:
+            start = 0
+            while start < len(group):
+                if len(group[start]) < k:
+                    start += 1
+                    continue
+                prefix = group[start][:k]
+                end = bisect.bisect_left(group, prefix + "\x7f", start)
+                if end - start > MAX_EXPANSIONS:
+                    part = group[start:end]
+                    out[prefix] = sorted(part, key=len)[:MAX_EXPANSIONS + 1]
+                    longer.append(part)
+                start = end
+        k, groups = k + 1, longer
+    return out
+
+
+def get_index(path=CATALOG_FILE, synonyms_path=SYNONYMS_FILE):
+    """Index of the catalog file, rebuilt only when a file changes."""
+    key = tuple((p, os.path.getmtime(p) if os.path.exists(p) else None) for p in (path, synonyms_path))
+    index = _indexes.get(key)
+    if index is None:
+        with _lock:
+            index = _indexes.get(key)
+            if index is None:
+                index = build_index(load_catalog(path), load_synonyms(synonyms_path))
+                _indexes.clear()
+                _indexes[key] = index
+    return index
+
+
+# -------------------------------
+# Query
+# -------------------------------
+def _completed(index, tokens):
+    """(entry ids, scores) of a word's completions, and the completions."""
+    return _union([(index["postings"][t][0], index["postings"][t][1] * PREFIX) for t in tokens]), tokens
+
+
+def _prefixed(index, word):
+    common = index["completions"].get(word)
+    if common is not None:  # closest completions, merged when the index was built
+        return common
+    vocab = index["vocab"]
+    lo = bisect.bisect_left(vocab, word)
+    hi = bisect.bisect_left(vocab, word + "\x7f", lo)
+    return _completed(index, [t for t in vocab[lo:hi] if t != word])
+
+
+def _typos(index, word):
+    limit = max_edits(word)
+    if not limit:
+        return []
+    # Only tokens within limit of the word's length can be close enough.
+    grams = index["grams"]
+    ids = [grams[key] for g in _trigrams(word)
+           for key in ((g, n) for n in range(len(word) - limit, len(word) + limit + 1)) if key in grams]
+    if not ids:
+        return []
+    candidates, counts = np.unique(np.concatenate(ids), return_counts=True)
+    candidates = _top(candidates, counts, MAX_TYPO_CANDIDATES)
+    # Keep the closest corrections only: once one is found, farther
+    # candidates are abandoned as soon as they exceed its distance.
+    found = []
+    for t in candidates.tolist():
+        token = index["vocab"][t]
+        d = edit_distance(word, token, limit)
+        if d < limit:
+            found, limit = [], d
+        if d <= limit:
+            found.append((token, d))
+    return found
+
+
+def _terms(index, words):
+    """Split the query into terms: synonym phrases or single words."""
+    terms, i = [], 0
+    while i < len(words):
+        for phrase, symptom in index["phrases"].get(words[i], []):
+            if tuple(words[i:i + len(phrase)]) == phrase:
+                terms.append((" ".join(phrase), symptom, i + len(phrase) == len(words)))
+                i += len(phrase)
+                break
+        else:
+            terms.append((words[i], None, i + 1 == len(words)))
+            i += 1
+    return terms
+
+
+_NONE = (np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32))
+
+
+def _merge(ids, scores, reduce):
+    """Sorted unique ids with their scores combined by a ufunc (np.maximum, np.add),
+    and how many times each id occurred."""
+    order = np.argsort(ids, kind="stable")
+    ids, scores = ids[order], scores[order]
+    starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+    return ids[starts], reduce.reduceat(scores, starts), np.diff(np.r_[starts, len(ids)])
+
+
+def _union(parts):
+    """Entries in any part, with their best score. Each part is (ids, scores)
+    with sorted unique ids; small parts are merged into a much larger one."""
+    if len(parts) < 2:
+        return parts[0] if parts else _NONE
+    parts = sorted(parts, key=lambda p: -len(p[0]))
+    ids, scores = parts[0]
+    more = np.concatenate([p[0] for p in parts[1:]])
+    more_scores = np.concatenate([p[1] for p in parts[1:]])
+    if 8 * len(more) > len(ids):
+        ids, scores, _ = _merge(np.concatenate([ids, more]), np.concatenate([scores, more_scores]), np.maximum)
+        return ids, scores
+    if len(parts) > 2:
+        more, more_scores, _ = _merge(more, more_scores, np.maximum)
+    pos = np.searchsorted(ids, more)
+    found = ids[np.minimum(pos, len(ids) - 1)] == more
+    scores = scores.copy()
+    scores[pos[found]] = np.maximum(scores[pos[found]], more_scores[found])
+    new = ~found
+    return np.insert(ids, pos[new], more[new]), np.insert(scores, pos[new], more_scores[new])
+
+
+def _literal(index, words):
+    """Entries containing every word, scored by their weakest word."""
+    ids = scores = None
+    for word in words:
+        if word not in index["postings"]:
+            return None
+        word_ids, weights = index["postings"][word]
+        if ids is None:
+            ids, scores = word_ids, weights
+        else:
+            ids, a, b = np.intersect1d(ids, word_ids, assume_unique=True, return_indices=True)
+            scores = np.minimum(scores[a], weights[b])
+    return (ids, scores) if len(ids) else None
+
+
+def _matches(index, term, symptom):
+    """Entries matching a term as a whole: its word, all words of a synonym
+    phrase, or the entries listing its symptom."""
+    parts = []
+    used = []
+    exact = index["postings"].get(term)
+    if exact is not None:
+        parts.append(exact)
+        used.append(term)
+    elif " " in term:
+        literal = _literal(index, term.split())
+        if literal is not None:
+            parts.append(literal)
+            used.append(term)
+    if symptom is not None and symptom in index["symptoms"]:
+        ids = index["symptoms"][symptom]
+        parts.append((ids, np.full(len(ids), FIELDS["symptoms"] * SYNONYM, dtype=np.float32)))
+        used.append(symptom)
+    return _union(parts), used
+
+
+def _term_scores(index, term, symptom, last):
+    """(entry ids, scores) of one query term and the words it was expanded to.
+
+    Only the posting lists the term touches are read, so the cost follows the
+    number of matching entries, not the catalog size. Synonym terms, which
+    match the most entries, are resolved when the index is built.
+    """
+    if symptom is not None and term in index["synonyms"]:
+        matched, used = index["synonyms"][term]
+    else:
+        matched, used = _matches(index, term, symptom)
+    parts = [matched] if used else []
+    used = list(used)
+    if " " not in term and (last or term not in index["postings"]):
+        completed, tokens = _prefixed(index, term)
+        if tokens:
+            parts.append(completed)
+            used += tokens
+    if not used and " " not in term:
+        for token, d in _typos(index, term):
+            ids, weights = index["postings"][token]
+            parts.append((ids, weights * (TYPO / d)))
+            used.append(token)
+    return _union(parts), used
+
+
+def _top(ids, scores, limit):
+    """ids of the limit best scores, best first (ties by catalog order)."""
+    if len(ids) > limit:
+        keep = np.sort(np.argpartition(-scores, limit - 1)[:limit])
+        ids, scores = ids[keep], scores[keep]
+    return ids[np.argsort(-scores, kind="stable")]
+
+
+def search(query, limit=LIMIT, index=None):
+    """Entries best matching a free-text query, each with "score" and "matched"
+    (the catalog words or symptoms the query was resolved to)."""
+    index = index or get_index()
+    terms = _terms(index, tokenize(query))
+    if not terms or not index["catalog"]:
+        return []
+    parts, matched = [], []
+    for term, symptom, last in terms:
+        part, used = _term_scores(index, term, symptom, last)
+        parts.append(part)
+        matched += used
+    # Entries matching every term: walk the smallest part, look up the others.
+    parts.sort(key=lambda p: len(p[0]))
+    ids, total = parts[0]
+    for other, scores in parts[1:]:
+        if not len(ids):
+            break
+        pos = np.minimum(np.searchsorted(other, ids), len(other) - 1)
+        found = other[pos] == ids
+        ids, total = ids[found], total[found] + scores[pos[found]]
+    if not len(ids):
+        # None does: rank the entries matching the most terms.
+        ids = np.concatenate([p[0] for p in parts])
+        if not len(ids):
+            return []
+        ids, total, hits = _merge(ids, np.concatenate([p[1] for p in parts]), np.add)
+        best = hits == hits.max()
+        ids, total = ids[best], total[best]
+    order = _top(np.arange(len(ids)), total, limit)
+    return [dict(index["catalog"][i], score=float(total[j]), matched=matched)
+            for i, j in zip(ids[order].tolist(), order.tolist())]
+
+
+def for_symptoms(symptoms, limit=LIMIT, index=None):
+    """Entries that treat the given symptom keys, most symptoms covered first."""
+    index = index or get_index()
+    lists = [index["symptoms"][s] for s in symptoms if s in index["symptoms"]]
+    if not lists:
+        return []
+    ids, counts = np.unique(np.concatenate(lists), return_counts=True)
+    top = _top(np.arange(len(ids)), counts, limit)
+    return [dict(index["catalog"][i], score=float(counts[j])) for i, j in zip(ids[top].tolist(), top.tolist())]
+
+
+# -------------------------------
+# Benchmark
+# -------------------------------
+def synthetic_catalog(n_entries, seed=0, path=CATALOG_FILE):
+    """The seed catalog plus n_entries made-up brands of its generics."""
+    rng = np.random.default_rng(seed)
+    base = load_catalog(path)
+    syllables = ["ba", "co", "di", "fe", "ga", "lo", "mi", "na", "pra", "qui", "ro", "sa", "ta", "vex", "zo", "len", "mar", "tri"]
+    suffixes = ["", " forte", " plus", " xr", " junior", " max"]
+    catalog = list(base)
+    for _ in range(n_entries):
+        src = base[rng.integers(len(base))]
+        name = "".join(rng.choice(syllables, rng.integers(2, 5))).capitalize() + suffixes[rng.integers(len(suffixes))]
+        catalog.append(dict(src, name=name))
+    return catalog
+
+
+def _typo(word, rng):
+    i = int(rng.integers(len(word)))
+    return word[:i] + word[i + 1:] if rng.random() < 0.5 else word[:i] + word[i] + word[i:]
+
+
+def bench(n_entries=50_000, n_queries=2000, seed=0):
+    from bench_models import percentiles, time_calls
+
+    rng = np.random.default_rng(seed)
+    catalog = synthetic_catalog(n_entries, seed)
+    synonyms = load_synonyms()
+    t0 = time.perf_counter()
+    index = build_index(catalog, synonyms)
+    build_s = time.perf_counter() - t0
+
+    names = [tokenize(catalog[i]["name"])[0] for i in rng.integers(len(catalog), size=n_queries)]
+    long_names = [w for w in names if len(w) >= 5] or names
+    queries = {
+        "exact": names,
+        "prefix": [w[:int(rng.integers(2, max(3, len(w))))] for w in names],
+        "typo": [_typo(w, rng) for w in long_names],
+        "symptom": list(rng.choice(list(synonyms), n_queries)),
+        "multi_word": [f"{w} {s}" for w, s in zip(names, rng.choice(list(synonyms), n_queries))],
+    }
+    results = {"entries": len(catalog), "tokens": len(index["vocab"]), "build_s": build_s, "queries": {}}
+    for kind, qs in queries.items():
+        search(qs[0], index=index)
+        found = [bool(search(q, index=index)) for q in qs[:200]]
+        results["queries"][kind] = {
+            **percentiles(time_calls(lambda q: search(q, index=index), [(q,) for q in qs])),
+            "hit_rate": float(np.mean(found)),
+        }
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search the medicine catalog.")
+    parser.add_argument("query", nargs="?", help="free-text query")
+    parser.add_argument("--catalog", default=CATALOG_FILE)
+    parser.add_argument("--limit", type=int, default=LIMIT)
+    parser.add_argument("--bench", action="store_true", help="time queries over a synthetic catalog")
+    parser.add_argument("--entries", type=int, default=50_000, help="synthetic catalog size for --bench")
+    args = parser.parse_args(argv)
+
+    if args.bench:
+        r = bench(args.entries)
+        print(f"{r['entries']:,} entries, {r['tokens']:,} distinct words, index built in {r['build_s']:.2f}s")
+        print(f"{'query':<12}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'found':>8}")
+        for kind, s in r["queries"].items():
+            print(f"{kind:<12}{s['p50_ms']:>9.3f}{s['p95_ms']:>9.3f}{s['p99_ms']:>9.3f}{s['hit_rate']:>8.0%}")
+        p95 = max(s["p95_ms"] for s in r["queries"].values())
+        p99 = max(s["p99_ms"] for s in r["queries"].values())
+        ok = p95 < TARGET_MS and p99 < TARGET_MS
+        print(f"{'PASS' if ok else 'FAIL'}: worst p95 {p95:.3f} ms, p99 {p99:.3f} ms (target < {TARGET_MS:g} ms)")
+        sys.exit(0 if ok else 1)
+    if not args.query:
+        parser.error("a query or --bench is required")
+    for entry in search(args.query, args.limit, get_index(args.catalog)):
+        print(f"{entry['score']:6.2f}  {entry['name']} ({entry['generic']}, {entry['rx']}): "
+              f"{', '.join(entry['indications'])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+# metrics.py
+# Per-stage timing for the app's request handlers, exposed as Prometheus text.
+#
+#   with metrics.request("diagnosis"):
+#       with metrics.timed("diagnosis.predict"):
+#           ...
+#
+# Every stage and request keeps a cumulative histogram (Prometheus buckets)
+# plus the last WINDOW samples for rolling p50/p95/p99. Exposition:
+#
+#   HEALTH_METRICS_PORT=9464   serve http://127.0.0.1:9464/metrics from a background thread
+#   HEALTH_METRICS_FILE=path   rewrite the text file after requests, at most every EXPORT_INTERVAL_S
+#                              (node-exporter textfile style)
+#   HEALTH_PROFILE_SLOWEST=N   cProfile requests and keep the N slowest in profiles/
+#
+# State is per process and shared by all Streamlit sessions.
+
+import bisect
+import collections
+import contextlib
+import cProfile
+import heapq
+import http.server
+import io
+import logging
+import os
+import pstats
+import tempfile
+import threading
+import time
+
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+WINDOW = 1000
+QUANTILES = (0.5, 0.95, 0.99)
+PROFILE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles")
+EXPORT_INTERVAL_S = 1.0
+
+_log = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_series = {}  # (metric, label) -> {"buckets": [...], "sum": s, "count": n, "recent": deque}
+_profile_lock = threading.Lock()
+_slowest = []  # min-heap of (seconds, path)
+_export_lock = threading.Lock()
+_last_export = 0.0
+_server = None
+_setup_done = False
+
+
+# -------------------------------
+# Recording
+# -------------------------------
+def observe(metric, label, seconds):
+    with _lock:
+        s = _series.get((metric, label))
+        if s is None:
+            s = _series[(metric, label)] = {
+                "buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0,
+                "recent": collections.deque(maxlen=WINDOW),
+            }
+        i = bisect.bisect_left(BUCKETS, seconds)
+        if i < len(BUCKETS):
+            s["buckets"][i] += 1
+        s["sum"] += seconds
+        s["count"] += 1
+        s["recent"].append(seconds)
+
+
+@contextlib.contextmanager
+def timed(stage):
+    """Time a block as one stage (recorded even if it raises)."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe("stage", stage, time.perf_counter() - t0)
+
+
+def _keep_profile(name, seconds, profile, n):
+    """Keep the profile if it is among the n slowest seen so far."""
+    if len(_slowest) >= n and seconds <= _slowest[0][0]:
+        return
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{name}_{int(time.time() * 1000)}_{seconds * 1000:.0f}ms.prof")
+    profile.dump_stats(path)
+    text = io.StringIO()
+    pstats.Stats(profile, stream=text).sort_stats("cumulative").print_stats(30)
+    with open(path[:-5] + ".txt", "w") as f:
+        f.write(text.getvalue())
+    heapq.heappush(_slowest, (seconds, path))
+    while len(_slowest) > n:
+        _, old = heapq.heappop(_slowest)
+        for p in (old, old[:-5] + ".txt"):
+            with contextlib.suppress(OSError):
+                os.remove(p)
+
+
+@contextlib.contextmanager
+def request(name):
+    """Time a whole request; profile it when HEALTH_PROFILE_SLOWEST is set.
+
+    Only one request is profiled at a time; concurrent ones are just timed.
+    """
+    n_profiles = int(os.environ.get("HEALTH_PROFILE_SLOWEST", "0") or 0)
+    profile = None
+    if n_profiles > 0 and _profile_lock.acquire(blocking=False):
+        profile = cProfile.Profile()
+        profile.enable()
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - t0
+        if profile is not None:
+            profile.disable()
+            try:
+                _keep_profile(name, seconds, profile, n_profiles)
+            except OSError:
+                _log.warning("could not keep the profile of %s", name, exc_info=True)
+            finally:
+                _profile_lock.release()
+        observe("request", name, seconds)
+        _export()
+
+
+# -------------------------------
+# Exposition
+# -------------------------------
+def _quantile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def snapshot():
+    """{metric: {label: {"count", "sum"}}} of every series so far."""
+    with _lock:
+        out = {}
+        for (metric, label), s in _series.items():
+            out.setdefault(metric, {})[label] = {"count": s["count"], "sum": s["sum"]}
+    return out
+
+
+def render():
+    """All series in Prometheus text exposition format."""
+    with _lock:
+        snapshot = {k: (list(s["buckets"]), s["sum"], s["count"], list(s["recent"])) for k, s in _series.items()}
+    lines = []
+    for metric in ("stage", "request"):
+        keys = sorted(k for k in snapshot if k[0] == metric)
+        if not keys:
+            continue
+        name = f"health_{metric}_seconds"
+        lines += [f"# HELP {name} Time spent per {metric}.", f"# TYPE {name} histogram"]
+        for _, label in keys:
+            buckets, total, count, _ = snapshot[(metric, label)]
+            cumulative = 0
+            for le, c in zip(BUCKETS, buckets):
+                cumulative += c
+                lines.append(f'{name}_bucket{{{metric}="{label}",le="{le}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{metric}="{label}",le="+Inf"}} {count}')
+            lines.append(f'{name}_sum{{{metric}="{label}"}} {total:.9f}')
+            lines.append(f'{name}_count{{{metric}="{label}"}} {count}')
+        recent = f"health_{metric}_recent_seconds"
+        lines += [f"# HELP {recent} Rolling quantiles over the last {WINDOW} samples.", f"# TYPE {recent} gauge"]
+        for _, label in keys:
+            samples = snapshot[(metric, label)][3]
+            for q in QUANTILES:
+                lines.append(f'{recent}{{{metric}="{label}",quantile="{q}"}} {_quantile(samples, q):.9f}')
+    return "\n".join(lines) + "\n"
+
+
+def write_file(path):
+    """Replace path atomically; each writer uses its own temp file."""
+    fd, tmp = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp",
+                               dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(render())
+        os.chmod(tmp, 0o644)  # mkstemp creates 0600; exporters may read as another user
+        os.replace(tmp, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp)
+        raise
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_http_server(port, host="127.0.0.1"):
+    """Serve /metrics from a daemon thread (once per process)."""
+    global _server
+    with _lock:
+        if _server is None:
+            _server = http.server.ThreadingHTTPServer((host, port), _Handler)
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+    return _server
+
+
+def _export():
+    """Rewrite HEALTH_METRICS_FILE, at most every EXPORT_INTERVAL_S and by one
+    thread at a time; failures are logged, never raised into a request."""
+    global _last_export
+    path = os.environ.get("HEALTH_METRICS_FILE")
+    if not path or time.monotonic() - _last_export < EXPORT_INTERVAL_S:
+        return
+    if not _export_lock.acquire(blocking=False):
+        return  # another request is writing it
+    try:
+        _last_export = time.monotonic()
+        write_file(path)
+    except OSError:
+        _log.warning("could not write metrics to %s", path, exc_info=True)
+    finally:
+        _export_lock.release()
+
+
+def setup():
+    """Start the exporters configured through the environment (once)."""
+    global _setup_done
+    if _setup_done:
+        return
+    _setup_done = True
+    port = os.environ.get("HEALTH_METRICS_PORT")
+    if port:
+        try:
+            start_http_server(int(port))
+        except OSError:
+            pass  # another process already serves this port
+
+
+def reset():
+    global _last_export
+    with _lock:
+        _series.clear()
+        _slowest.clear()
+        _last_export = 0.0
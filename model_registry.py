@@ -0,0 +1,109 @@
+# model_registry.py
+# Process-wide registry for the artifacts in models/.
+#
+# Streamlit re-executes app_streamlit.py on every interaction, but imported
+# modules stay in sys.modules, so everything cached here is shared by every
+# session and rerun of the same server process.
+
+import hashlib
+import os
+import threading
+
+import joblib
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+MODEL_DIR = os.path.join(ROOT, "models")
+
+MODEL_FILES = {
+    "Random Forest": "rf_model.joblib",
+    "Decision Tree": "dt_model.joblib",
+}
+FEATURES_FILE = "model_features.joblib"
+
+_lock = threading.Lock()
+_entries = {}
+_NOT_LOADED = object()
+
+
+# -------------------------------
+# Hashing
+# -------------------------------
+def file_hash(path, chunk_size=1 << 20):
+    """Return the sha256 hex digest of a file, read in chunks."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _stat_key(path):
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def _resolve(name):
+    return name if os.path.isabs(name) else os.path.join(MODEL_DIR, name)
+
+
+# -------------------------------
+# Loading
+# -------------------------------
+def _entry(name, with_object=True):
+    path = _resolve(name)
+    key = _stat_key(path)
+    entry = _entries.get(path)
+    if entry is not None and entry["stat"] == key and (entry["obj"] is not _NOT_LOADED or not with_object):
+        return entry
+
+    with _lock:
+        entry = _entries.get(path)
+        if entry is None or entry["stat"] != key:
+            # The file was touched; only drop the object if its content changed.
+            digest = file_hash(path)
+            if entry is None or entry["hash"] != digest:
+                entry = {"stat": key, "hash": digest, "obj": _NOT_LOADED}
+                _entries[path] = entry
+            else:
+                entry["stat"] = key
+        if with_object and entry["obj"] is _NOT_LOADED:
+            # mmap_mode="r" keeps large numpy arrays as read-only memory maps
+            # so several worker processes share the same pages. Objects that
+            # copy their arrays on unpickling (sklearn trees) load as usual.
+            entry["obj"] = joblib.load(path, mmap_mode="r")
+        return entry
+
+
+def load(name):
+    """Return the artifact stored at models/<name>, loading it on first use."""
+    return _entry(name)["obj"]
+
+
+def artifact_hash(name):
+    """Return the content hash of models/<name> without deserializing it."""
+    return _entry(name, with_object=False)["hash"]
+
+
+def exists(name):
+    return os.path.exists(_resolve(name))
+
+
+def get_model(model_name):
+    """Return the fitted pipeline for a UI model name ("Random Forest", ...)."""
+    return load(MODEL_FILES[model_name])
+
+
+def get_features():
+    """Return the feature order the pipelines were trained with."""
+    return load(FEATURES_FILE)
+
+
+def loaded():
+    """Return {path: hash} for every artifact currently held in memory."""
+    return {path: e["hash"] for path, e in _entries.items() if e["obj"] is not _NOT_LOADED}
+
+
+def clear():
+    """Drop every cached artifact (the next access reloads from disk)."""
+    with _lock:
+        _entries.clear()
@@ -0,0 +1,97 @@
+# prediction_cache.py
+# Bounded LRU + TTL cache in front of model prediction, shared by every
+# session of the process.
+#
+# Keys are (model name, model artifact hash, feature tuple in model feature
+# order). When a retrain produces a new artifact its hash changes, so old
+# entries can no longer be hit and are purged the first time the new hash is
+# seen.
+
+import collections
+import threading
+import time
+
+MAX_ENTRIES = 4096
+TTL_SECONDS = 3600.0
+
+_lock = threading.Lock()
+_entries = collections.OrderedDict()
+_current_hash = {}
+_stats = collections.Counter()
+
+
+def make_key(model_name, artifact_hash, data, features):
+    """Canonical cache key: numbers as float, everything else as str."""
+    values = []
+    for f in features:
+        v = data[f]
+        try:
+            values.append(float(v))
+        except (TypeError, ValueError):
+            values.append(str(v))
+    return (model_name, artifact_hash, tuple(values))
+
+
+def _invalidate(model_name, artifact_hash):
+    """Drop entries of model_name computed from any other artifact."""
+    stale = [k for k in _entries if k[0] == model_name and k[1] != artifact_hash]
+    for k in stale:
+        del _entries[k]
+    _stats["invalidated"] += len(stale)
+    _current_hash[model_name] = artifact_hash
+
+
+def get(key):
+    """Return (True, value) on a live hit, (False, None) otherwise."""
+    now = time.monotonic()
+    with _lock:
+        if _current_hash.get(key[0]) != key[1]:
+            _invalidate(key[0], key[1])
+        entry = _entries.get(key)
+        if entry is None:
+            _stats["misses"] += 1
+            return False, None
+        expires, value = entry
+        if expires < now:
+            del _entries[key]
+            _stats["expired"] += 1
+            _stats["misses"] += 1
+            return False, None
+        _entries.move_to_end(key)
+        _stats["hits"] += 1
+        return True, value
+
+
+def put(key, value, ttl=None):
+    with _lock:
+        _entries[key] = (time.monotonic() + (TTL_SECONDS if ttl is None else ttl), value)
+        _entries.move_to_end(key)
+        while len(_entries) > MAX_ENTRIES:
+            _entries.popitem(last=False)
+            _stats["evictions"] += 1
+
+
+def cached(key, compute):
+    """Return the cached value for key, computing and storing it on a miss."""
+    hit, value = get(key)
+    if not hit:
+        value = compute()
+        put(key, value)
+    return value
+
+
+def stats():
+    """Counters plus current size and hit rate."""
+    with _lock:
+        out = {k: _stats[k] for k in ("hits", "misses", "evictions", "expired", "invalidated")}
+        out["size"] = len(_entries)
+    lookups = out["hits"] + out["misses"]
+    out["hit_rate"] = out["hits"] / lookups if lookups else 0.0
+    return out
+
+
+def clear():
+    with _lock:
+        _entries.clear()
+        _current_hash.clear()
+        _stats.clear()
@@ -0,0 +1,295 @@
+# reports.py
+# Diagnosis PDF reports, rendered in memory by a background worker pool.
+#
+# Reports are content-addressed: the file name carries a hash of
+# (user, prediction, vitals, symptoms, model), so an identical request reuses
+# the report already on disk (or still being rendered) instead of laying it
+# out again. The PDF therefore carries no date: it may be shared by several
+# diagnoses, and each one's time is in its history record.
+#
+# Each user's reports live in reports/<user>/ and are recorded in the reports
+# table of storage.py, so listing, exporting (export.py) and expiring them
+# never lists the whole folder.
+#
+#   python reports.py compact                    # move flat reports/<user>_*.pdf into user folders, reindex
+#                                                # (once after upgrading; the app never moves files)
+#   python reports.py retain --days 365 --keep 100 [--dry-run]
+
+import argparse
+import collections
+import datetime
+import glob
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fpdf import FPDF
+
+import metrics
+import storage
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+REPORTS_DIR = os.path.join(ROOT, "reports")
+
+MAX_WORKERS = 2
+MAX_TRACKED = 256
+
+# Retention defaults: reports older than this or beyond the newest
+# KEEP_PER_USER of a user are deleted by `reports.py retain`.
+RETENTION_DAYS = 365
+KEEP_PER_USER = 100
+# Flat file names used before user folders: <user>_<YYYYMMDD_HHMMSS>.pdf
+# (timestamped) and <user>_<key16>.pdf (content-addressed).
+FLAT_NAME = re.compile(r"^(.+)_(\d{8}_\d{6}|[0-9a-f]{16})\.pdf$")
+STAMP_FORMAT = "%Y%m%d_%H%M%S"
+# Leftover .tmp files from interrupted writes older than this are removed.
+STALE_TMP_S = 3600
+
+_pool = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="report")
+_lock = threading.Lock()
+_jobs = collections.OrderedDict()
+
+
+# -------------------------------
+# Rendering
+# -------------------------------
+def render_pdf(username, prediction, vitals, symptoms, model_name, recommendations):
+    """Lay out the diagnosis report and return the PDF as bytes."""
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_font("Arial", "B", 16)
+    pdf.cell(0, 10, "Smart Health Diagnosis Report", ln=True, align="C")
+    pdf.set_font("Arial", size=12)
+    pdf.cell(0, 8, f"User: {username}", ln=True)
+    pdf.ln(6)
+    pdf.set_font("Arial", "B", 12)
+    pdf.cell(0, 8, f"Predicted Disease: {prediction}", ln=True)
+    pdf.cell(0, 8, f"Model Used: {model_name}", ln=True)
+    pdf.ln(6)
+    pdf.set_font("Arial", "B", 12)
+    pdf.cell(0, 8, "Vitals:", ln=True)
+    pdf.set_font("Arial", size=11)
+    for k, v in vitals.items():
+        pdf.cell(0, 7, f"- {k}: {v}", ln=True)
+    pdf.ln(4)
+    pdf.set_font("Arial", "B", 12)
+    pdf.cell(0, 8, "Symptoms:", ln=True)
+    pdf.set_font("Arial", size=11)
+    pdf.multi_cell(0, 7, ", ".join(symptoms) if symptoms else "None")
+    pdf.ln(4)
+    pdf.set_font("Arial", "B", 12)
+    pdf.cell(0, 8, "Recommendations:", ln=True)
+    pdf.set_font("Arial", size=11)
+    for r in recommendations:
+        pdf.multi_cell(0, 7, f"- {r}")
+    return bytes(pdf.output())
+
+
+# -------------------------------
+# Content addressing
+# -------------------------------
+def report_key(username, prediction, vitals, symptoms, model_name):
+    """Hash of everything that determines the report's content."""
+    payload = json.dumps(
+        [username, str(prediction), vitals, sorted(symptoms), model_name],
+        sort_keys=True, default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def user_dir(username, reports_dir=None):
+    """reports/<user>/; names that are not plain file names get a hash suffix."""
+    safe = re.sub(r"[^A-Za-z0-9_.-]", "_", username).strip(".") or "_"
+    if safe != username:
+        safe = f"{safe}-{hashlib.sha1(username.encode()).hexdigest()[:8]}"
+    return os.path.join(reports_dir or REPORTS_DIR, safe)
+
+
+def report_path(username, key):
+    return os.path.join(user_dir(username), f"{key[:16]}.pdf")
+
+
+def _refresh(username, path):
+    """Mark a reused report as new again (mtime and index row), so retention
+    does not delete a report that was just handed out."""
+    os.utime(path)
+    storage.add_report(username, os.path.basename(path), os.path.getsize(path))
+
+
+def _build(username, key, prediction, vitals, symptoms, model_name, recommendations):
+    path = report_path(username, key)
+    try:
+        with metrics.timed("report.read"), open(path, "rb") as f:
+            data = f.read()
+        _refresh(username, path)
+        return path, data
+    except FileNotFoundError:
+        pass
+    with metrics.timed("report.render_pdf"):
+        data = render_pdf(username, prediction, vitals, symptoms, model_name, recommendations)
+    with metrics.timed("report.write"):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        storage.add_report(username, os.path.basename(path), len(data))
+    return path, data
+
+
+# -------------------------------
+# Worker pool
+# -------------------------------
+def submit_report(username, prediction, vitals, symptoms, model_name, recommendations):
+    """Queue a report and return its key; duplicates share one job."""
+    key = report_key(username, prediction, vitals, symptoms, model_name)
+    args = (username, key, prediction, vitals, symptoms, model_name, recommendations)
+    with _lock:
+        job = _jobs.get(key)
+        reused = job is not None and job.done() and job.exception() is None
+        if job is None or (job.done() and not reused):
+            job = _jobs[key] = _pool.submit(_build, *args)
+            while len(_jobs) > MAX_TRACKED:
+                _jobs.popitem(last=False)
+        _jobs.move_to_end(key)
+    if reused:
+        try:
+            _refresh(username, job.result()[0])
+        except FileNotFoundError:
+            # Deleted since it was rendered: render it again.
+            with _lock:
+                _jobs[key] = _pool.submit(_build, *args)
+    return key
+
+
+def get_report(key):
+    """Return (file_name, pdf_bytes) once ready, None while still rendering.
+
+    Raises the worker's exception if rendering failed and KeyError if the
+    job is unknown (never submitted, or evicted long ago).
+    """
+    with _lock:
+        job = _jobs[key]
+    if not job.done():
+        return None
+    path, data = job.result()
+    return os.path.basename(path), data
+
+
+# -------------------------------
+# Compaction and retention
+# -------------------------------
+def _created(path):
+    """When the report was made: the timestamp in a legacy <YYYYMMDD_HHMMSS>.pdf
+    name, else the file's mtime (which a checkout or copy resets)."""
+    try:
+        return str(datetime.datetime.strptime(os.path.basename(path)[:-len(".pdf")], STAMP_FORMAT))
+    except ValueError:
+        return str(datetime.datetime.fromtimestamp(os.path.getmtime(path)))
+
+
+def compact(reports_dir=None, db_path=None):
+    """Bring reports/ and its index in line; the only operation that lists
+    the folder. Returns {"moved", "indexed", "dropped", "tmp_removed"}.
+
+    - flat reports/<user>_<name>.pdf files are moved to reports/<user>/<name>.pdf;
+    - user folders are reindexed: files missing from the index are added,
+      index rows whose file is gone are dropped;
+    - stale .tmp files of interrupted writes and empty folders are removed.
+    """
+    reports_dir = reports_dir or REPORTS_DIR
+    counts = {"moved": 0, "indexed": 0, "dropped": 0, "tmp_removed": 0}
+    if not os.path.isdir(reports_dir):
+        return counts
+    users = {r["username"] for r in storage.list_reports(db_path=db_path)}
+    users |= {r["username"] for r in storage.connect(db_path).execute("SELECT username FROM users")}
+
+    for path in glob.glob(os.path.join(reports_dir, "*.pdf")):
+        match = FLAT_NAME.match(os.path.basename(path))
+        if match is None:
+            continue
+        user, name = match.groups()
+        users.add(user)
+        target = os.path.join(user_dir(user, reports_dir), f"{name}.pdf")
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(path, target)
+        counts["moved"] += 1
+
+    dirs = {user_dir(u, reports_dir): u for u in users}
+    cutoff = time.time() - STALE_TMP_S
+    for path in glob.glob(os.path.join(reports_dir, "**", "*.tmp"), recursive=True):
+        if os.path.getmtime(path) < cutoff:
+            os.remove(path)
+            counts["tmp_removed"] += 1
+
+    indexed = {(r["username"], r["name"]) for r in storage.list_reports(db_path=db_path)}
+    on_disk = set()
+    for folder in glob.glob(os.path.join(reports_dir, "*", "")):
+        folder = folder.rstrip(os.sep)
+        user = dirs.get(folder, os.path.basename(folder))
+        for path in glob.glob(os.path.join(folder, "*.pdf")):
+            name = os.path.basename(path)
+            on_disk.add((user, name))
+            if (user, name) not in indexed:
+                storage.add_report(user, name, os.path.getsize(path), _created(path), db_path)
+                counts["indexed"] += 1
+        if not os.listdir(folder):
+            os.rmdir(folder)
+    gone = [{"username": u, "name": n} for u, n in indexed - on_disk]
+    storage.delete_reports(gone, db_path)
+    counts["dropped"] = len(gone)
+    return counts
+
+
+def apply_retention(days=RETENTION_DAYS, keep_per_user=KEEP_PER_USER, dry_run=False,
+                    reports_dir=None, db_path=None, now=None):
+    """Delete reports older than `days` or beyond the newest keep_per_user of
+    their user (either limit may be None). Returns the affected entries."""
+    before = None
+    if days is not None:
+        before = (now or datetime.datetime.now()) - datetime.timedelta(days=days)
+    expired = storage.expired_reports(before, keep_per_user, db_path)
+    if dry_run or not expired:
+        return expired
+    for e in expired:
+        try:
+            os.remove(os.path.join(user_dir(e["username"], reports_dir), e["name"]))
+        except FileNotFoundError:
+            pass
+    storage.delete_reports(expired, db_path)
+    # Forget finished jobs whose file may be gone, so they are re-rendered.
+    with _lock:
+        for key in [k for k, job in _jobs.items() if job.done()]:
+            del _jobs[key]
+    return expired
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain the reports/ folder.")
+    parser.add_argument("--db", default=storage.DB_PATH)
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("compact", help="move flat reports into user folders and reindex")
+    r = sub.add_parser("retain", help="delete old reports")
+    r.add_argument("--days", type=int, default=RETENTION_DAYS, help="keep reports newer than this (0 = no age limit)")
+    r.add_argument("--keep", type=int, default=KEEP_PER_USER, help="newest reports kept per user (0 = no limit)")
+    r.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args(argv)
+
+    storage.init_db(args.db)
+    if args.command == "compact":
+        counts = compact(db_path=args.db)
+        print(f"✅ Moved {counts['moved']}, indexed {counts['indexed']}, dropped {counts['dropped']} missing, "
+              f"removed {counts['tmp_removed']} stale temp files")
+    else:
+        expired = apply_retention(args.days or None, args.keep or None, args.dry_run, db_path=args.db)
+        freed = sum(e["bytes"] for e in expired)
+        verb = "Would delete" if args.dry_run else "Deleted"
+        print(f"✅ {verb} {len(expired)} reports ({freed / 1e6:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+# sample_inputs.py
+# Random rows shaped like the Diagnosis page input, shared by the benchmarks,
+# the load generator and the tests.
+#
+#   from sample_inputs import random_rows
+#   df = random_rows(1000, seed=1)
+
+import numpy as np
+import pandas as pd
+
+from core_utils import ALL_FEATURES, SYMPTOMS
+
+
+def random_rows(n, seed=0):
+    """Rows shaped like the Diagnosis page input (integers, one-decimal temp)."""
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "age": rng.integers(0, 121, n),
+        "temp_c": np.round(rng.uniform(35.0, 41.0, n), 1),
+        "heart_rate": rng.integers(40, 160, n),
+        "spo2": rng.integers(80, 101, n),
+        "gender": rng.choice(["Male", "Female", "Other"], n),
+    })
+    for s in SYMPTOMS:
+        df[s] = (rng.random(n) < 0.2).astype(int)
+    return df[ALL_FEATURES]
@@ -0,0 +1,576 @@
+# storage.py
+# SQLite storage for users, prediction history and feedback.
+#
+# Replaces the whole-file users.json load/save: lookups go through the
+# username primary key / indexes, history and feedback are append-only
+# inserts, and every write is its own transaction (WAL mode), so concurrent
+# Streamlit sessions no longer overwrite each other.
+#
+# History is read a page at a time (get_history(..., before_id=cursor)) and
+# per-user totals live in user_stats / user_disease_counts, updated in the
+# same transaction as each insert, so neither page scans a user's history.
+#
+# The reports table indexes the PDFs in reports/<user>/ (see reports.py), so
+# listing, exporting or expiring a user's reports never lists the folder.
+#
+#   python storage.py --migrate           # one-shot import of users.json
+#   python storage.py --migrate-feedback  # one-shot import of feedback.txt
+#   python storage.py --bench             # predict-and-save cost vs history size
+
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DB_PATH = os.path.join(ROOT, "health.db")
+USERS_JSON = os.path.join(ROOT, "users.json")
+FEEDBACK_TXT = os.path.join(ROOT, "feedback.txt")
+
+# Legacy feedback.txt line: "<timestamp> - <username>: <text>"
+FEEDBACK_LINE = re.compile(r"^(\d{4}-\d{2}-\d{2} [\d:.]+) - ([^:]+): (.*)$")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    password TEXT NOT NULL,
+    email    TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS history (
+    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    username   TEXT NOT NULL,
+    timestamp  TEXT NOT NULL,
+    prediction TEXT NOT NULL,
+    model      TEXT NOT NULL,
+    symptoms   TEXT NOT NULL,
+    vitals     TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS history_by_user ON history (username, id);
+CREATE TABLE IF NOT EXISTS feedback (
+    id        INTEGER PRIMARY KEY AUTOINCREMENT,
+    username  TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    text      TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS feedback_by_user ON feedback (username, id);
+CREATE TABLE IF NOT EXISTS user_stats (
+    username        TEXT PRIMARY KEY,
+    total           INTEGER NOT NULL,
+    last_id         INTEGER NOT NULL,
+    last_timestamp  TEXT NOT NULL,
+    last_prediction TEXT NOT NULL,
+    last_vitals     TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS user_disease_counts (
+    username TEXT NOT NULL,
+    disease  TEXT NOT NULL,
+    n        INTEGER NOT NULL,
+    PRIMARY KEY (username, disease)
+);
+CREATE TABLE IF NOT EXISTS reports (
+    username TEXT NOT NULL,
+    name     TEXT NOT NULL,
+    bytes    INTEGER NOT NULL,
+    created  TEXT NOT NULL,
+    PRIMARY KEY (username, name)
+);
+CREATE INDEX IF NOT EXISTS reports_by_created ON reports (created);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+_local = threading.local()
+_lock = threading.Lock()
+_ready = set()  # db paths whose schema and WAL mode are set up
+_open = {}      # db path -> [(owner thread, connection)]
+_generation = {}  # db path -> number of close() calls; cached connections of older ones are closed
+
+
+# -------------------------------
+# Connections
+# -------------------------------
+def connect(db_path=None):
+    """Return this thread's connection to db_path.
+
+    Streamlit runs every rerun in a new thread, so a thread's first call
+    takes over the connection of a thread that has exited, if any, and the
+    schema is only created the first time a database is opened. A connection
+    cached before close(db_path) is replaced, whichever thread closed it.
+    """
+    db_path = db_path or DB_PATH
+    conns = _local.__dict__.setdefault("conns", {})
+    cached = conns.get(db_path)
+    if cached is None or cached[1] != _generation.get(db_path, 0):
+        cached = conns[db_path] = _acquire(db_path)
+    return cached[0]
+
+
+def _acquire(db_path):
+    """(connection, generation) for the calling thread."""
+    me = threading.current_thread()
+    with _lock:
+        generation = _generation.get(db_path, 0)
+        owners = _open.setdefault(db_path, [])
+        for i, (thread, conn) in enumerate(owners):
+            if not thread.is_alive():
+                owners[i] = (me, conn)
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                return conn, generation
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA synchronous=NORMAL")
+    with _lock:
+        if db_path not in _ready:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            _ready.add(db_path)
+        _open.setdefault(db_path, []).append((me, conn))
+        generation = _generation.get(db_path, 0)
+    return conn, generation
+
+
+def close(db_path=None):
+    """Close every connection to db_path, e.g. before deleting the file.
+    No other thread may be using it; each thread's next connect() opens a
+    new connection."""
+    db_path = db_path or DB_PATH
+    with _lock:
+        for _, conn in _open.pop(db_path, []):
+            conn.close()
+        _ready.discard(db_path)
+        _generation[db_path] = _generation.get(db_path, 0) + 1
+
+
+@contextlib.contextmanager
+def _transaction(conn):
+    """BEGIN IMMEDIATE ... COMMIT, rolled back on error."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def init_db(db_path=None, users_json=None, feedback_txt=None):
+    """Create the schema and import users.json / feedback.txt once if they exist."""
+    conn = connect(db_path)
+    users_json = users_json or USERS_JSON
+    feedback_txt = feedback_txt or FEEDBACK_TXT
+    if os.path.exists(users_json) and get_meta("users_json_migrated", db_path) is None:
+        migrate_users_json(users_json, db_path)
+    if os.path.exists(feedback_txt) and get_meta("feedback_txt_migrated", db_path) is None:
+        migrate_feedback_txt(feedback_txt, db_path)
+    if get_meta("user_stats_built", db_path) is None:
+        rebuild_stats(db_path)
+    return conn
+
+
+def get_meta(key, db_path=None):
+    row = connect(db_path).execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row["value"] if row else None
+
+
+def set_meta(key, value, db_path=None):
+    with _transaction(connect(db_path)) as conn:
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+
+def setdefault_meta(key, value, db_path=None):
+    """Store value under key unless one is already there; returns the stored value."""
+    with _transaction(connect(db_path)) as conn:
+        conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+    return get_meta(key, db_path)
+
+
+# -------------------------------
+# Users
+# -------------------------------
+def get_user(username, db_path=None):
+    """Return {"username", "password", "email"} or None."""
+    row = connect(db_path).execute(
+        "SELECT username, password, email FROM users WHERE username = ?", (username,)
+    ).fetchone()
+    return dict(row) if row else None
+
+
+def create_user(username, password_hash, email="", db_path=None):
+    """Insert a user; returns False if the username is already taken."""
+    try:
+        with _transaction(connect(db_path)) as conn:
+            conn.execute(
+                "INSERT INTO users (username, password, email) VALUES (?, ?, ?)",
+                (username, password_hash, email or ""),
+            )
+    except sqlite3.IntegrityError:
+        return False
+    return True
+
+
+# -------------------------------
+# History
+# -------------------------------
+def _history_row(row):
+    return {
+        "id": row["id"],
+        "timestamp": row["timestamp"],
+        "prediction": row["prediction"],
+        "symptoms": json.loads(row["symptoms"]),
+        "model": row["model"],
+        "vitals": json.loads(row["vitals"]),
+    }
+
+
+def _count_record(conn, username, history_id, timestamp, prediction, vitals):
+    conn.execute(
+        """INSERT INTO user_stats (username, total, last_id, last_timestamp, last_prediction, last_vitals)
+           VALUES (?, 1, ?, ?, ?, ?)
+           ON CONFLICT (username) DO UPDATE SET
+               total = total + 1, last_id = excluded.last_id, last_timestamp = excluded.last_timestamp,
+               last_prediction = excluded.last_prediction, last_vitals = excluded.last_vitals""",
+        (username, history_id, timestamp, prediction, vitals),
+    )
+    conn.execute(
+        """INSERT INTO user_disease_counts (username, disease, n) VALUES (?, ?, 1)
+           ON CONFLICT (username, disease) DO UPDATE SET n = n + 1""",
+        (username, prediction),
+    )
+
+
+def add_history(username, record, db_path=None):
+    """Append one prediction record (timestamp, prediction, symptoms, model,
+    vitals) and update the user's counters in the same transaction."""
+    timestamp = str(record.get("timestamp") or datetime.datetime.now())
+    prediction = str(record["prediction"])
+    vitals = json.dumps(record.get("vitals", {}))
+    with _transaction(connect(db_path)) as conn:
+        cur = conn.execute(
+            "INSERT INTO history (username, timestamp, prediction, model, symptoms, vitals) VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                username,
+                timestamp,
+                prediction,
+                str(record.get("model", "")),
+                json.dumps(record.get("symptoms", [])),
+                vitals,
+            ),
+        )
+        _count_record(conn, username, cur.lastrowid, timestamp, prediction, vitals)
+
+
+def get_history(username, limit=10, before_id=None, db_path=None):
+    """Return up to limit of the user's records, newest first.
+
+    Pass the "id" of the last record of a page as before_id to get the next,
+    older page; each page is one range scan of the (username, id) index.
+    """
+    if before_id is None:
+        rows = connect(db_path).execute(
+            "SELECT * FROM history WHERE username = ? ORDER BY id DESC LIMIT ?", (username, limit)
+        ).fetchall()
+    else:
+        rows = connect(db_path).execute(
+            "SELECT * FROM history WHERE username = ? AND id < ? ORDER BY id DESC LIMIT ?",
+            (username, before_id, limit),
+        ).fetchall()
+    return [_history_row(r) for r in rows]
+
+
+def get_stats(username, db_path=None):
+    """Return {"total", "diseases": {disease: count} (most frequent first),
+    "last_timestamp", "last_prediction", "last_vitals"} from the counters."""
+    conn = connect(db_path)
+    row = conn.execute("SELECT * FROM user_stats WHERE username = ?", (username,)).fetchone()
+    if row is None:
+        return {"total": 0, "diseases": {}, "last_timestamp": None, "last_prediction": None, "last_vitals": {}}
+    diseases = conn.execute(
+        "SELECT disease, n FROM user_disease_counts WHERE username = ? ORDER BY n DESC, disease", (username,)
+    ).fetchall()
+    return {
+        "total": row["total"],
+        "diseases": {r["disease"]: r["n"] for r in diseases},
+        "last_timestamp": row["last_timestamp"],
+        "last_prediction": row["last_prediction"],
+        "last_vitals": json.loads(row["last_vitals"]),
+    }
+
+
+def count_history(username, db_path=None):
+    row = connect(db_path).execute("SELECT total FROM user_stats WHERE username = ?", (username,)).fetchone()
+    return row["total"] if row else 0
+
+
+def _rebuild_stats(conn):
+    """Recompute every user's counters from the history table (inside a transaction)."""
+    conn.execute("DELETE FROM user_stats")
+    conn.execute("DELETE FROM user_disease_counts")
+    conn.execute(
+        """INSERT INTO user_disease_counts (username, disease, n)
+           SELECT username, prediction, COUNT(*) FROM history GROUP BY username, prediction"""
+    )
+    conn.execute(
+        """INSERT INTO user_stats (username, total, last_id, last_timestamp, last_prediction, last_vitals)
+           SELECT h.username, c.total, h.id, h.timestamp, h.prediction, h.vitals
+           FROM (SELECT username, COUNT(*) AS total, MAX(id) AS last_id FROM history GROUP BY username) AS c
+           JOIN history AS h ON h.id = c.last_id"""
+    )
+    conn.execute(
+        "INSERT OR REPLACE INTO meta (key, value) VALUES ('user_stats_built', ?)",
+        (str(datetime.datetime.now()),),
+    )
+
+
+def rebuild_stats(db_path=None):
+    """Backfill the counters, e.g. for a database created before they existed."""
+    with _transaction(connect(db_path)) as conn:
+        _rebuild_stats(conn)
+
+
+def iter_history(db_path=None, after_id=0, username=None):
+    """Yield every user's (or one user's) records with id > after_id, oldest
+    first (for offline reports, exports and retraining)."""
+    if username is None:
+        rows = connect(db_path).execute("SELECT * FROM history WHERE id > ? ORDER BY id", (after_id,))
+    else:
+        rows = connect(db_path).execute(
+            "SELECT * FROM history WHERE username = ? AND id > ? ORDER BY id", (username, after_id)
+        )
+    for row in rows:
+        yield dict(_history_row(row), username=row["username"])
+
+
+# -------------------------------
+# Report index
+# -------------------------------
+def add_report(username, name, size, created=None, db_path=None):
+    """Record (or refresh) the report file reports/<user>/<name>."""
+    with _transaction(connect(db_path)) as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO reports (username, name, bytes, created) VALUES (?, ?, ?, ?)",
+            (username, name, size, str(created or datetime.datetime.now())),
+        )
+
+
+def list_reports(username=None, db_path=None):
+    """[{"username", "name", "bytes", "created"}] of one user (newest first)
+    or of everyone (by user, newest first)."""
+    if username is None:
+        rows = connect(db_path).execute("SELECT * FROM reports ORDER BY username, created DESC")
+    else:
+        rows = connect(db_path).execute(
+            "SELECT * FROM reports WHERE username = ? ORDER BY created DESC", (username,)
+        )
+    return [dict(r) for r in rows]
+
+
+def expired_reports(before=None, keep_per_user=None, db_path=None):
+    """Reports created before `before` or beyond the newest keep_per_user of
+    their user."""
+    before = None if before is None else str(before)
+    rows = connect(db_path).execute(
+        """SELECT username, name, bytes, created FROM (
+               SELECT *, ROW_NUMBER() OVER (PARTITION BY username ORDER BY created DESC) AS rank FROM reports
+           ) WHERE (? IS NOT NULL AND created < ?) OR (? IS NOT NULL AND rank > ?)""",
+        (before, before, keep_per_user, keep_per_user),
+    ).fetchall()
+    return [dict(r) for r in rows]
+
+
+def delete_reports(entries, db_path=None):
+    """Drop index rows for [{"username", "name"}, ...]."""
+    with _transaction(connect(db_path)) as conn:
+        conn.executemany(
+            "DELETE FROM reports WHERE username = ? AND name = ?", [(e["username"], e["name"]) for e in entries]
+        )
+
+
+# -------------------------------
+# Feedback
+# -------------------------------
+def add_feedback(username, text, timestamp=None, db_path=None):
+    with _transaction(connect(db_path)) as conn:
+        conn.execute(
+            "INSERT INTO feedback (username, timestamp, text) VALUES (?, ?, ?)",
+            (username, str(timestamp or datetime.datetime.now()), text),
+        )
+
+
+def recent_feedback(username, k=5, db_path=None):
+    """Return the user's last k feedback entries, newest first.
+
+    Served by the (username, id) index, so the cost is O(k) whatever the
+    total amount of feedback, and usernames only match exactly.
+    """
+    rows = connect(db_path).execute(
+        "SELECT timestamp, text FROM feedback WHERE username = ? ORDER BY id DESC LIMIT ?", (username, k)
+    ).fetchall()
+    return [dict(r) for r in rows]
+
+
+# -------------------------------
+# Migration from users.json
+# -------------------------------
+def migrate_users_json(json_path=None, db_path=None):
+    """Import users and their history from the legacy users.json format.
+
+    Runs in one transaction and records itself in the meta table, so it is
+    applied at most once per database. Returns (users, history records).
+    """
+    json_path = json_path or USERS_JSON
+    with open(json_path, "r") as f:
+        users = json.load(f)
+
+    n_users = n_records = 0
+    with _transaction(connect(db_path)) as conn:
+        if conn.execute("SELECT 1 FROM meta WHERE key = 'users_json_migrated'").fetchone():
+            return 0, 0
+        for username, u in users.items():
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO users (username, password, email) VALUES (?, ?, ?)",
+                (username, u.get("password", ""), u.get("email") or ""),
+            )
+            n_users += cur.rowcount
+            for rec in u.get("history", []):
+                conn.execute(
+                    "INSERT INTO history (username, timestamp, prediction, model, symptoms, vitals) VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        username,
+                        str(rec.get("timestamp", "")),
+                        str(rec.get("prediction", "")),
+                        str(rec.get("model", "")),
+                        json.dumps(rec.get("symptoms", [])),
+                        json.dumps(rec.get("vitals", {})),
+                    ),
+                )
+                n_records += 1
+        _rebuild_stats(conn)
+        conn.execute(
+            "INSERT INTO meta (key, value) VALUES ('users_json_migrated', ?)",
+            (str(datetime.datetime.now()),),
+        )
+    return n_users, n_records
+
+
+def migrate_feedback_txt(txt_path=None, db_path=None):
+    """Import the legacy feedback.txt log once; returns (entries, skipped lines)."""
+    txt_path = txt_path or FEEDBACK_TXT
+    rows, skipped = [], 0
+    with open(txt_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line.strip():
+                continue
+            m = FEEDBACK_LINE.match(line)
+            if m is not None:
+                rows.append([m.group(2), m.group(1), m.group(3)])
+            elif rows:
+                # Multi-line feedback was written as-is; keep it with its entry.
+                rows[-1][2] += "\n" + line
+            else:
+                skipped += 1
+
+    with _transaction(connect(db_path)) as conn:
+        if conn.execute("SELECT 1 FROM meta WHERE key = 'feedback_txt_migrated'").fetchone():
+            return 0, 0
+        conn.executemany("INSERT INTO feedback (username, timestamp, text) VALUES (?, ?, ?)", rows)
+        conn.execute(
+            "INSERT INTO meta (key, value) VALUES ('feedback_txt_migrated', ?)",
+            (str(datetime.datetime.now()),),
+        )
+    return len(rows), skipped
+
+
+# -------------------------------
+# Benchmark
+# -------------------------------
+def benchmark(sizes=(0, 1000, 10000, 50000), repeat=10):
+    """Time one predict-and-save against users.json and SQLite, and one
+    History page (an older page, via the cursor) and Profile summary, as
+    history grows."""
+    record = {
+        "timestamp": str(datetime.datetime.now()),
+        "prediction": "Flu",
+        "symptoms": ["fever", "cough"],
+        "model": "Random Forest",
+        "vitals": {"age": 25, "temp_c": 38.5, "heart_rate": 80, "spo2": 97, "gender": "Male"},
+    }
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            json_path = os.path.join(tmp, f"users_{size}.json")
+            db_path = os.path.join(tmp, f"health_{size}.db")
+            users = {"bench": {"password": "", "email": "", "history": [record] * size}}
+            with open(json_path, "w") as f:
+                json.dump(users, f, indent=4)
+            create_user("bench", "", db_path=db_path)
+            with _transaction(connect(db_path)) as conn:
+                conn.executemany(
+                    "INSERT INTO history (username, timestamp, prediction, model, symptoms, vitals) VALUES (?, ?, ?, ?, ?, ?)",
+                    [("bench", record["timestamp"], "Flu", "Random Forest", "[]", "{}")] * size,
+                )
+                _rebuild_stats(conn)
+
+            t0 = time.perf_counter()
+            for _ in range(repeat):
+                with open(json_path, "r") as f:
+                    users = json.load(f)
+                users["bench"]["history"].append(record)
+                with open(json_path, "w") as f:
+                    json.dump(users, f, indent=4)
+            json_ms = 1e3 * (time.perf_counter() - t0) / repeat
+
+            t0 = time.perf_counter()
+            for _ in range(repeat):
+                add_history("bench", record, db_path=db_path)
+            sqlite_ms = 1e3 * (time.perf_counter() - t0) / repeat
+
+            cursor = size // 2 + 1
+            t0 = time.perf_counter()
+            for _ in range(repeat):
+                get_history("bench", limit=10, before_id=cursor, db_path=db_path)
+            page_ms = 1e3 * (time.perf_counter() - t0) / repeat
+
+            t0 = time.perf_counter()
+            for _ in range(repeat):
+                get_stats("bench", db_path=db_path)
+            stats_ms = 1e3 * (time.perf_counter() - t0) / repeat
+
+            close(db_path)
+            results.append((size, json_ms, sqlite_ms, page_ms, stats_ms))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the SQLite user store.")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--migrate", nargs="?", const=USERS_JSON, metavar="USERS_JSON",
+                        help="import a users.json file into the database")
+    parser.add_argument("--migrate-feedback", nargs="?", const=FEEDBACK_TXT, metavar="FEEDBACK_TXT",
+                        help="import a feedback.txt log into the database")
+    parser.add_argument("--bench", action="store_true", help="benchmark predict-and-save")
+    args = parser.parse_args(argv)
+
+    if args.migrate:
+        n_users, n_records = migrate_users_json(args.migrate, args.db)
+        print(f"✅ Imported {n_users} users and {n_records} history records into {args.db}")
+    if args.migrate_feedback:
+        n_rows, skipped = migrate_feedback_txt(args.migrate_feedback, args.db)
+        print(f"✅ Imported {n_rows} feedback entries into {args.db} ({skipped} unparseable lines skipped)")
+    if args.bench:
+        print(f"{'history':>8}  {'users.json ms':>14}  {'sqlite ms':>10}  {'page ms':>8}  {'stats ms':>9}")
+        for size, json_ms, sqlite_ms, page_ms, stats_ms in benchmark():
+            print(f"{size:>8}  {json_ms:>14.2f}  {sqlite_ms:>10.3f}  {page_ms:>8.3f}  {stats_ms:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+# tests/test_explain.py
+# Contributions plus bias add up to the models' predicted probabilities.
+#
+#   python -m pytest tests/test_explain.py
+
+import numpy as np
+import pytest
+
+import explain
+import inference
+import model_registry as registry
+from sample_inputs import random_rows
+
+ATOL = 1e-9
+
+
+def _total(engine, rows):
+    bias, contrib = explain.contributions(engine, rows)
+    return bias + contrib.sum(axis=1)
+
+
+@pytest.mark.parametrize("model_name", list(inference.ENGINE_FILES))
+def test_batch_adds_up_to_predict_proba(model_name):
+    rows = random_rows(500, seed=11)
+    total = _total(explain.get_engine(model_name), rows)
+    np.testing.assert_allclose(total, registry.get_model(model_name).predict_proba(rows), atol=ATOL)
+
+
+@pytest.mark.parametrize("model_name", list(inference.ENGINE_FILES))
+def test_single_row_adds_up_to_predict_proba(model_name):
+    frame = random_rows(20, seed=12)
+    pipeline = registry.get_model(model_name)
+    engine = explain.get_engine(model_name)
+    for i, row in enumerate(frame.to_dict("records")):
+        total = _total(engine, row)
+        assert total.shape == (1, len(engine["classes"]))
+        np.testing.assert_allclose(total, pipeline.predict_proba(frame.iloc[[i]]), atol=ATOL)
+
+
+@pytest.mark.parametrize("model_name", list(inference.ENGINE_FILES))
+def test_explain_matches_prediction(model_name):
+    row = random_rows(1, seed=13).to_dict("records")[0]
+    out = explain.explain(model_name, row)[0]
+    proba = registry.get_model(model_name).predict_proba(random_rows(1, seed=13))[0]
+    classes = list(explain.get_engine(model_name)["classes"])
+    assert out["prediction"] == classes[int(np.argmax(proba))]
+    assert out["probability"] == pytest.approx(proba.max(), abs=ATOL)
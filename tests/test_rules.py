@@ -0,0 +1,63 @@
+# tests/test_rules.py
+# Single-row and batch safety rules agree, including on inputs that need casting.
+#
+#   python -m pytest tests/test_rules.py
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.utils import RULES, alert_messages, alert_text, evaluate_rules, simple_rule_flags
+from sample_inputs import random_rows
+
+LOW_SPO2, HIGH_FEVER, CHEST_PAIN_BREATH = (rule["message"] for rule in RULES[:3])
+
+EDGE_ROWS = [
+    ({"spo2": "91", "temp_c": "39.5", "chest_pain": "1.0", "shortness_of_breath": "1"},
+     [LOW_SPO2, HIGH_FEVER, CHEST_PAIN_BREATH]),
+    ({"chest_pain": 1.0, "shortness_of_breath": True}, [CHEST_PAIN_BREATH]),
+    ({"chest_pain": "1.9", "shortness_of_breath": 1}, [CHEST_PAIN_BREATH]),
+    # A bad value falls back to its own default; the other vitals still count.
+    ({"spo2": "", "temp_c": 40, "chest_pain": None, "shortness_of_breath": 1}, [HIGH_FEVER]),
+    ({"spo2": None, "temp_c": "hot", "chest_pain": 1, "shortness_of_breath": 1}, [CHEST_PAIN_BREATH]),
+    ({"spo2": 85, "chest_pain": float("nan"), "shortness_of_breath": 1}, [LOW_SPO2]),
+    ({"spo2": float("nan"), "temp_c": float("nan")}, []),
+    # Out of range values are compared as they are.
+    ({"spo2": -5, "temp_c": 1e6, "chest_pain": 2, "shortness_of_breath": 1}, [LOW_SPO2, HIGH_FEVER]),
+    ({"spo2": "1e400", "temp_c": "-inf"}, []),
+    ({}, []),
+]
+
+
+@pytest.mark.parametrize("row, expected", EDGE_ROWS)
+def test_single_row(row, expected):
+    assert simple_rule_flags(row) == expected
+
+
+def test_batch_matches_single_row():
+    frame = pd.DataFrame([row for row, _ in EDGE_ROWS])
+    masks = evaluate_rules(frame)
+    for (row, expected), mask in zip(EDGE_ROWS, masks):
+        assert alert_messages(mask) == expected == simple_rule_flags(row)
+
+
+def test_batch_matches_single_row_on_random_rows():
+    frame = random_rows(2000, seed=21)
+    texts = alert_text(evaluate_rules(frame))
+    for row, text in zip(frame.to_dict("records"), texts):
+        assert text == " | ".join(simple_rule_flags(row))
+
+
+def test_millions_of_rows():
+    n = 2_000_000
+    frame = random_rows(n, seed=22)
+    frame["chest_pain"] = 1  # make the two-clause rule fire often
+    masks = evaluate_rules(frame)
+    assert masks.shape == (n,)
+    expected = (
+        (frame["spo2"].to_numpy() < 92).astype(int)
+        | (frame["temp_c"].to_numpy() >= 39).astype(int) << 1
+        | (frame["shortness_of_breath"].to_numpy() == 1).astype(int) << 2
+    )
+    np.testing.assert_array_equal(masks.astype(int), expected)
+    assert len(alert_text(masks)) == n
@@ -0,0 +1,25 @@
+# tests/test_storage.py
+# Per-thread connections stay usable after close(), whichever thread called it.
+#
+#   python -m pytest tests/test_storage.py
+
+import threading
+
+import storage
+
+
+def test_close_from_another_thread(tmp_path):
+    db_path = str(tmp_path / "health.db")
+    storage.create_user("ana", "hash", db_path=db_path)
+    assert storage.connect(db_path).execute("SELECT COUNT(*) FROM users").fetchone()[0] == 1
+
+    closer = threading.Thread(target=storage.close, args=(db_path,))
+    closer.start()
+    closer.join()
+    (tmp_path / "health.db").unlink()
+
+    # This thread's cached connection was closed; connect() opens a new one
+    # and sets the schema up again on the fresh file.
+    conn = storage.connect(db_path)
+    assert conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 0
+    storage.close(db_path)
@@ -1,27 +1,58 @@
 # train_model.py
 # Run this after updating your dataset: python train_model.py
+#
+#   python train_model.py                                  # in memory, all cores
+#   python train_model.py --data big.parquet --out-of-core --sample-rows 200000
+#   python train_model.py --incremental --new-data new_cases.csv
+#   python train_model.py --incremental --from-history
+#
+# --out-of-core never holds the dataset in memory: the scaler is fitted over
+# streamed chunks and every tree of the forest is grown on its own random
+# subsample drawn while streaming (a few trees per pass over the file).
+#
+# The in-memory path is cached by content: the preprocessed train/test
+# matrices are stored as .npy files (memory-mapped on reuse) under a hash of
+# the dataset, feature list, split and preprocessing, and every fitted model
+# under that hash plus its estimator and hyperparameters. Unchanged inputs
+# reuse the cached artifacts, and an already installed model is not
+# rewritten. Every installed model gets a <name>_model.manifest.json with its
+# provenance and timings. --no-cache forces a full retrain.
+#
+# --incremental updates the saved forest instead of retraining: it keeps its
+# fitted preprocessor, grows --new-trees trees on the new rows only, retires
+# the oldest trees beyond --max-trees and saves the result as a new version
+# in models/versions/ before installing it as rf_model.joblib.
+
+import argparse
+import contextlib
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
 
-import pandas as pd
 import joblib
+import numpy as np
+import pandas as pd
+import sklearn
+from joblib import Parallel, delayed
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import OneHotEncoder, StandardScaler
 from sklearn.compose import ColumnTransformer
 from sklearn.pipeline import Pipeline
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.tree import DecisionTreeClassifier
-import os
+
+import tree_engine
+from model_registry import file_hash
 
 # -------------------------------
 # Paths
 # -------------------------------
 DATA_PATH = "data/symptoms_disease.csv"
 MODEL_DIR = "models"
-os.makedirs(MODEL_DIR, exist_ok=True)
-
-# -------------------------------
-# Load dataset
-# -------------------------------
-df = pd.read_csv(DATA_PATH)
 
 # Ensure proper columns
 TARGET = "disease"
@@ -35,53 +66,725 @@ SYMPTOMS = [
 ]
 ALL_FEATURES = NUMERIC_FEATURES + CATEGORICAL_FEATURES + SYMPTOMS
 
-# Ensure all required columns exist
-for col in ALL_FEATURES:
-    if col not in df.columns:
-        df[col] = 0
+# Compact dtypes: 0/1 symptoms as uint8, vitals as float32.
+DTYPES = {
+    **{s: np.uint8 for s in SYMPTOMS},
+    **{n: np.float32 for n in NUMERIC_FEATURES},
+    **{c: "category" for c in CATEGORICAL_FEATURES},
+    TARGET: "category",
+}
+
+TEST_SIZE = 0.2
+RANDOM_STATE = 42
+N_ESTIMATORS = 200
+
+
+# -------------------------------
+# Stage timing
+# -------------------------------
+try:
+    import resource  # Unix only
+except ImportError:
+    resource = None
+
+STAGES = []
+
+
+def peak_rss_mb():
+    """Peak RSS of this process so far, or None where it is not available (Windows)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and KiB elsewhere.
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Record wall time and peak RSS (so far) for a training stage."""
+    t0 = time.perf_counter()
+    yield
+    STAGES.append((name, time.perf_counter() - t0, peak_rss_mb()))
+
 
-# Drop missing target rows
-df = df.dropna(subset=[TARGET])
+def print_stages():
+    print(f"{'stage':<28}{'wall s':>10}{'peak RSS MB':>14}")
+    for name, seconds, peak_mb in STAGES:
+        peak = "-" if peak_mb is None else f"{peak_mb:.1f}"
+        print(f"{name:<28}{seconds:>10.2f}{peak:>14}")
 
-# Convert categorical gender to string
-df["gender"] = df["gender"].astype(str)
 
 # -------------------------------
-# Preprocessing & Split
+# Load dataset
 # -------------------------------
-X = df[ALL_FEATURES].copy()
-y = df[TARGET].copy()
+def _columns(path):
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(path).schema_arrow.names
+    return list(pd.read_csv(path, nrows=0).columns)
+
+
+def _prepare(df):
+    """Add missing feature columns, drop unlabeled rows, gender as str."""
+    for col in ALL_FEATURES:
+        if col not in df.columns:
+            df[col] = np.uint8(0)
+    df = df.dropna(subset=[TARGET])
+    df["gender"] = df["gender"].astype(str)
+    return df
+
+
+def iter_chunks(path, chunksize=500_000):
+    """Stream the dataset (CSV or Parquet) as prepared DataFrame chunks."""
+    present = [c for c in ALL_FEATURES + [TARGET] if c in _columns(path)]
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=present):
+            yield _prepare(batch.to_pandas().astype({c: DTYPES[c] for c in present}))
+    else:
+        dtypes = {c: DTYPES[c] for c in present}
+        for chunk in pd.read_csv(path, usecols=present, dtype=dtypes, chunksize=chunksize):
+            yield _prepare(chunk)
+
+
+def load_dataset(path=DATA_PATH):
+    """Read the whole dataset with compact dtypes."""
+    present = [c for c in ALL_FEATURES + [TARGET] if c in _columns(path)]
+    dtypes = {c: DTYPES[c] for c in present}
+    if path.endswith(".parquet"):
+        df = pd.read_parquet(path, columns=present).astype(dtypes)
+    else:
+        df = pd.read_csv(path, usecols=present, dtype=dtypes)
+    return _prepare(df)
 
-X_train, X_test, y_train, y_test = train_test_split(
-    X, y, test_size=0.2, random_state=42, stratify=y
-)
 
-preprocessor = ColumnTransformer([
-    ("num", StandardScaler(), NUMERIC_FEATURES),
-    ("cat", OneHotEncoder(handle_unknown="ignore", sparse_output=False), CATEGORICAL_FEATURES)
-], remainder="passthrough")
+def split_dataset(df):
+    """The held-out split every model in this repo is evaluated on."""
+    return train_test_split(
+        df[ALL_FEATURES], df[TARGET].astype(str),
+        test_size=TEST_SIZE, random_state=RANDOM_STATE, stratify=df[TARGET],
+    )
+
 
 # -------------------------------
-# Train Models
+# Models
 # -------------------------------
-rf_model = Pipeline([
-    ("preprocess", preprocessor),
-    ("clf", RandomForestClassifier(n_estimators=200, random_state=42))
-])
+def build_preprocessor(categories="auto"):
+    return ColumnTransformer([
+        ("num", StandardScaler(), NUMERIC_FEATURES),
+        ("cat", OneHotEncoder(categories=categories, handle_unknown="ignore", sparse_output=False), CATEGORICAL_FEATURES)
+    ], remainder="passthrough")
+
 
-dt_model = Pipeline([
-    ("preprocess", preprocessor),
-    ("clf", DecisionTreeClassifier(max_depth=8, random_state=42))
-])
+def build_models(n_jobs=-1):
+    preprocessor = build_preprocessor()
+    rf_model = Pipeline([
+        ("preprocess", preprocessor),
+        ("clf", RandomForestClassifier(n_estimators=N_ESTIMATORS, random_state=RANDOM_STATE, n_jobs=n_jobs))
+    ])
+    dt_model = Pipeline([
+        ("preprocess", preprocessor),
+        ("clf", DecisionTreeClassifier(max_depth=8, random_state=RANDOM_STATE))
+    ])
+    return rf_model, dt_model
+
+
+# -------------------------------
+# Training cache
+# -------------------------------
+CACHE_DIR = "cache"
+MATRICES = ("X_train", "X_test", "y_train", "y_test")
+# Parameters that change how a model is fitted, not what is fitted.
+UNKEYED_PARAMS = {"n_jobs", "verbose"}
+
+
+def _digest(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def data_key(data_path):
+    """Hash of the dataset content, feature list, split and preprocessing."""
+    return _digest(file_hash(data_path), ALL_FEATURES, TARGET, TEST_SIZE, RANDOM_STATE,
+                   repr(build_preprocessor()), sklearn.__version__)
+
+
+def model_params(clf):
+    return {k: v for k, v in clf.get_params().items() if k not in UNKEYED_PARAMS}
+
+
+def model_key(dkey, clf):
+    return _digest(dkey, type(clf).__name__, model_params(clf))
+
+
+def _write_atomic(path, write):
+    tmp = f"{path}.tmp"
+    write(tmp)
+    os.replace(tmp, path)
+
+
+def _write_json(path, obj):
+    def write(tmp):
+        with open(tmp, "w") as f:
+            json.dump(obj, f, indent=2, default=str)
+    _write_atomic(path, write)
+
+
+def prepare_matrices(data_path, cache_dir, dkey, use_cache=True):
+    """Fitted preprocessor, [X_train, X_test, y_train, y_test] and timings.
+
+    The matrices are transformed once per dataset key and then memory-mapped
+    from cache_dir/data-<key>/, so fitting another classifier neither reads
+    the CSV nor re-runs the preprocessor.
+    """
+    path = os.path.join(cache_dir, f"data-{dkey[:16]}")
+    if use_cache and os.path.exists(os.path.join(path, "preprocessor.joblib")):
+        t0 = time.perf_counter()
+        with stage("load cached matrices"):
+            preprocessor = joblib.load(os.path.join(path, "preprocessor.joblib"))
+            arrays = [np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in MATRICES]
+        return preprocessor, arrays, {"cached_matrices_s": time.perf_counter() - t0}
+
+    timings = {}
+    t0 = time.perf_counter()
+    with stage("load"):
+        df = load_dataset(data_path)
+    with stage("split"):
+        X_train, X_test, y_train, y_test = split_dataset(df)
+        del df
+    timings["load_split_s"] = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    with stage("transform"):
+        preprocessor = build_preprocessor().fit(X_train)
+        # The trees cast their input to float32 anyway, so the models are
+        # the same as when fitted through the pipeline.
+        arrays = [preprocessor.transform(X_train).astype(np.float32),
+                  preprocessor.transform(X_test).astype(np.float32),
+                  y_train.to_numpy(dtype=str), y_test.to_numpy(dtype=str)]
+    timings["transform_s"] = time.perf_counter() - t0
+
+    tmp = f"{path}.tmp{os.getpid()}"
+    os.makedirs(tmp, exist_ok=True)
+    for name, array in zip(MATRICES, arrays):
+        np.save(os.path.join(tmp, f"{name}.npy"), array)
+    joblib.dump(preprocessor, os.path.join(tmp, "preprocessor.joblib"))
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp, path)
+    return preprocessor, arrays, timings
+
+
+def cached_model_paths(cache_dir, name, key):
+    """(artifact, manifest) paths of a cached model."""
+    artifact = os.path.join(cache_dir, f"{name}-{key[:16]}.joblib")
+    return artifact, artifact[:-len(".joblib")] + ".json"
+
+
+def is_cached(cache_dir, name, key):
+    """A cached model is usable only with both its artifact and its manifest
+    (the manifest is written last, so an interrupted fit leaves none)."""
+    return all(os.path.exists(p) for p in cached_model_paths(cache_dir, name, key))
+
+
+def fit_cached(name, clf, preprocessor, arrays, dkey, cache_dir, provenance, use_cache=True):
+    """Fit clf on the prepared matrices, or load the model cached under the
+    same data and model key. Returns (pipeline, manifest, artifact path)."""
+    key = model_key(dkey, clf)
+    artifact, manifest_path = cached_model_paths(cache_dir, name, key)
+    if use_cache and is_cached(cache_dir, name, key):
+        with stage(f"load cached {name}"):
+            model = joblib.load(artifact)
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+        return model, manifest, artifact
+
+    X_train, X_test, y_train, y_test = arrays
+    t0 = time.perf_counter()
+    with stage(f"fit {name}"):
+        clf.fit(X_train, np.asarray(y_train, dtype=object))
+    fit_s = time.perf_counter() - t0
+    with stage(f"evaluate {name}"):
+        accuracy = clf.score(X_test, np.asarray(y_test, dtype=object))
+    if "n_jobs" in clf.get_params():
+        # Single-row predictions are faster without a worker pool.
+        clf.set_params(n_jobs=None)
+    model = Pipeline([("preprocess", preprocessor), ("clf", clf)])
+    _write_atomic(artifact, lambda tmp: joblib.dump(model, tmp))
+
+    manifest = {
+        "model": f"{name}_model.joblib",
+        "hash": file_hash(artifact),
+        "model_key": key,
+        "data_key": dkey,
+        **provenance,
+        "estimator": type(clf).__name__,
+        "params": model_params(clf),
+        "train_rows": int(X_train.shape[0]),
+        "test_rows": int(X_test.shape[0]),
+        "accuracy": float(accuracy),
+        "timings": {**provenance.get("timings", {}), "fit_s": fit_s},
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+    }
+    _write_json(manifest_path, manifest)
+    return model, manifest, artifact
+
+
+def train_in_memory(data_path, model_dir=MODEL_DIR, n_jobs=-1, use_cache=True):
+    """Fit (or reuse) both models; returns {name: (pipeline, manifest, cached artifact)}."""
+    cache_dir = os.path.join(model_dir, CACHE_DIR)
+    os.makedirs(cache_dir, exist_ok=True)
+    with stage("hash inputs"):
+        dkey = data_key(data_path)
+    rf_model, dt_model = build_models(n_jobs)
+    models = {"rf": rf_model.named_steps["clf"], "dt": dt_model.named_steps["clf"]}
+    keys = {name: model_key(dkey, clf) for name, clf in models.items()}
+    if use_cache and all(is_cached(cache_dir, n, k) for n, k in keys.items()):
+        preprocessor, arrays, timings = None, None, {}
+    else:
+        preprocessor, arrays, timings = prepare_matrices(data_path, cache_dir, dkey, use_cache)
+    provenance = {
+        "data": {"path": data_path, "sha256": file_hash(data_path)},
+        "features": ALL_FEATURES,
+        "target": TARGET,
+        "split": {"test_size": TEST_SIZE, "random_state": RANDOM_STATE},
+        "sklearn": sklearn.__version__,
+        "timings": timings,
+    }
+    return {
+        name: fit_cached(name, clf, preprocessor, arrays, dkey, cache_dir, provenance, use_cache)
+        for name, clf in models.items()
+    }
+
+
+def install_models(trained, model_dir=MODEL_DIR):
+    """Copy cached models into models/ with their manifests and tree engines,
+    skipping any whose installed file already has the same content."""
+    installed = []
+    features = os.path.join(model_dir, "model_features.joblib")
+    if not os.path.exists(features) or joblib.load(features) != ALL_FEATURES:
+        joblib.dump(ALL_FEATURES, features)
+    for name, (model, manifest, artifact) in trained.items():
+        target = os.path.join(model_dir, f"{name}_model.joblib")
+        if os.path.exists(target) and file_hash(target) == manifest["hash"]:
+            continue
+        _write_atomic(target, lambda tmp: shutil.copyfile(artifact, tmp))
+        _write_json(os.path.join(model_dir, f"{name}_model.manifest.json"), manifest)
+        engine = tree_engine.export_pipeline(model, ALL_FEATURES)
+        engine["source_hash"] = manifest["hash"]
+        joblib.dump(engine, os.path.join(model_dir, f"{name}_engine.joblib"))
+        installed.append(name)
+    return installed
+
+
+# -------------------------------
+# Out-of-core training
+# -------------------------------
+# Training rows the ColumnTransformer is fitted on for its structure.
+PREPROCESSOR_FIT_ROWS = 1000
+
+
+def _is_test(chunk, start):
+    """Deterministic ~TEST_SIZE held-out rows, keyed on the global row number."""
+    rows = np.arange(start, start + len(chunk), dtype=np.uint64)
+    return (rows * np.uint64(2654435761) % np.uint64(1000)) < TEST_SIZE * 1000
+
+
+def _fit_tree(X, y, n_classes, params, seed):
+    # One zero-weight anchor row per class keeps every tree's class axis at
+    # n_classes, so the trees can be averaged as one forest.
+    anchors = np.zeros((n_classes, X.shape[1]), dtype=X.dtype)
+    X = np.vstack([X, anchors])
+    y = np.concatenate([y, np.arange(n_classes)])
+    weight = np.concatenate([np.ones(len(X) - n_classes), np.zeros(n_classes)])
+    tree = DecisionTreeClassifier(random_state=seed, **params)
+    return tree.fit(X, y, sample_weight=weight)
+
+
+def assemble_forest(trees, classes, n_features, **params):
+    """Wrap independently grown trees as a fitted RandomForestClassifier."""
+    rf = RandomForestClassifier(n_estimators=len(trees), **params)
+    rf.estimators_ = list(trees)
+    rf.estimator_ = DecisionTreeClassifier()
+    rf.classes_ = np.asarray(classes)
+    rf.n_classes_ = len(classes)
+    rf.n_outputs_ = 1
+    rf.n_features_in_ = n_features
+    return rf
+
+
+def train_out_of_core(data_path, sample_rows=100_000, trees_per_pass=25, chunksize=500_000,
+                      n_estimators=N_ESTIMATORS, n_jobs=-1, max_test_rows=200_000):
+    rng = np.random.default_rng(RANDOM_STATE)
+
+    # Pass 1: class labels, categories, scaler statistics, held-out rows.
+    with stage("scan (pass 1)"):
+        scaler = StandardScaler()
+        classes, genders, n_train = set(), set(), 0
+        test_parts, fit_parts, start = [], [], 0
+        for chunk in iter_chunks(data_path, chunksize):
+            test = _is_test(chunk, start)
+            start += len(chunk)
+            train = chunk[~test]
+            if len(train):
+                scaler.partial_fit(train[NUMERIC_FEATURES].to_numpy(np.float64))
+            classes.update(train[TARGET].astype(str).unique())
+            genders.update(train["gender"].unique())
+            if n_train < PREPROCESSOR_FIT_ROWS:
+                fit_parts.append(train.iloc[:PREPROCESSOR_FIT_ROWS - n_train])
+            n_train += len(train)
+            if sum(len(p) for p in test_parts) < max_test_rows:
+                test_parts.append(chunk[test])
+        if n_train == 0:
+            raise ValueError(f"{data_path} has no training rows")
+        classes = np.array(sorted(classes))
+        test_df = pd.concat(test_parts).iloc[:max_test_rows]
+
+    # The ColumnTransformer is fitted on the first training rows for its
+    # structure; the scaler is then replaced by the one fitted on all of them.
+    preprocessor = build_preprocessor(categories=[sorted(genders)])
+    preprocessor.fit(pd.concat(fit_parts)[ALL_FEATURES])
+    preprocessor.transformers_[0] = ("num", scaler, NUMERIC_FEATURES)
+    class_index = {c: i for i, c in enumerate(classes)}
+    p = min(1.0, sample_rows / max(n_train, 1))
+
+    # Later passes: grow trees_per_pass trees per pass over the file.
+    tree_params = {"max_features": "sqrt"}
+    trees = []
+    for first in range(0, n_estimators, trees_per_pass):
+        group = range(first, min(first + trees_per_pass, n_estimators))
+        with stage(f"sample trees {group.start}-{group.stop - 1}"):
+            X_parts = {t: [] for t in group}
+            y_parts = {t: [] for t in group}
+            start = 0
+            for chunk in iter_chunks(data_path, chunksize):
+                train = chunk[~_is_test(chunk, start)]
+                start += len(chunk)
+                X = preprocessor.transform(train[ALL_FEATURES]).astype(np.float32)
+                y = train[TARGET].astype(str).map(class_index).to_numpy(np.int64)
+                for t in group:
+                    mask = rng.random(len(train)) < p
+                    X_parts[t].append(X[mask])
+                    y_parts[t].append(y[mask])
+        with stage(f"fit trees {group.start}-{group.stop - 1}"):
+            trees += Parallel(n_jobs=n_jobs, prefer="threads")(
+                delayed(_fit_tree)(np.concatenate(X_parts[t]), np.concatenate(y_parts[t]),
+                                   len(classes), tree_params, RANDOM_STATE + t)
+                for t in group
+            )
+            del X_parts, y_parts
+
+    rf_model = Pipeline([
+        ("preprocess", preprocessor),
+        ("clf", assemble_forest(trees, classes, len(preprocessor.get_feature_names_out()),
+                                random_state=RANDOM_STATE, **tree_params)),
+    ])
+
+    # The decision tree is shallow; one subsample is plenty.
+    with stage("fit dt"):
+        sample = []
+        start = 0
+        for chunk in iter_chunks(data_path, chunksize):
+            train = chunk[~_is_test(chunk, start)]
+            start += len(chunk)
+            sample.append(train[rng.random(len(train)) < p])
+        sample = pd.concat(sample)
+        dt_model = Pipeline([
+            ("preprocess", preprocessor),
+            ("clf", DecisionTreeClassifier(max_depth=8, random_state=RANDOM_STATE)),
+        ])
+        dt_model.named_steps["clf"].fit(preprocessor.transform(sample[ALL_FEATURES]), sample[TARGET].astype(str))
+        del sample
+
+    with stage("evaluate"):
+        X_test, y_test = test_df[ALL_FEATURES], test_df[TARGET].astype(str)
+        scores = {"rf": rf_model.score(X_test, y_test), "dt": dt_model.score(X_test, y_test)}
+    return rf_model, dt_model, scores
+
+
+# -------------------------------
+# Incremental update
+# -------------------------------
+VERSIONS_DIR = "versions"
+MANIFEST_FILE = "manifest.json"
+NEW_TREES = 25
+# Fewer new rows than this would replace whole trees with trees grown on a
+# handful of cases; --from-history waits until enough have accumulated.
+MIN_NEW_ROWS = 200
+
+
+def read_manifest(model_dir=MODEL_DIR):
+    path = os.path.join(model_dir, VERSIONS_DIR, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+def load_history_cases(db_path=None, after_id=0):
+    """Stored Diagnosis requests newer than after_id as a labeled frame.
+
+    The history has no confirmed diagnosis, so the label is the prediction
+    that was shown; prefer --new-data with real labels when available.
+    Returns (frame, id of the newest record read).
+    """
+    import storage
+
+    rows, last_id = [], after_id
+    for rec in storage.iter_history(db_path, after_id):
+        last_id = rec["id"]
+        vitals = rec.get("vitals") or {}
+        if all(f in vitals for f in ALL_FEATURES):
+            rows.append({**{f: vitals[f] for f in ALL_FEATURES}, TARGET: rec["prediction"]})
+    df = pd.DataFrame(rows, columns=ALL_FEATURES + [TARGET])
+    return _prepare(df.astype({c: DTYPES[c] for c in ALL_FEATURES + [TARGET]})), last_id
+
+
+def train_incremental(new_df, model_dir=MODEL_DIR, new_trees=NEW_TREES, max_trees=N_ESTIMATORS, n_jobs=-1,
+                      min_rows=MIN_NEW_ROWS):
+    """Add new_trees trees grown on new_df to the saved forest and keep the
+    newest max_trees. Cost depends on len(new_df) and new_trees only.
+
+    Returns (updated pipeline, info dict for the manifest). Raises
+    ValueError when fewer than min_rows rows have a label the forest knows.
+    """
+    with stage("load model"):
+        base = joblib.load(os.path.join(model_dir, "rf_model.joblib"))
+        preprocessor, forest = base.named_steps["preprocess"], base.named_steps["clf"]
+        classes = np.asarray(forest.classes_)
+
+    with stage("prepare new data"):
+        labels = new_df[TARGET].astype(str)
+        known = labels.isin(classes).to_numpy()
+        # Old trees cannot vote for a class they were never given.
+        unknown = sorted(set(labels[~known]))
+        X = preprocessor.transform(new_df.loc[known, ALL_FEATURES]).astype(np.float32)
+        y = np.searchsorted(classes, labels[known].to_numpy())
+        if len(y) < max(min_rows, 1):
+            raise ValueError(f"{len(y)} new rows with a known label, fewer than the minimum of {min_rows}")
+
+    rng = np.random.default_rng(len(forest.estimators_) + len(y))
+    params = {"max_features": forest.max_features, "max_depth": forest.max_depth,
+              "min_samples_leaf": forest.min_samples_leaf}
+    with stage(f"fit {new_trees} trees"):
+        seeds = rng.integers(2 ** 31, size=new_trees)
+        boots = [rng.integers(len(y), size=len(y)) for _ in range(new_trees)]
+        grown = Parallel(n_jobs=n_jobs, prefer="threads")(
+            delayed(_fit_tree)(X[b], y[b], len(classes), params, int(seed)) for b, seed in zip(boots, seeds)
+        )
+
+    # Sliding window: trees are kept oldest first, so retire from the front.
+    trees = list(forest.estimators_) + grown
+    retired = max(0, len(trees) - max_trees)
+    trees = trees[retired:]
+    rf = assemble_forest(trees, classes, forest.n_features_in_, random_state=forest.random_state, **params)
+    model = Pipeline([("preprocess", preprocessor), ("clf", rf)])
+    info = {
+        "rows": int(len(y)),
+        "skipped_unknown_labels": int((~known).sum()),
+        "unknown_labels": unknown,
+        "new_trees": new_trees,
+        "retired_trees": retired,
+        "trees": len(trees),
+    }
+    return model, info
+
+
+def _incremental_manifest(rf_model, entry, model_dir):
+    """rf_model.manifest.json for an incrementally updated forest. What the
+    original fit was trained on is kept under "base"; there is no cache key,
+    since the model is not in models/cache/."""
+    path = os.path.join(model_dir, "rf_model.manifest.json")
+    previous = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            previous = json.load(f)
+    base = previous.get("base") or {
+        k: previous[k] for k in ("hash", "model_key", "data_key", "data", "split", "train_rows", "accuracy")
+        if k in previous
+    }
+    clf = rf_model.named_steps["clf"]
+    return {
+        "model": "rf_model.joblib",
+        "hash": entry["hash"],
+        "model_key": None,
+        "base": base,
+        "features": ALL_FEATURES,
+        "target": TARGET,
+        "sklearn": sklearn.__version__,
+        "estimator": type(clf).__name__,
+        "params": model_params(clf),
+        "incremental": {k: entry[k] for k in ("version", "parent_hash", "source", "rows", "new_trees",
+                                              "retired_trees", "trees") if k in entry},
+        "accuracy": entry.get("accuracy_after"),
+        "created": entry["created"],
+    }
+
+
+def save_version(rf_model, info, model_dir=MODEL_DIR):
+    """Write rf_model as the next version, record it in the manifest and
+    install it as models/rf_model.joblib (with a fresh tree engine and
+    rf_model.manifest.json)."""
+    versions_dir = os.path.join(model_dir, VERSIONS_DIR)
+    os.makedirs(versions_dir, exist_ok=True)
+    manifest = read_manifest(model_dir)
+    current = os.path.join(model_dir, "rf_model.joblib")
+    version = manifest[-1]["version"] + 1 if manifest else 1
+    path = os.path.join(versions_dir, f"rf_model.v{version}.joblib")
+    joblib.dump(rf_model, path)
+
+    entry = {
+        "version": version,
+        "file": os.path.basename(path),
+        "hash": file_hash(path),
+        "parent_hash": file_hash(current) if os.path.exists(current) else None,
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        **info,
+    }
+    manifest.append(entry)
+    tmp = os.path.join(versions_dir, MANIFEST_FILE + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, os.path.join(versions_dir, MANIFEST_FILE))
+
+    # Install atomically; the registry and engine cache key on content hash.
+    tmp = current + ".tmp"
+    joblib.dump(rf_model, tmp)
+    os.replace(tmp, current)
+    installed_hash = file_hash(current)
+    engine = tree_engine.export_pipeline(rf_model, ALL_FEATURES)
+    engine["source_hash"] = installed_hash
+    joblib.dump(engine, os.path.join(model_dir, "rf_engine.joblib"))
+    _write_json(os.path.join(model_dir, "rf_model.manifest.json"),
+                _incremental_manifest(rf_model, {**entry, "hash": installed_hash}, model_dir))
+    return version, path
 
-rf_model.fit(X_train, y_train)
-dt_model.fit(X_train, y_train)
 
 # -------------------------------
 # Save Models and Feature Order
 # -------------------------------
-joblib.dump(rf_model, os.path.join(MODEL_DIR, "rf_model.joblib"))
-joblib.dump(dt_model, os.path.join(MODEL_DIR, "dt_model.joblib"))
-joblib.dump(ALL_FEATURES, os.path.join(MODEL_DIR, "model_features.joblib"))
+def save_models(rf_model, dt_model, model_dir=MODEL_DIR, provenance=None, scores=None):
+    """Write both pipelines, their tree engines and <name>_model.manifest.json
+    (provenance as in train_in_memory; these models are not in the cache)."""
+    os.makedirs(model_dir, exist_ok=True)
+    joblib.dump(rf_model, os.path.join(model_dir, "rf_model.joblib"))
+    joblib.dump(dt_model, os.path.join(model_dir, "dt_model.joblib"))
+    joblib.dump(ALL_FEATURES, os.path.join(model_dir, "model_features.joblib"))
+
+    # Export flat tree engines (used by the app for fast inference)
+    for name, model in [("rf", rf_model), ("dt", dt_model)]:
+        path = os.path.join(model_dir, f"{name}_model.joblib")
+        engine = tree_engine.export_pipeline(model, ALL_FEATURES)
+        engine["source_hash"] = file_hash(path)
+        joblib.dump(engine, os.path.join(model_dir, f"{name}_engine.joblib"))
+        clf = model.named_steps["clf"]
+        _write_json(os.path.join(model_dir, f"{name}_model.manifest.json"), {
+            "model": os.path.basename(path),
+            "hash": engine["source_hash"],
+            "model_key": None,
+            "data_key": None,
+            **(provenance or {}),
+            "estimator": type(clf).__name__,
+            "params": model_params(clf),
+            "accuracy": None if scores is None else float(scores[name]),
+            "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        })
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train the RF and DT diagnosis models.")
+    parser.add_argument("--data", default=DATA_PATH, help="CSV or Parquet dataset")
+    parser.add_argument("--model-dir", default=MODEL_DIR)
+    parser.add_argument("--n-jobs", type=int, default=-1, help="cores for forest fitting (-1 = all)")
+    parser.add_argument("--out-of-core", action="store_true",
+                        help="stream the dataset and grow each tree on its own subsample")
+    parser.add_argument("--sample-rows", type=int, default=100_000, help="rows per tree (--out-of-core)")
+    parser.add_argument("--trees-per-pass", type=int, default=25, help="trees sampled per pass (--out-of-core)")
+    parser.add_argument("--chunksize", type=int, default=500_000)
+    parser.add_argument("--incremental", action="store_true",
+                        help="update the saved forest with new rows instead of retraining")
+    parser.add_argument("--new-data", help="CSV or Parquet of new labeled rows (--incremental)")
+    parser.add_argument("--from-history", nargs="?", const="", metavar="DB",
+                        help="use Diagnosis history not yet trained on as new rows (--incremental)")
+    parser.add_argument("--new-trees", type=int, default=NEW_TREES, help="trees grown on the new rows")
+    parser.add_argument("--max-trees", type=int, default=N_ESTIMATORS, help="oldest trees beyond this are retired")
+    parser.add_argument("--min-rows", type=int, default=MIN_NEW_ROWS,
+                        help="refuse an update on fewer new rows than this (--incremental)")
+    parser.add_argument("--eval-data", help="labeled rows to score the old and new forest on")
+    parser.add_argument("--no-cache", action="store_true", help="retrain even if the inputs are unchanged")
+    args = parser.parse_args(argv)
+
+    if args.incremental:
+        if args.new_data:
+            new_df, cursor = load_dataset(args.new_data), None
+        elif args.from_history is not None:
+            after = next((v["history_cursor"] for v in reversed(read_manifest(args.model_dir))
+                          if v.get("history_cursor") is not None), 0)
+            new_df, cursor = load_history_cases(args.from_history or None, after)
+        else:
+            parser.error("--incremental needs --new-data or --from-history")
+        if new_df.empty:
+            print("Nothing new to train on.")
+            return
+        try:
+            rf_model, info = train_incremental(new_df, args.model_dir, args.new_trees, args.max_trees, args.n_jobs,
+                                               args.min_rows)
+        except ValueError as e:
+            # Nothing is saved, so --from-history picks these rows up again next time.
+            print(f"⚠️ Not updated: {e}.")
+            return
+        info["source"] = args.new_data or "history"
+        info["history_cursor"] = cursor
+        if args.eval_data:
+            with stage("evaluate"):
+                eval_df = load_dataset(args.eval_data)
+                X_eval, y_eval = eval_df[ALL_FEATURES], eval_df[TARGET].astype(str)
+                old = joblib.load(os.path.join(args.model_dir, "rf_model.joblib"))
+                info["accuracy_before"] = old.score(X_eval, y_eval)
+                info["accuracy_after"] = rf_model.score(X_eval, y_eval)
+        rf_model.named_steps["clf"].set_params(n_jobs=None)
+        with stage("save"):
+            version, path = save_version(rf_model, info, args.model_dir)
+        print_stages()
+        print(f"✅ Version {version}: +{info['new_trees']} trees on {info['rows']} rows, "
+              f"-{info['retired_trees']} oldest, {info['trees']} trees → {path}")
+        if info["skipped_unknown_labels"]:
+            print(f"⚠️ Skipped {info['skipped_unknown_labels']} rows with labels the forest does not know: "
+                  f"{', '.join(info['unknown_labels'])} (retrain from scratch to add classes)")
+        if "accuracy_after" in info:
+            print(f"Accuracy on {args.eval_data}: {info['accuracy_before']:.4f} → {info['accuracy_after']:.4f}")
+        return
+
+    if not args.out_of_core:
+        trained = train_in_memory(args.data, args.model_dir, args.n_jobs, use_cache=not args.no_cache)
+        with stage("save"):
+            installed = install_models(trained, args.model_dir)
+        print_stages()
+        scores = {name: manifest["accuracy"] for name, (_, manifest, _) in trained.items()}
+        print(f"Held-out accuracy: RF {scores['rf']:.4f}, DT {scores['dt']:.4f}")
+        if installed:
+            print(f"✅ Models trained and saved successfully ({', '.join(installed)} updated).")
+        else:
+            print("✅ Models already up to date; nothing rewritten.")
+        return
+
+    rf_model, dt_model, scores = train_out_of_core(
+        args.data, args.sample_rows, args.trees_per_pass, args.chunksize, n_jobs=args.n_jobs
+    )
+    provenance = {
+        "data": {"path": args.data, "sha256": file_hash(args.data)},
+        "features": ALL_FEATURES,
+        "target": TARGET,
+        # Rows are held out by a hash of their row number (_is_test), not train_test_split.
+        "split": {"test_size": TEST_SIZE, "method": "row hash"},
+        "sklearn": sklearn.__version__,
+        "out_of_core": {"sample_rows": args.sample_rows, "trees_per_pass": args.trees_per_pass},
+        "timings": {name: seconds for name, seconds, _ in STAGES},
+    }
+    with stage("save"):
+        save_models(rf_model, dt_model, args.model_dir, provenance, scores)
+
+    print_stages()
+    print(f"Held-out accuracy: RF {scores['rf']:.4f}, DT {scores['dt']:.4f}")
+    print("✅ Models trained and saved successfully.")
+
 
-print("✅ Models trained and saved successfully.")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,371 @@
+# tree_engine.py
+# Flat, array-based inference for the fitted tree pipelines in models/.
+#
+# export_pipeline() folds the ColumnTransformer (StandardScaler + OneHotEncoder
+# + passthrough) into the split thresholds of every tree, so prediction works
+# directly on raw feature values without pandas or sklearn at request time.
+# The exported dict only holds numpy arrays and plain Python objects, so it can
+# be saved with joblib and memory-mapped by model_registry.
+
+import time
+
+import numpy as np
+
+from core_utils import ALL_FEATURES
+
+# -------------------------------
+# Threshold folding
+# -------------------------------
+def _ordered(x):
+    """Map float64 values to int64 keys with the same ordering."""
+    bits = x.view(np.int64)
+    return np.where(bits >= 0, bits, np.int64(-(2 ** 63)) - bits)
+
+
+def _unordered(keys):
+    bits = np.where(keys >= 0, keys, np.int64(-(2 ** 63)) - keys)
+    return bits.view(np.float64)
+
+
+def _fold_thresholds(thr, mean, scale):
+    """Return the largest raw x for which the tree's test on the transformed
+    value still goes left.
+
+    sklearn computes z = (x - mean) / scale in float64, casts z to float32 and
+    tests z <= thr. That map is monotone in x, so the test is exactly
+    equivalent to x <= x_max; x_max is found by bisecting over float64 values.
+    """
+    thr = np.asarray(thr, dtype=np.float64)
+    mean = np.asarray(mean, dtype=np.float64)
+    scale = np.asarray(scale, dtype=np.float64)
+
+    def goes_left(x):
+        z = ((x - mean) / scale).astype(np.float32).astype(np.float64)
+        return z <= thr
+
+    guess = thr * scale + mean
+    width = (np.abs(thr) + 1.0) * scale * 1e-5 + np.abs(guess) * 1e-12
+    lo, hi = guess - width, guess + width
+    for _ in range(64):
+        bad_lo, bad_hi = ~goes_left(lo), goes_left(hi)
+        if not (bad_lo.any() or bad_hi.any()):
+            break
+        width = width * 2
+        lo = np.where(bad_lo, guess - width, lo)
+        hi = np.where(bad_hi, guess + width, hi)
+
+    lo_k, hi_k = _ordered(lo), _ordered(hi)
+    while True:
+        open_ = hi_k - lo_k > 1
+        if not open_.any():
+            break
+        mid_k = lo_k + (hi_k - lo_k) // 2
+        left = goes_left(_unordered(mid_k))
+        lo_k = np.where(open_ & left, mid_k, lo_k)
+        hi_k = np.where(open_ & ~left, mid_k, hi_k)
+    return _unordered(lo_k)
+
+
+def _column_map(preprocessor, features):
+    """Describe every transformed column in terms of the raw feature vector.
+
+    Returns one tuple per output column: ("num", raw_index, mean, scale) or
+    ("cat", raw_index, category_code).
+    """
+    columns = []
+    categories = {}
+    for name, trans, cols in preprocessor.transformers_:
+        if trans == "drop":
+            continue
+        idx = [c if isinstance(c, (int, np.integer)) else features.index(c) for c in cols]
+        # Fitted "passthrough" columns are stored as an identity FunctionTransformer.
+        if trans == "passthrough" or (type(trans).__name__ == "FunctionTransformer" and trans.func is None):
+            columns.extend(("num", i, 0.0, 1.0) for i in idx)
+        elif hasattr(trans, "scale_") or hasattr(trans, "mean_"):
+            mean = trans.mean_ if getattr(trans, "with_mean", True) else np.zeros(len(idx))
+            scale = trans.scale_ if getattr(trans, "with_std", True) else np.ones(len(idx))
+            columns.extend(("num", i, m, s) for i, m, s in zip(idx, mean, scale))
+        elif hasattr(trans, "categories_"):
+            if getattr(trans, "drop_idx_", None) is not None:
+                raise ValueError(f"OneHotEncoder '{name}' with drop= is not supported.")
+            for i, cats in zip(idx, trans.categories_):
+                categories[features[i]] = [str(c) for c in cats]
+                columns.extend(("cat", i, code) for code in range(len(cats)))
+        else:
+            raise ValueError(f"Unsupported transformer '{name}': {type(trans).__name__}")
+    return columns, categories
+
+
+# -------------------------------
+# Export
+# -------------------------------
+def export_pipeline(pipeline, features=None):
+    """Flatten a fitted Pipeline(preprocess, clf) into numpy node arrays.
+
+    Works for a DecisionTreeClassifier or a RandomForestClassifier. Nodes of
+    all trees share one set of arrays and a row moves to the right child when
+    lower < x <= upper:
+
+    - numeric splits use (folded threshold, +inf);
+    - one-hot splits go right only on their own category code c, which is
+      (c - 0.5, c + 0.5] since categories are encoded as integer codes;
+    - leaves point to themselves so every row can run max_depth steps.
+    """
+    features = list(features or ALL_FEATURES)
+    preprocessor = pipeline.named_steps["preprocess"]
+    clf = pipeline.named_steps["clf"]
+    trees = list(getattr(clf, "estimators_", [clf]))
+    columns, categories = _column_map(preprocessor, features)
+
+    feature, lower, upper, children, value, roots, depths = [], [], [], [], [], [], []
+    offset = 0
+    for est in trees:
+        t = est.tree_
+        n = t.node_count
+        is_leaf = t.children_left == -1
+        ids = np.arange(n) + offset
+
+        col = np.where(is_leaf, 0, t.feature)
+        raw = np.array([columns[c][1] for c in col], dtype=np.int64)
+        lo = np.full(n, np.inf)
+        hi = np.full(n, np.inf)
+
+        num = np.array([columns[c][0] == "num" for c in col]) & ~is_leaf
+        if num.any():
+            mean = np.array([columns[c][2] for c in col[num]], dtype=np.float64)
+            scale = np.array([columns[c][3] for c in col[num]], dtype=np.float64)
+            lo[num] = _fold_thresholds(t.threshold[num], mean, scale)
+
+        for i in np.flatnonzero(~num & ~is_leaf):
+            # The one-hot value is 1.0 for the node's category, 0.0 otherwise.
+            code, thr = columns[col[i]][2], np.float64(t.threshold[i])
+            if 0.0 <= thr < 1.0:
+                lo[i], hi[i] = code - 0.5, code + 0.5
+            elif thr < 0.0:
+                lo[i] = -np.inf
+
+        val = np.ascontiguousarray(t.value[:, 0, :], dtype=np.float64)
+        normalizer = val.sum(axis=1)[:, np.newaxis]
+        normalizer[normalizer == 0.0] = 1.0
+
+        left = np.where(is_leaf, ids, t.children_left + offset)
+        right = np.where(is_leaf, ids, t.children_right + offset)
+        feature.append(raw)
+        lower.append(lo)
+        upper.append(hi)
+        children.append(np.stack([left, right], axis=1).ravel().astype(np.int64))
+        value.append(val / normalizer)
+        roots.append(offset)
+        depths.append(t.max_depth)
+        offset += n
+
+    return {
+        "features": features,
+        "categories": categories,
+        "classes": np.asarray(clf.classes_),
+        "n_trees": len(trees),
+        "max_depth": int(max(depths)),
+        "feature": np.concatenate(feature),
+        "lower": np.concatenate(lower),
+        "upper": np.concatenate(upper),
+        "children": np.concatenate(children),
+        "value": np.concatenate(value),
+        "roots": np.asarray(roots, dtype=np.int64),
+        "depths": np.asarray(depths, dtype=np.int64),
+    }
+
+
+# -------------------------------
+# Prediction
+# -------------------------------
+def encode(engine, rows):
+    """Turn a dict, a list of dicts or a DataFrame into the raw float array.
+
+    Categorical values become their category code (-1 when unknown, which
+    matches OneHotEncoder(handle_unknown="ignore")). 2-D arrays are assumed
+    to be encoded already and are returned as float64.
+    """
+    if isinstance(rows, np.ndarray):
+        return np.asarray(rows, dtype=np.float64)
+    if isinstance(rows, dict):
+        rows = [rows]
+    features, categories = engine["features"], engine["categories"]
+    codes = {f: {c: float(i) for i, c in enumerate(cats)} for f, cats in categories.items()}
+    if hasattr(rows, "columns"):
+        X = np.empty((len(rows), len(features)))
+        for j, f in enumerate(features):
+            col = rows[f]
+            X[:, j] = col.astype(str).map(codes[f]).fillna(-1.0).to_numpy() if f in codes else col.to_numpy(dtype=np.float64)
+        return X
+    return np.array(
+        [[codes[f].get(str(r[f]), -1.0) if f in codes else r[f] for f in features] for r in rows],
+        dtype=np.float64,
+    )
+
+
+def apply(engine, X):
+    """Return the leaf index reached in every tree, shape (n_trees, n_rows)."""
+    X = np.ascontiguousarray(encode(engine, X))
+    n_rows, n_features = X.shape
+    flat = X.ravel()
+    feature, lower, upper = engine["feature"], engine["lower"], engine["upper"]
+    children = engine["children"]
+    base = np.tile(np.arange(n_rows, dtype=np.int64) * n_features, engine["n_trees"])
+    node = np.repeat(np.asarray(engine["roots"]), n_rows)
+    for _ in range(engine["max_depth"]):
+        x = flat[feature[node] + base]
+        go_right = (x > lower[node]) & (x <= upper[node])
+        node = children[2 * node + go_right]
+    return node.reshape(engine["n_trees"], n_rows)
+
+
+def node_values(engine, nodes):
+    """Class probabilities stored at nodes, as float64.
+
+    Engines written by compact_forest.py keep a deduplicated value table
+    (value_index maps node -> row) with probabilities quantized to integers
+    that value_scale maps back to [0, 1].
+    """
+    if "value_index" in engine:
+        nodes = engine["value_index"][nodes]
+    value = engine["value"][nodes]
+    if "value_scale" in engine:
+        return value * engine["value_scale"]
+    return value
+
+
+def _proba_per_tree(engine, X):
+    """Walk one tree at a time over all rows; faster for larger batches since
+    each tree only runs for its own depth and the working set stays small."""
+    n_rows = X.shape[0]
+    flat = np.ascontiguousarray(X.T).ravel()
+    rows = np.arange(n_rows, dtype=np.int64)
+    offsets = engine["feature"].astype(np.int64) * n_rows
+    lower, upper, children = engine["lower"], engine["upper"], engine["children"]
+    acc = np.zeros((n_rows, len(engine["classes"])))
+    for root, depth in zip(engine["roots"], engine["depths"]):
+        node = np.full(n_rows, root)
+        for _ in range(depth):
+            x = flat[offsets[node] + rows]
+            node = children[2 * node + ((x > lower[node]) & (x <= upper[node]))]
+        acc += node_values(engine, node)
+    return acc
+
+
+def predict_proba(engine, X):
+    """Class probabilities, identical to the source pipeline's predict_proba."""
+    X = encode(engine, X)
+    # Trees are summed in order, like sklearn's forest accumulator, so the
+    # result is bit-identical. Walking all trees at once wins for small
+    # batches; per-tree walking wins above a few hundred rows.
+    if X.shape[0] <= 256:
+        acc = np.cumsum(node_values(engine, apply(engine, X)), axis=0)[-1]
+    else:
+        acc = _proba_per_tree(engine, X)
+    return acc / engine["n_trees"]
+
+
+def predict(engine, X):
+    """Predicted class labels for a dict, list of dicts, DataFrame or array."""
+    return engine["classes"][np.argmax(predict_proba(engine, X), axis=1)]
+
+
+# -------------------------------
+# Several models in one walk
+# -------------------------------
+def stack(engines):
+    """Merge engines over the same features into one set of node arrays so
+    a single apply() walks every tree of every model."""
+    first = engines[0]
+    for e in engines[1:]:
+        if e["features"] != first["features"] or e["categories"] != first["categories"]:
+            raise ValueError("engines must share features and categories")
+    members, nodes, trees = [], 0, 0
+    feature, lower, upper, children, roots = [], [], [], [], []
+    for e in engines:
+        feature.append(e["feature"].astype(np.int64))
+        lower.append(e["lower"].astype(np.float64))
+        upper.append(e["upper"].astype(np.float64))
+        children.append(e["children"].astype(np.int64) + nodes)
+        roots.append(e["roots"].astype(np.int64) + nodes)
+        members.append({"engine": e, "trees": (trees, trees + e["n_trees"]), "node_offset": nodes})
+        nodes += len(e["feature"])
+        trees += e["n_trees"]
+    return {
+        "features": first["features"],
+        "categories": first["categories"],
+        "n_trees": trees,
+        "max_depth": max(e["max_depth"] for e in engines),
+        "feature": np.concatenate(feature),
+        "lower": np.concatenate(lower),
+        "upper": np.concatenate(upper),
+        "children": np.concatenate(children),
+        "roots": np.concatenate(roots),
+        "members": members,
+    }
+
+
+def predict_proba_stacked(stacked, X):
+    """List of class probabilities, one per stacked engine, each identical
+    to predict_proba() of that engine on its own."""
+    X = encode(stacked, X)
+    if X.shape[0] > 256:
+        return [predict_proba(m["engine"], X) for m in stacked["members"]]
+    leaves = apply(stacked, X)
+    out = []
+    for m in stacked["members"]:
+        start, stop = m["trees"]
+        values = node_values(m["engine"], leaves[start:stop] - m["node_offset"])
+        out.append(np.cumsum(values, axis=0)[-1] / m["engine"]["n_trees"])
+    return out
+
+
+# -------------------------------
+# Benchmark against sklearn
+# -------------------------------
+def _timeit(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return np.median(times)
+
+
+def benchmark(pipeline, df, features=None, repeat=50):
+    """Check exactness on df and time single-row and batch prediction."""
+    import pandas as pd
+
+    features = list(features or ALL_FEATURES)
+    engine = export_pipeline(pipeline, features)
+    X_df = df[features]
+    X_raw = encode(engine, X_df)
+
+    # Both the small-batch and the per-tree path must match sklearn exactly.
+    for part in (slice(0, 16), slice(None)):
+        ref = pipeline.predict_proba(X_df[part])
+        got = predict_proba(engine, X_raw[part])
+        if not np.array_equal(ref, got):
+            raise AssertionError(f"max abs diff {np.abs(ref - got).max()}")
+
+    row = X_df.iloc[0].to_dict()
+    batch = pd.concat([X_df] * max(1, 10000 // len(X_df)), ignore_index=True)
+    batch_raw = encode(engine, batch)
+    return {
+        "single_sklearn_ms": 1e3 * _timeit(lambda: pipeline.predict(pd.DataFrame([row])[features]), repeat),
+        "single_engine_ms": 1e3 * _timeit(lambda: predict(engine, row), repeat),
+        "batch_rows": len(batch),
+        "batch_sklearn_ms": 1e3 * _timeit(lambda: pipeline.predict(batch), 5),
+        "batch_engine_ms": 1e3 * _timeit(lambda: predict(engine, batch_raw), 5),
+    }
+
+
+if __name__ == "__main__":
+    import joblib
+    import pandas as pd
+
+    data = pd.read_csv("data/symptoms_disease.csv")
+    data["gender"] = data["gender"].astype(str)
+    for name in ["rf_model", "dt_model"]:
+        stats = benchmark(joblib.load(f"models/{name}.joblib"), data)
+        print(f"{name}: " + ", ".join(f"{k}={v:.3f}" if isinstance(v, float) else f"{k}={v}" for k, v in stats.items()))
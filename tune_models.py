@@ -0,0 +1,329 @@
+# tune_models.py
+# Hyperparameter search for the RF and DT models of train_model.py.
+#
+#   python tune_models.py                              # both models, 3 folds, all cores
+#   python tune_models.py --data big.csv --min-accuracy 0.95 --out tuning.json
+#   python tune_models.py --model dt --install         # fit and install the winner
+#
+# Every cross-validation fold of the training split is preprocessed once and
+# stored as .npy files under models/cache/folds-<hash>/ (keyed like the
+# training cache, so it is reused until the dataset changes). Worker processes
+# memory-map the folds read-only, so candidates never refit the
+# ColumnTransformer or copy the data.
+#
+# Search is successive halving: every candidate is fitted on a small slice of
+# each fold's training rows, the best 1/--eta move on to --eta times as many
+# rows, and so on until the full folds. Candidates are ordered by the goal,
+# the cheapest model that meets the accuracy floor: those above the floor by
+# inference cost (trees x depth, which is what tree_engine walks per row),
+# then the rest by accuracy. The finalists are refitted on the whole training
+# split and measured on the held-out split: accuracy, single-row p50 latency
+# through tree_engine and engine size.
+
+import argparse
+import itertools
+import json
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.model_selection import StratifiedKFold
+from sklearn.pipeline import Pipeline
+from sklearn.tree import DecisionTreeClassifier
+
+import train_model
+import tree_engine
+from sample_inputs import random_rows
+from compact_forest import LATENCY_CALLS, artifact_bytes, single_row_p50_ms
+from core_utils import ALL_FEATURES
+
+N_FOLDS = 3
+ETA = 3
+MIN_ROWS = 200
+FINALISTS = 5
+TOLERANCE = 0.01
+# Finalists this close to the fastest p50 count as equally fast.
+LATENCY_SLACK = 0.05
+
+ESTIMATORS = {"rf": RandomForestClassifier, "dt": DecisionTreeClassifier}
+GRIDS = {
+    "rf": {
+        "n_estimators": [10, 25, 50, 100, 200],
+        "max_depth": [4, 6, 8, 12, None],
+        "min_samples_leaf": [1, 5],
+    },
+    "dt": {
+        "max_depth": [4, 6, 8, 10, 12, None],
+        "min_samples_leaf": [1, 5, 20],
+        "criterion": ["gini", "entropy"],
+    },
+}
+
+
+# -------------------------------
+# Folds
+# -------------------------------
+def prepare_folds(data_path, n_folds=N_FOLDS, model_dir=train_model.MODEL_DIR):
+    """Directory holding fold<i>_{X,y}_{train,val}.npy for the training split.
+
+    Each fold's preprocessor is fitted on that fold's training rows only.
+    """
+    key = train_model._digest(train_model.data_key(data_path), n_folds)
+    path = os.path.join(model_dir, train_model.CACHE_DIR, f"folds-{key[:16]}")
+    if os.path.exists(os.path.join(path, "folds.json")):
+        return path
+
+    X_train, _, y_train, _ = train_model.split_dataset(train_model.load_dataset(data_path))
+    y = y_train.to_numpy(dtype=str)
+    tmp = f"{path}.tmp{os.getpid()}"
+    os.makedirs(tmp, exist_ok=True)
+    folds = StratifiedKFold(n_folds, shuffle=True, random_state=train_model.RANDOM_STATE)
+    for i, (fit_idx, val_idx) in enumerate(folds.split(X_train, y)):
+        preprocessor = train_model.build_preprocessor().fit(X_train.iloc[fit_idx])
+        arrays = {
+            "X_train": preprocessor.transform(X_train.iloc[fit_idx]).astype(np.float32),
+            "X_val": preprocessor.transform(X_train.iloc[val_idx]).astype(np.float32),
+            "y_train": y[fit_idx],
+            "y_val": y[val_idx],
+        }
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp, f"fold{i}_{name}.npy"), array)
+    with open(os.path.join(tmp, "folds.json"), "w") as f:
+        json.dump({"data": data_path, "folds": n_folds, "rows": len(y)}, f)
+    os.replace(tmp, path)
+    return path
+
+
+_folds = {}
+
+
+def _fold(fold_dir, i):
+    """Memory-mapped (X_train, y_train, X_val, y_val) of a fold, per process."""
+    key = (fold_dir, i)
+    if key not in _folds:
+        _folds[key] = tuple(
+            np.load(os.path.join(fold_dir, f"fold{i}_{name}.npy"), mmap_mode="r")
+            for name in ("X_train", "y_train", "X_val", "y_val")
+        )
+    return _folds[key]
+
+
+# -------------------------------
+# Candidates
+# -------------------------------
+def candidates(models=("rf", "dt"), grids=GRIDS):
+    """[(model, params)] for every point of each model's grid."""
+    out = []
+    for model in models:
+        grid = grids[model]
+        for values in itertools.product(*grid.values()):
+            out.append((model, dict(zip(grid, values))))
+    return out
+
+
+def make_estimator(model, params, n_jobs=None):
+    clf = ESTIMATORS[model](random_state=train_model.RANDOM_STATE, **params)
+    if model == "rf":
+        clf.set_params(n_jobs=n_jobs)
+    return clf
+
+
+def inference_cost(clf):
+    """Node visits per row in tree_engine: every tree runs max_depth steps."""
+    trees = getattr(clf, "estimators_", [clf])
+    return len(trees) * max(t.tree_.max_depth for t in trees)
+
+
+def _score(task):
+    """Fit one candidate on the first `rows` rows of one fold (worker side)."""
+    fold_dir, i, model, params, rows = task
+    X_train, y_train, X_val, y_val = _fold(fold_dir, i)
+    clf = make_estimator(model, params)
+    t0 = time.perf_counter()
+    clf.fit(X_train[:rows], y_train[:rows])
+    fit_s = time.perf_counter() - t0
+    return {
+        "accuracy": float(np.mean(clf.predict(X_val) == y_val)),
+        "fit_s": fit_s,
+        "cost": inference_cost(clf),
+        "nodes": int(sum(t.tree_.node_count for t in getattr(clf, "estimators_", [clf]))),
+    }
+
+
+def _order(results, floor):
+    """Indices of results, best first: above the floor by cost, then the
+    rest by accuracy."""
+    return sorted(range(len(results)), key=lambda i: (
+        (0, results[i]["cost"], -results[i]["accuracy"]) if results[i]["accuracy"] >= floor
+        else (1, -results[i]["accuracy"], results[i]["cost"])
+    ))
+
+
+def _floor(results, min_accuracy, tolerance):
+    if min_accuracy is not None:
+        return min_accuracy
+    return max(r["accuracy"] for r in results) - tolerance
+
+
+# -------------------------------
+# Search
+# -------------------------------
+def successive_halving(cands, fold_dir, n_jobs=None, eta=ETA, min_rows=MIN_ROWS, finalists=FINALISTS,
+                       min_accuracy=None, tolerance=TOLERANCE):
+    """Run the halving rounds; returns (finalist candidates, round log)."""
+    with open(os.path.join(fold_dir, "folds.json")) as f:
+        meta = json.load(f)
+    n_folds = meta["folds"]
+    full = min(len(_fold(fold_dir, i)[1]) for i in range(n_folds))
+    n_rounds = max(1, math.ceil(math.log(max(len(cands) / finalists, 1), eta)) + 1)
+    rows = max(min(min_rows, full), full // eta ** (n_rounds - 1))
+
+    log = []
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        while True:
+            t0 = time.perf_counter()
+            tasks = [(fold_dir, i, model, params, rows) for model, params in cands for i in range(n_folds)]
+            scores = list(pool.map(_score, tasks, chunksize=max(1, len(tasks) // (4 * (n_jobs or os.cpu_count())))))
+            results = []
+            for c in range(len(cands)):
+                per_fold = scores[c * n_folds:(c + 1) * n_folds]
+                results.append({
+                    key: float(np.mean([s[key] for s in per_fold])) for key in ("accuracy", "fit_s", "cost", "nodes")
+                })
+            floor = _floor(results, min_accuracy, tolerance)
+            order = _order(results, floor)
+            log.append({
+                "rows": rows, "candidates": len(cands), "floor": floor, "seconds": time.perf_counter() - t0,
+                "results": [{"model": cands[i][0], "params": cands[i][1], **results[i]} for i in order],
+            })
+            if rows >= full or len(cands) <= finalists:
+                keep = order[:finalists]
+                return [cands[i] for i in keep], log
+            keep = order[:max(finalists, math.ceil(len(cands) / eta))]
+            cands = [cands[i] for i in keep]
+            rows = min(full, rows * eta)
+
+
+def measure(finalists, data_path, model_dir=train_model.MODEL_DIR, n_jobs=-1):
+    """Refit the finalists on the full training split (cached matrices of
+    train_model) and measure them on the held-out split."""
+    cache_dir = os.path.join(model_dir, train_model.CACHE_DIR)
+    os.makedirs(cache_dir, exist_ok=True)
+    dkey = train_model.data_key(data_path)
+    preprocessor, (X_train, X_test, y_train, y_test), _ = train_model.prepare_matrices(data_path, cache_dir, dkey)
+    rows = random_rows(LATENCY_CALLS, seed=3).to_dict("records")
+    out = []
+    for model, params in finalists:
+        clf = make_estimator(model, params, n_jobs)
+        t0 = time.perf_counter()
+        clf.fit(X_train, np.asarray(y_train, dtype=object))
+        fit_s = time.perf_counter() - t0
+        if model == "rf":
+            clf.set_params(n_jobs=None)
+        engine = tree_engine.export_pipeline(Pipeline([("preprocess", preprocessor), ("clf", clf)]), ALL_FEATURES)
+        out.append({
+            "model": model,
+            "params": params,
+            "accuracy": float(np.mean(clf.predict(X_test) == np.asarray(y_test))),
+            "p50_ms": single_row_p50_ms(engine, rows),
+            "bytes": artifact_bytes(engine),
+            "cost": inference_cost(clf),
+            "fit_s": fit_s,
+        })
+    return out
+
+
+def choose(measured, min_accuracy=None, tolerance=TOLERANCE, slack=LATENCY_SLACK):
+    """Fastest candidate meeting the floor, or None. Timing noise should not
+    pick between equally fast models, so those within slack of the fastest
+    are decided by size, then inference cost."""
+    floor = _floor(measured, min_accuracy, tolerance)
+    fits = [m for m in measured if m["accuracy"] >= floor]
+    if not fits:
+        return None, floor
+    fastest = min(m["p50_ms"] for m in fits)
+    fits = [m for m in fits if m["p50_ms"] <= fastest * (1 + slack)]
+    return min(fits, key=lambda m: (m["bytes"], m["cost"], -m["accuracy"], json.dumps(m["params"]))), floor
+
+
+def install(best, data_path, model_dir=train_model.MODEL_DIR, n_jobs=-1):
+    """Fit the chosen candidate through the training cache and install it."""
+    cache_dir = os.path.join(model_dir, train_model.CACHE_DIR)
+    dkey = train_model.data_key(data_path)
+    preprocessor, arrays, timings = train_model.prepare_matrices(data_path, cache_dir, dkey)
+    provenance = {
+        "data": {"path": data_path, "sha256": train_model.file_hash(data_path)},
+        "features": ALL_FEATURES,
+        "target": train_model.TARGET,
+        "split": {"test_size": train_model.TEST_SIZE, "random_state": train_model.RANDOM_STATE},
+        "sklearn": train_model.sklearn.__version__,
+        "timings": timings,
+        "tuning": {"p50_ms": best["p50_ms"], "bytes": best["bytes"]},
+    }
+    clf = make_estimator(best["model"], best["params"], n_jobs)
+    trained = {best["model"]: train_model.fit_cached(best["model"], clf, preprocessor, arrays, dkey, cache_dir, provenance)}
+    return train_model.install_models(trained, model_dir)
+
+
+def _params(params):
+    return ", ".join(f"{k}={v}" for k, v in params.items())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tune the RF and DT models for accuracy, latency and size.")
+    parser.add_argument("--data", default=train_model.DATA_PATH, help="CSV or Parquet dataset")
+    parser.add_argument("--model-dir", default=train_model.MODEL_DIR)
+    parser.add_argument("--model", choices=sorted(ESTIMATORS), action="append",
+                        help="model to tune (repeatable, default both)")
+    parser.add_argument("--folds", type=int, default=N_FOLDS)
+    parser.add_argument("--eta", type=int, default=ETA, help="keep 1/eta of the candidates per round")
+    parser.add_argument("--min-rows", type=int, default=MIN_ROWS, help="training rows per fold in the first round")
+    parser.add_argument("--finalists", type=int, default=FINALISTS, help="candidates measured per model")
+    parser.add_argument("--min-accuracy", type=float, help="accuracy floor (default best minus --tolerance)")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    parser.add_argument("--n-jobs", type=int, help="worker processes (default all cores)")
+    parser.add_argument("--out", help="write every round and measurement as JSON")
+    parser.add_argument("--install", action="store_true", help="fit and install the chosen model(s)")
+    args = parser.parse_args(argv)
+
+    t0 = time.perf_counter()
+    fold_dir = prepare_folds(args.data, args.folds, args.model_dir)
+    print(f"Folds ready in {time.perf_counter() - t0:.2f}s → {fold_dir}")
+
+    report = {"data": args.data, "folds": args.folds, "models": {}}
+    for model in args.model or sorted(ESTIMATORS):
+        cands = candidates([model])
+        finalists, log = successive_halving(
+            cands, fold_dir, args.n_jobs, args.eta, args.min_rows, args.finalists, args.min_accuracy, args.tolerance
+        )
+        for r in log:
+            print(f"{model}: {r['candidates']:>3} candidates on {r['rows']:>7,} rows/fold in {r['seconds']:.2f}s, "
+                  f"floor {r['floor']:.4f}, best {r['results'][0]['accuracy']:.4f}")
+        measured = measure(finalists, args.data, args.model_dir)
+        best, floor = choose(measured, args.min_accuracy, args.tolerance)
+
+        print(f"{'accuracy':>10}{'p50 ms':>9}{'bytes':>11}{'fit s':>8}  params")
+        for m in sorted(measured, key=lambda m: (-m["accuracy"], m["p50_ms"])):
+            mark = "*" if m is best else " "
+            print(f"{m['accuracy']:>10.4f}{m['p50_ms']:>9.3f}{m['bytes']:>11,}{m['fit_s']:>8.2f} {mark}{_params(m['params'])}")
+        report["models"][model] = {"rounds": log, "finalists": measured, "floor": floor, "best": best}
+        if best is None:
+            print(f"❌ {model}: no finalist reaches accuracy {floor:.4f}")
+            continue
+        print(f"✅ {model}: {_params(best['params'])} (accuracy {best['accuracy']:.4f}, "
+              f"p50 {best['p50_ms']:.3f} ms, {best['bytes']:,} bytes)")
+        if args.install:
+            installed = install(best, args.data, args.model_dir)
+            print(f"✅ Installed {model}" if installed else f"✅ {model} already installed")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+        print(f"Results → {args.out}")
+
+
+if __name__ == "__main__":
+    main()